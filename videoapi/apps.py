@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class VideoapiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'videoapi'
+
+    def ready(self):
+        from django.core import checks
+        from . import signals  # noqa: F401
+        from .postprocess import check_asset_storage
+        checks.register(check_asset_storage)
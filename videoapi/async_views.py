@@ -0,0 +1,180 @@
+# videoapi/async_views.py
+# Native async views, served without blocking a thread per client under ASGI (videoproject/asgi.py).
+import asyncio
+import json
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.core.serializers.json import DjangoJSONEncoder
+from django.views.decorators.http import require_safe
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, AuthenticationFailed
+from .derivations import touch
+from .models import Job, Video
+from .serializers import JobSerializer
+from .streaming import serve_video
+
+FINISHED_STATES = (Job.SUCCESS, Job.FAILURE)
+
+
+@sync_to_async
+def authenticate(request):
+    try:
+        result = JWTAuthentication().authenticate(request)
+    except (InvalidToken, AuthenticationFailed):
+        return None
+    return result[0] if result else None
+
+
+def unauthorized():
+    return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+
+
+def check_share_token(pk, token):
+    # The error response for a share link token that does not grant access to video `pk`
+    serializer = URLSafeTimedSerializer('SECRET_KEY')
+    try:
+        data = serializer.loads(token, salt='share_video', max_age=3600)  # 1 hour validity
+        if data['video_id'] != pk:
+            return JsonResponse({'error': 'Invalid access'}, status=403)
+    except (SignatureExpired, BadSignature):
+        return JsonResponse({'error': 'Invalid or expired token'}, status=403)
+    return None
+
+
+@sync_to_async
+def shared_video_response(request, pk):
+    # Only the lookup and the response headers run on a thread, the body is read by the stream read pool
+    video = Video.objects.select_related('blob').filter(pk=pk).first()
+    if video is None:
+        return JsonResponse({'error': 'Not found'}, status=404)
+    touch(video)
+    return serve_video(request, video)
+
+
+@require_safe
+async def stream_video(request, pk, token):
+    """Playback of a signed share link, no login needed."""
+    return check_share_token(pk, token) or await shared_video_response(request, pk)
+
+
+@require_safe
+async def download_video(request, pk, token):
+    if await authenticate(request) is None:
+        return unauthorized()
+    return check_share_token(pk, token) or await shared_video_response(request, pk)
+
+
+@sync_to_async
+def job_payload(pk, user=None):
+    # With a user, only a job of their own, anybody else's is not found
+    jobs = Job.objects.select_related('video').filter(pk=pk)
+    if user is not None:
+        jobs = jobs.filter(owner=user)
+    job = jobs.first()
+    return JobSerializer(job).data if job else None
+
+
+class JobWatch:
+    """
+    One poller per job and event loop. Every client watching the same job waits
+    on a shared condition, so the database sees one query per poll interval per
+    job instead of one per connected client.
+    """
+    watches = {}
+
+    def __init__(self, pk):
+        self.pk = pk
+        self.payload = None
+        self.version = 0
+        self.listeners = 0
+        self.changed = asyncio.Condition()
+        self.task = None
+
+    @classmethod
+    def get(cls, pk):
+        key = (id(asyncio.get_running_loop()), pk)
+        watch = cls.watches.get(key)
+        if watch is None:
+            watch = cls.watches[key] = cls(pk)
+        if watch.task is None or watch.task.done():
+            watch.task = asyncio.ensure_future(watch.run(key))
+        return watch
+
+    async def run(self, key):
+        try:
+            while self.listeners or self.version == 0:
+                payload = await job_payload(self.pk)
+                if payload != self.payload:
+                    async with self.changed:
+                        self.payload = payload
+                        self.version += 1
+                        self.changed.notify_all()
+                if payload is None or payload['state'] in FINISHED_STATES:
+                    break
+                await asyncio.sleep(settings.JOB_EVENTS_POLL_INTERVAL)
+        finally:
+            if self.watches.get(key) is self:
+                del self.watches[key]
+
+    async def wait(self, version, timeout):
+        async with self.changed:
+            try:
+                await asyncio.wait_for(self.changed.wait_for(lambda: self.version != version), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.version, self.payload
+
+
+def sse(event, data):
+    return f'event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n'
+
+
+async def job_events(request, pk):
+    """Server-sent events stream of a job's progress, closed once the job finishes."""
+    user = await authenticate(request)
+    if user is None:
+        return unauthorized()
+    if await job_payload(pk, user) is None:
+        return JsonResponse({'detail': 'Not found.'}, status=404)
+
+    async def stream():
+        watch = JobWatch.get(pk)
+        watch.listeners += 1
+        version = 0
+        deadline = time.monotonic() + settings.JOB_EVENTS_TIMEOUT
+        try:
+            yield 'retry: 2000\n\n'
+            while time.monotonic() < deadline:
+                new_version, payload = await watch.wait(version, settings.JOB_EVENTS_HEARTBEAT)
+                if new_version == version:
+                    # Comment lines keep proxies from closing an idle connection
+                    yield ': keep-alive\n\n'
+                    continue
+                version = new_version
+                if payload is None:
+                    break
+                if payload['state'] in FINISHED_STATES:
+                    yield sse('done', payload)
+                    break
+                yield sse('progress', payload)
+        finally:
+            watch.listeners -= 1
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@require_safe
+async def job_detail(request, pk):
+    user = await authenticate(request)
+    if user is None:
+        return unauthorized()
+    payload = await job_payload(pk, user)
+    if payload is None:
+        return JsonResponse({'detail': 'Not found.'}, status=404)
+    return JsonResponse(payload)
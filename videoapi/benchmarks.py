@@ -0,0 +1,224 @@
+# videoapi/benchmarks.py
+# Media pipeline benchmarks. Every case runs in a forked child so wall time and
+# peak RSS (the Python process and the ffmpeg processes it starts) are measured
+# per case. Run them with `python manage.py benchmark_media`.
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import statistics
+import sys
+import time
+import numpy as np
+from imageio_ffmpeg import get_ffmpeg_version
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.db import connections
+from django.test import Client
+from itsdangerous import URLSafeTimedSerializer
+from rest_framework import serializers
+from .media import probe_streams
+from .models import Video
+from .serializers import VideoSerializer
+from .synthetic import CODECS, parse_size, generate_video
+from .tasks import trim_video_task, merge_videos_task
+
+RANGE_REQUESTS = 50
+RANGE_SIZE = 256 * 1024
+
+
+def _rss_mb(kilobytes):
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+    return round(kilobytes / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def _run_child(case, args, pipe):
+    try:
+        started = time.perf_counter()
+        metrics = case(*args)
+        metrics['wall_time'] = time.perf_counter() - started
+        metrics['peak_rss_mb'] = _rss_mb(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+        metrics['children_peak_rss_mb'] = _rss_mb(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+        pipe.send(metrics)
+    except Exception as exc:
+        pipe.send({'error': f'{type(exc).__name__}: {exc}'})
+    finally:
+        pipe.close()
+
+
+def measure(case, *args):
+    """Run `case(*args)` in a forked child and return its metrics plus wall time and peak RSS."""
+    context = multiprocessing.get_context('fork')
+    receiver, sender = context.Pipe(duplex=False)
+    # Children reconnect on their own, in-memory test databases are kept open by Django
+    connections.close_all()
+    process = context.Process(target=_run_child, args=(case, args, sender))
+    process.start()
+    sender.close()
+    try:
+        metrics = receiver.recv()
+    except EOFError:
+        metrics = {'error': f'benchmark process exited with {process.exitcode}'}
+    process.join()
+    return metrics
+
+
+def _rates(metrics, frames=None, size=None):
+    # Cases that prepare their input first report the time of the measured call separately
+    elapsed = metrics.get('call_time') or metrics['wall_time']
+    if frames is not None:
+        metrics['fps'] = round(frames / elapsed, 1) if elapsed else None
+    if size is not None:
+        metrics['mb_per_s'] = round(size / elapsed / 1e6, 1) if elapsed else None
+    return metrics
+
+
+def _output_frames(video_id):
+    video = Video.objects.get(pk=video_id)
+    return int((video.duration or 0) * (video.fps or 0))
+
+
+def bench_validate(path):
+    upload = TemporaryUploadedFile(os.path.basename(path), 'video/mp4', os.path.getsize(path), None)
+    with open(path, 'rb') as source:
+        shutil.copyfileobj(source, upload)
+    upload.seek(0)
+    started = time.perf_counter()
+    try:
+        VideoSerializer().validate_video_file(upload)
+        valid = True
+    except serializers.ValidationError:
+        # Synthetic inputs may fall outside the upload limits, the probe still ran
+        valid = False
+    return {'valid': valid, 'call_time': time.perf_counter() - started}
+
+
+def bench_trim(video_id, start, end, mode):
+    result = trim_video_task.apply(args=[video_id, start, end, mode]).get()
+    return {'frames': _output_frames(result['id'])}
+
+
+def bench_merge(video_ids):
+    result = merge_videos_task.apply(args=[video_ids]).get()
+    return {'frames': _output_frames(result['id'])}
+
+
+def bench_stream(video_id, size, seed=0):
+    client = Client()
+    token = URLSafeTimedSerializer('SECRET_KEY').dumps({'video_id': video_id}, salt='share_video')
+    url = f'/api/videos/stream/{video_id}/{token}/'
+
+    started = time.perf_counter()
+    response = client.get(url)
+    received = sum(len(chunk) for chunk in response.streaming_content)
+    full_time = time.perf_counter() - started
+
+    rng = np.random.default_rng(seed)
+    latencies = []
+    for first in rng.integers(0, max(size - RANGE_SIZE, 1), size=RANGE_REQUESTS):
+        started = time.perf_counter()
+        response = client.get(url, HTTP_RANGE=f'bytes={first}-{first + RANGE_SIZE - 1}')
+        b''.join(response.streaming_content)
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    return {
+        'bytes': received,
+        'full_mb_per_s': round(received / full_time / 1e6, 1) if full_time else None,
+        'range_p50_ms': round(latencies[len(latencies) // 2], 2),
+        'range_p95_ms': round(latencies[int(len(latencies) * 0.95) - 1], 2),
+    }
+
+
+def _video_for(path):
+    # Inputs are copied under MEDIA_ROOT/videos/ like an upload, rows for the same input share the copy
+    target = os.path.join(settings.MEDIA_ROOT, 'videos', os.path.basename(path))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if not os.path.exists(target):
+        shutil.copy(path, target)
+    return Video.objects.create(title=os.path.basename(path), video_file=os.path.relpath(target, settings.MEDIA_ROOT))
+
+
+def _repeat(name, input_name, repeat, case, *args, frames=None, size=None):
+    runs = [measure(case, *args) for _ in range(repeat)]
+    failures = [run for run in runs if 'error' in run]
+    if failures:
+        return {'case': name, 'input': input_name, 'error': failures[0]['error']}
+    # The median run is reported, plus the spread of the wall times
+    runs.sort(key=lambda run: run['wall_time'])
+    metrics = dict(runs[len(runs) // 2])
+    metrics['wall_time_min'] = runs[0]['wall_time']
+    metrics['wall_time_stdev'] = statistics.pstdev(run['wall_time'] for run in runs)
+    _rates(metrics, frames=metrics.get('frames', frames), size=size)
+    return {'case': name, 'input': input_name, **metrics}
+
+
+def run_suite(workdir, sizes=('360p',), codecs=('h264',), duration=10, repeat=3, cases=None, log=None):
+    """Generate the inputs under `workdir` and benchmark every case on each of them."""
+    log = log or (lambda message: None)
+    cases = set(cases or ('validate', 'trim', 'merge', 'stream'))
+    results = []
+    for size_name in sizes:
+        width, height = parse_size(size_name)
+        inputs = {}
+        for codec in codecs:
+            path = os.path.join(workdir, 'inputs', f'{size_name}_{codec}{CODECS[codec]["extension"]}')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            log(f'generating {os.path.basename(path)}')
+            started = time.perf_counter()
+            generate_video(path, width, height, duration=duration, codec=codec)
+            info = probe_streams(path)
+            inputs[codec] = path
+            frames = int(duration * (info['video']['fps'] or 25))
+            results.append(_rates({
+                'case': 'generate', 'input': os.path.basename(path), 'wall_time': time.perf_counter() - started,
+            }, frames=frames, size=os.path.getsize(path)))
+
+        for codec, path in inputs.items():
+            name, file_size = os.path.basename(path), os.path.getsize(path)
+            video = _video_for(path)
+            if 'validate' in cases:
+                log(f'validate {name}')
+                results.append(_repeat('validate_video_file', name, repeat, bench_validate, path, size=file_size))
+            if 'trim' in cases:
+                start, end = duration * 0.25, duration * 0.75
+                for mode in ('exact', 'fast'):
+                    log(f'trim {mode} {name}')
+                    results.append(_repeat(f'trim_video_task[{mode}]', name, repeat, bench_trim,
+                                           video.pk, start, end, mode))
+            if 'merge' in cases:
+                log(f'merge {name}')
+                results.append(_repeat('merge_videos_task[copy]', name, repeat, bench_merge,
+                                       [video.pk, _video_for(path).pk]))
+                others = [other for other in inputs if other != codec]
+                if others:
+                    mixed = [video.pk, _video_for(inputs[others[0]]).pk]
+                    results.append(_repeat('merge_videos_task[encode]', f'{name}+{others[0]}', repeat,
+                                           bench_merge, mixed))
+            if 'stream' in cases:
+                log(f'stream {name}')
+                results.append(_repeat('stream', name, repeat, bench_stream, video.pk, file_size, size=file_size))
+    return results
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'ffmpeg': get_ffmpeg_version(),
+    }
+
+
+def compare(results, baseline, threshold=0.1):
+    """Cases whose median wall time grew by more than `threshold` against a previous report."""
+    previous = {(entry['case'], entry['input']): entry for entry in baseline.get('results', [])}
+    regressions = []
+    for entry in results:
+        before = previous.get((entry['case'], entry['input']))
+        if not before or 'wall_time' not in entry or not before.get('wall_time'):
+            continue
+        change = entry['wall_time'] / before['wall_time'] - 1
+        if change > threshold:
+            regressions.append({'case': entry['case'], 'input': entry['input'], 'change': round(change, 3)})
+    return regressions
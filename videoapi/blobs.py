@@ -0,0 +1,107 @@
+# videoapi/blobs.py
+# Content-addressed storage: files are stored once per SHA-256 and reference counted.
+import hashlib
+import os
+import shutil
+from django.core.files import File
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from .models import Blob, Derivation, Video
+from .storage import local_path, seed_cache
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for data in iter(lambda: handle.read(CHUNK_SIZE), b''):
+            hasher.update(data)
+    return hasher.hexdigest()
+
+
+def blob_name(sha256, extension):
+    upload_to = Blob._meta.get_field('file').upload_to
+    return os.path.join(upload_to, sha256[:2], f'{sha256}{extension.lower()}')
+
+
+def ingest_file(path, sha256=None):
+    """
+    Move a finished local file into the blob store and take a reference on its
+    Blob. When the content is already stored, the new copy is deleted. Object
+    stores get an upload, and the local copy moves to the worker's cache.
+    """
+    storage = Blob._meta.get_field('file').storage
+    sha256 = sha256 or hash_file(path)
+    size = os.path.getsize(path)
+    for _ in range(3):
+        with transaction.atomic():
+            blob = Blob.objects.select_for_update().filter(sha256=sha256).first()
+            if blob is not None and storage.exists(blob.file.name):
+                os.remove(path)
+                Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+                blob.refresh_from_db()
+                return blob
+
+            name = blob.file.name if blob else blob_name(sha256, os.path.splitext(path)[1])
+            target = local_path(storage, name)
+            if target is not None:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.move(path, target)
+            else:
+                with open(path, 'rb') as handle:
+                    name = storage.save(name, File(handle))
+            if blob is not None:
+                # The row survived but its file went missing, the new copy restores it
+                Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+                blob.refresh_from_db()
+                if target is None:
+                    seed_cache(name, path)
+                return blob
+            try:
+                with transaction.atomic():
+                    blob = Blob.objects.create(sha256=sha256, file=name, size=size, ref_count=1)
+            except IntegrityError:
+                # Another request stored the same content first, take a reference on that instead.
+                # An uploaded object is left alone, it has the same name and bytes as the winner's
+                if target is not None:
+                    shutil.move(target, path)
+                continue
+            if target is None:
+                seed_cache(name, path)
+            return blob
+    raise IntegrityError(f'Could not store blob {sha256}')
+
+
+def _delete_unreferenced(blob_id):
+    blob = Blob.objects.select_for_update().filter(pk=blob_id, ref_count__lte=0).first()
+    if blob is None:
+        return False
+    blob.file.delete(save=False)
+    blob.delete()
+    return True
+
+
+def release_blob(blob_id):
+    """Drop one reference and delete the file once nothing points at it."""
+    with transaction.atomic():
+        Blob.objects.filter(pk=blob_id).update(ref_count=F('ref_count') - 1)
+        return _delete_unreferenced(blob_id)
+
+
+def reclaim_blobs():
+    """
+    Delete the blobs whose references were dropped without releasing them (bulk
+    deletes). A count that disagrees with the videos and cached outputs still
+    pointing at a blob is corrected instead. Returns the number of blobs deleted.
+    """
+    reclaimed = 0
+    for blob_id in Blob.objects.filter(ref_count__lte=0).values_list('pk', flat=True):
+        with transaction.atomic():
+            referenced = (Video.objects.filter(blob_id=blob_id).count()
+                          + Derivation.objects.filter(blob_id=blob_id).count())
+            if referenced:
+                Blob.objects.filter(pk=blob_id).update(ref_count=referenced)
+            else:
+                reclaimed += _delete_unreferenced(blob_id)
+    return reclaimed
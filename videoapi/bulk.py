@@ -0,0 +1,134 @@
+# videoapi/bulk.py
+# Video selection shared by the listing and the bulk endpoints, and bulk delete and
+# update that run a fixed number of queries per batch of videos instead of per video.
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from .models import Blob, Tag, Video
+from .caching import invalidate
+
+FILTERS = ('is_trimmed', 'is_merged', 'owner', 'min_duration', 'max_duration', 'tag')
+TAG_OPERATIONS = ('set', 'add', 'remove')
+
+
+def filter_videos(videos, params, user):
+    """Apply the listing filters found in `params` (query parameters or a JSON object)."""
+    # All of them are covered by an index
+    for flag in ('is_trimmed', 'is_merged'):
+        value = params.get(flag)
+        if value is not None:
+            videos = videos.filter(**{flag: str(value).lower() in ('1', 'true', 'yes')})
+    owner = params.get('owner')
+    if owner == 'me':
+        videos = videos.filter(owner=user)
+    elif owner:
+        if not str(owner).isdigit():
+            raise ValueError('Invalid owner filter.')
+        videos = videos.filter(owner_id=owner)
+    try:
+        if params.get('min_duration'):
+            videos = videos.filter(duration__gte=float(params['min_duration']))
+        if params.get('max_duration'):
+            videos = videos.filter(duration__lte=float(params['max_duration']))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid duration filter.')
+    if params.get('tag'):
+        videos = videos.filter(tags__name=params['tag'])
+    return videos
+
+
+def select_videos(data, user):
+    """
+    The videos of `user` a bulk request applies to, given as an `ids` list or a
+    `filter` object, and the requested ids that are not among them.
+    """
+    owned = Video.objects.filter(owner=user)
+    ids, criteria = data.get('ids'), data.get('filter')
+    if ids is not None:
+        if not isinstance(ids, list) or not ids or not all(isinstance(pk, int) for pk in ids):
+            raise ValueError('ids must be a non-empty list of video ids.')
+        videos = owned.filter(pk__in=ids)
+        found = set(videos.values_list('pk', flat=True))
+        return videos, sorted(set(ids) - found)
+    if isinstance(criteria, dict) and criteria:
+        # An unknown key must not silently widen the selection
+        unknown = sorted(set(criteria) - set(FILTERS))
+        if unknown:
+            raise ValueError(f'Unknown filter {", ".join(unknown)}.')
+        return filter_videos(owned, criteria, user), []
+    raise ValueError('Select videos with a non-empty "ids" list or "filter" object.')
+
+
+def tag_changes(changes):
+    """Validate a `tags` object of a bulk update: 'set', or 'add' and/or 'remove', each a list of names."""
+    if not isinstance(changes, dict) or not changes or set(changes) - set(TAG_OPERATIONS):
+        raise ValueError('tags must be an object with "set", "add" or "remove" lists.')
+    if 'set' in changes and len(changes) > 1:
+        raise ValueError('"set" replaces all tags and cannot be combined with "add" or "remove".')
+    normalized = {}
+    max_length = Tag._meta.get_field('name').max_length
+    for operation, names in changes.items():
+        if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+            raise ValueError('Tags must be lists of names.')
+        normalized[operation] = sorted({name.strip() for name in names} - {''})
+        if any(len(name) > max_length for name in normalized[operation]):
+            raise ValueError(f'Tag names must be at most {max_length} characters.')
+    return normalized
+
+
+def _batches(videos):
+    # Statements run on batches of ids, so a selection that depends on tags survives re-tagging it
+    ids = list(videos.order_by().values_list('pk', flat=True))
+    for first in range(0, len(ids), settings.BULK_BATCH_SIZE):
+        yield ids[first:first + settings.BULK_BATCH_SIZE]
+
+
+def bulk_delete(videos):
+    """
+    Delete the selected videos. Blob references are dropped with one UPDATE per
+    batch and the files are left to the reclaim_storage task, instead of one
+    release per video. Returns the number of videos deleted.
+    """
+    deleted = 0
+    with transaction.atomic():
+        for ids in _batches(videos):
+            batch = Video.objects.filter(pk__in=ids)
+            per_blob = batch.filter(blob=OuterRef('pk')).order_by().values('blob').annotate(count=Count('pk'))
+            Blob.objects.filter(pk__in=batch.values('blob')).update(
+                ref_count=F('ref_count') - Subquery(per_blob.values('count'))
+            )
+            # Released above, so the post_delete handler must not release them a second time
+            batch.update(blob=None)
+            deleted += batch.delete()[1].get(Video._meta.label, 0)
+    return deleted
+
+
+def bulk_update(videos, title=None, tags=None):
+    """
+    Set the title of the selected videos and apply the `tags` changes (see
+    tag_changes). Returns the number of videos selected.
+    """
+    tags = tags or {}
+    names = tags.get('set', tags.get('add'))
+    Through = Video.tags.through
+    updated = 0
+    with transaction.atomic():
+        tag_ids = []
+        if names:
+            Tag.objects.bulk_create([Tag(name=name) for name in names], ignore_conflicts=True)
+            tag_ids = list(Tag.objects.filter(name__in=names).values_list('pk', flat=True))
+
+        for ids in _batches(videos):
+            updated += len(ids)
+            if title is not None:
+                Video.objects.filter(pk__in=ids).update(title=title)
+            if 'set' in tags:
+                Through.objects.filter(video_id__in=ids).delete()
+            if tags.get('remove'):
+                Through.objects.filter(video_id__in=ids, tag__name__in=tags['remove']).delete()
+            if tag_ids:
+                Through.objects.bulk_create(
+                    [Through(video_id=pk, tag_id=tag_id) for pk in ids for tag_id in tag_ids], ignore_conflicts=True
+                )
+            invalidate(ids)
+    return updated
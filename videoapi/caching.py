@@ -0,0 +1,83 @@
+# videoapi/caching.py
+# Cached payloads of the video list and detail endpoints. Every key carries a
+# generation that changes when a video does (signals.py, and the bulk operations
+# that bypass the signals): the video's own detail entry and all list pages stop
+# matching, nothing else is touched.
+import hashlib
+import json
+import uuid
+from functools import partial
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+LIST = 'list'
+
+
+def _cache():
+    return caches[settings.VIDEO_CACHE_ALIAS]
+
+
+def _generation_key(scope):
+    return f'videoapi:generation:{scope}'
+
+
+def _generation(scope):
+    cache = _cache()
+    key = _generation_key(scope)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, uuid.uuid4().hex, timeout=None)
+        generation = cache.get(key, '')
+    return generation
+
+
+def _new_generations(ids):
+    scopes = [LIST] + [f'video:{pk}' for pk in ids]
+    _cache().set_many({_generation_key(scope): uuid.uuid4().hex for scope in scopes}, timeout=None)
+
+
+def invalidate(ids=()):
+    """
+    Drop the cached list pages and the detail entries of the videos `ids`. Done
+    again when the transaction commits, since a request that read the old rows in
+    the meantime may have cached them under the new generation.
+    """
+    ids = list(ids)
+    _new_generations(ids)
+    transaction.on_commit(partial(_new_generations, ids))
+
+
+def list_key(request):
+    # The absolute URL covers the filters, the cursor and the host of the pagination links
+    digest = hashlib.sha256(request.build_absolute_uri().encode()).hexdigest()
+    return f'videoapi:videos:{_generation(LIST)}:{request.user.pk}:{digest}'
+
+
+def detail_key(pk):
+    # The payload of a video is the same for every user
+    return f'videoapi:video:{pk}:{_generation(f"video:{pk}")}'
+
+
+def cached_response(request, key, build):
+    """
+    Respond with the payload cached under `key`, or cache what `build()` returns.
+    The ETag is a hash of the payload, a matching If-None-Match gets a 304.
+    """
+    cache = _cache()
+    entry = cache.get(key)
+    if entry is None:
+        # Serializer output holds its serializer, the JSON round trip leaves plain data to cache
+        content = json.dumps(build(), cls=DjangoJSONEncoder, sort_keys=True)
+        entry = {'etag': quote_etag(hashlib.sha256(content.encode()).hexdigest()[:32]), 'data': json.loads(content)}
+        cache.set(key, entry, settings.VIDEO_CACHE_TIMEOUT)
+
+    headers = {'ETag': entry['etag'], 'Cache-Control': 'private, no-cache', 'Vary': 'Authorization'}
+    if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+    if entry['etag'] in if_none_match or '*' in if_none_match:
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(entry['data'], headers=headers)
@@ -0,0 +1,220 @@
+# videoapi/derivations.py
+# Memoized trim/merge outputs. Identical requests return the stored output, or
+# attach to the task that is already producing it. The output file is kept as a
+# blob reference of the derivation's own, each requester gets a Video of their
+# own that shares the blob, so eviction never touches a video anyone can see.
+import hashlib
+import json
+import os
+from datetime import timedelta
+from functools import partial
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from .models import Blob, Derivation, Job, Video
+from .blobs import release_blob
+from .jobs import queue_job
+from .profiles import encoding_params
+from .scheduling import stored_metadata_matches
+
+IN_FLIGHT = (Job.PENDING, Job.STARTED)
+# Streaming a derived video refreshes its last access at most this often
+TOUCH_INTERVAL = timedelta(minutes=1)
+
+
+def source_identity(video):
+    # Content hash when the video is in the blob store, so a replaced file never matches
+    if video.blob_id:
+        return f'{video.pk}:{video.blob.sha256}'
+    return f'{video.pk}:{int(video.uploaded_at.timestamp())}:{video.file_size or video.video_file.name}'
+
+
+def trim_params(start, end, mode, profile=None):
+    params = {'start': round(start, 3), 'end': round(end, 3), 'mode': mode}
+    if mode == 'fast':
+        # The keyframe tolerance changes where a fast cut lands
+        params['tolerance'] = settings.TRIM_KEYFRAME_TOLERANCE
+    else:
+        params.update(encoding_params(profile))
+    return params
+
+
+def merge_params(videos, profile=None):
+    # Inputs that will be joined packet by packet give the same output whatever the profile
+    if all(video.duration is not None for video in videos) and stored_metadata_matches(videos):
+        return {'mode': 'copy'}
+    return encoding_params(profile)
+
+
+def derivation_key(kind, videos, params):
+    descriptor = json.dumps(
+        {'kind': kind, 'sources': [source_identity(video) for video in videos], 'params': params}, sort_keys=True
+    )
+    return hashlib.sha256(descriptor.encode()).hexdigest()
+
+
+def materialize(derivation, owner_id):
+    """The owner's Video of a stored output, created with a reference on the blob the first time. Lock `derivation` first."""
+    video = Video.objects.filter(derivation=derivation, owner_id=owner_id).order_by('pk').first()
+    if video is None:
+        Blob.objects.filter(pk=derivation.blob_id).update(ref_count=F('ref_count') + 1)
+        video = Video.objects.create(
+            video_file=derivation.blob.file.name, blob=derivation.blob, file_size=derivation.size, owner_id=owner_id,
+            derivation=derivation, is_trimmed=derivation.kind != 'merge', is_merged=derivation.kind == 'merge',
+            **derivation.media
+        )
+    return video
+
+
+def _hit(derivation):
+    Derivation.objects.filter(pk=derivation.pk).update(hits=F('hits') + 1, last_accessed=timezone.now())
+
+
+def request_derivation(kind, videos, params, task, args, plan=None, owner_id=None):
+    """
+    Look up or start a derivation. Returns (video, job, created): `video` is the
+    owner's copy of an output that already exists (and `job` is None), and
+    `created` is False when the request joined a task that was already queued
+    or running. A joining request of another owner gets a job of its own that
+    follows the running one.
+    """
+    key = derivation_key(kind, videos, params)
+    with transaction.atomic():
+        derivation, _ = Derivation.objects.select_for_update().select_related('blob', 'job').get_or_create(
+            key=key, defaults={'kind': kind, 'params': params}
+        )
+        if derivation.blob_id:
+            _hit(derivation)
+            return materialize(derivation, owner_id), None, False
+        job = derivation.job
+        if job is not None and job.state in IN_FLIGHT:
+            Derivation.objects.filter(pk=derivation.pk).update(hits=F('hits') + 1)
+            if job.owner_id != owner_id:
+                job = job.followers.filter(owner_id=owner_id).first() or Job.objects.create(
+                    kind=kind, owner_id=owner_id, leader=job, state=job.state, progress=job.progress,
+                    queue=job.queue, priority=job.priority, estimated_cost=job.estimated_cost,
+                    expected_wait=job.expected_wait, started_at=job.started_at,
+                )
+            return None, job, False
+
+        # Nothing stored and nothing running (new key, or the last attempt failed)
+        job = Job.objects.create(kind=kind, owner_id=owner_id, **(plan or {}))
+        derivation.job = job
+        derivation.save(update_fields=['job'])
+    queue_job(job, task, args)
+    return None, job, True
+
+
+def stored_outputs(keys, owner_id, complete=False):
+    """
+    Map each key that already has an output to the owner's Video of it, refreshing
+    their last access. With `complete`, nothing unless every key has one.
+    """
+    outputs = {}
+    with transaction.atomic():
+        stored = list(Derivation.objects.select_for_update().filter(key__in=keys, blob__isnull=False)
+                      .select_related('blob').order_by('pk'))
+        if complete and len(stored) < len(set(keys)):
+            return outputs
+        for derivation in stored:
+            outputs[derivation.key] = materialize(derivation, owner_id)
+        if outputs:
+            Derivation.objects.filter(key__in=outputs).update(hits=F('hits') + 1, last_accessed=timezone.now())
+    return outputs
+
+
+def _store(derivation, kind, blob, media, owner_id):
+    # The reference ingest_file took on the blob becomes the derivation's
+    if derivation is None:
+        # Nothing memoizes the output (a task run on its own), the video keeps the reference
+        return Video.objects.create(video_file=blob.file.name, blob=blob, file_size=blob.size, owner_id=owner_id,
+                                    is_trimmed=kind != 'merge', is_merged=kind == 'merge', **media)
+    if derivation.blob_id:
+        # Stored meanwhile, by a batch that covered the same range
+        transaction.on_commit(partial(release_blob, blob.pk))
+    else:
+        Derivation.objects.filter(pk=derivation.pk).update(blob=blob, media=media, size=blob.size,
+                                                           last_accessed=timezone.now())
+        derivation.refresh_from_db()
+    return materialize(derivation, owner_id)
+
+
+def record_output(task_id, kind, blob, media, owner_id):
+    """Store a finished output for the derivation its task was started for and return the owner's Video."""
+    with transaction.atomic():
+        derivation = Derivation.objects.select_for_update().select_related('blob').filter(job_id=task_id).first()
+        return _store(derivation, kind, blob, media, owner_id)
+
+
+def record_keyed_output(key, kind, params, blob, media, owner_id):
+    # Batch outputs are recorded under the key a single request would use
+    with transaction.atomic():
+        derivation, _ = Derivation.objects.select_for_update().select_related('blob').get_or_create(
+            key=key, defaults={'kind': kind, 'params': params}
+        )
+        return _store(derivation, kind, blob, media, owner_id)
+
+
+def finish_followers(task_id, message, derivation_id=None):
+    """
+    Hand the jobs that joined a finished task a Video of their owners' own, of the
+    output stored for the task or, when it was stored under another key, `derivation_id`.
+    """
+    lookup = {'pk': derivation_id} if derivation_id else {'job_id': task_id}
+    for job in Job.objects.filter(leader_id=task_id, state__in=IN_FLIGHT):
+        with transaction.atomic():
+            derivation = Derivation.objects.select_for_update().select_related('blob').filter(
+                blob__isnull=False, **lookup
+            ).first()
+            if derivation is None:
+                return
+            video = materialize(derivation, job.owner_id)
+        result = {'message': message, 'file': os.path.basename(video.video_file.name), 'id': video.id}
+        Job.objects.filter(pk=job.pk).update(state=Job.SUCCESS, progress=1, eta=0, video=video, result=result,
+                                             finished_at=timezone.now(), updated_at=timezone.now())
+
+
+def touch(video):
+    if video.derivation_id:
+        now = timezone.now()
+        Derivation.objects.filter(pk=video.derivation_id, last_accessed__lt=now - TOUCH_INTERVAL).update(last_accessed=now)
+
+
+def _forget(pk):
+    with transaction.atomic():
+        derivation = Derivation.objects.select_for_update().filter(pk=pk, blob__isnull=False).first()
+        if derivation is None:
+            return 0
+        blob_id = derivation.blob_id
+        derivation.delete()
+        transaction.on_commit(partial(release_blob, blob_id))
+    return 1
+
+
+def evict_derivations(max_bytes=None, max_idle=None):
+    """
+    Forget stored outputs nobody has requested or streamed for `max_idle`, then
+    the least recently used ones until the cache fits in `max_bytes`. Only the
+    cache's own reference on each file is dropped: the videos handed out keep
+    theirs, and the file goes with the last of them. Returns the number of
+    outputs evicted.
+    """
+    max_bytes = settings.DERIVED_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    max_idle = settings.DERIVED_CACHE_MAX_IDLE if max_idle is None else max_idle
+    stored = Derivation.objects.filter(blob__isnull=False)
+
+    evicted = 0
+    if max_idle:
+        stale = stored.filter(last_accessed__lt=timezone.now() - timedelta(seconds=max_idle))
+        for pk in stale.values_list('pk', flat=True):
+            evicted += _forget(pk)
+
+    total = stored.aggregate(total=Sum('size'))['total'] or 0
+    if max_bytes and total > max_bytes:
+        for pk, size in stored.order_by('last_accessed', 'pk').values_list('pk', 'size'):
+            if total <= max_bytes:
+                break
+            evicted += _forget(pk)
+            total -= size or 0
+    return evicted
@@ -0,0 +1,84 @@
+# videoapi/jobs.py
+# Job bookkeeping shared by the views that submit tasks and the tasks that run them.
+import time
+from django.db.models import Q
+from django.utils import timezone
+from proglog import ProgressBarLogger
+from .models import Job
+
+
+def queue_job(job, task, args):
+    """Queue a task under its Job's id, the Job is failed if the broker refuses it."""
+    try:
+        task.apply_async(args=args, task_id=str(job.id), queue=job.queue or None, priority=job.priority)
+    except Exception as exc:
+        Job.objects.filter(pk=job.pk).update(state=Job.FAILURE, error=str(exc), finished_at=timezone.now())
+        raise
+    return job
+
+
+def submit_job(kind, task, args, plan=None, owner_id=None):
+    """Create the Job row, routed by `plan` (see scheduling.plan_job), and queue its task under the same id."""
+    return queue_job(Job.objects.create(kind=kind, owner_id=owner_id, **(plan or {})), task, args)
+
+
+class JobReporter:
+    """
+    Writes a task's progress to its Job row and the jobs following it. Updates
+    are throttled to one write per `min_interval` seconds. Tasks run without a
+    Job (eager calls, scripts) get a reporter that does nothing.
+    """
+
+    def __init__(self, task_id, min_interval=0.5):
+        job = Job.objects.filter(pk=task_id).values('pk', 'owner_id').first() if task_id else None
+        self.job_id = task_id if job else None
+        self.owner_id = job['owner_id'] if job else None
+        self.min_interval = min_interval
+        self.started = None
+        self.last_write = 0
+
+    def _update(self, followers=True, **fields):
+        if self.job_id:
+            jobs = Q(pk=self.job_id) | Q(leader_id=self.job_id) if followers else Q(pk=self.job_id)
+            Job.objects.filter(jobs).update(updated_at=timezone.now(), **fields)
+
+    def start(self):
+        self.started = time.monotonic()
+        self._update(state=Job.STARTED, started_at=timezone.now())
+
+    def update(self, fraction, fps=None):
+        now = time.monotonic()
+        if fraction is None or now - self.last_write < self.min_interval:
+            return
+        self.last_write = now
+        elapsed = now - (self.started or now)
+        eta = elapsed * (1 - fraction) / fraction if fraction > 0 else None
+        self._update(progress=round(fraction, 4), eta=eta, encode_fps=fps)
+
+    def finish(self, video=None, result=None):
+        # Followers get videos of their own, see derivations.finish_followers
+        self._update(followers=False, state=Job.SUCCESS, progress=1, eta=0, video=video, result=result,
+                     finished_at=timezone.now())
+
+    def fail(self, error):
+        self._update(state=Job.FAILURE, error=str(error), finished_at=timezone.now())
+
+
+class MoviepyProgressLogger(ProgressBarLogger):
+    """Forwards moviepy's frame-writing progress bar ('t') to a JobReporter."""
+
+    def __init__(self, reporter):
+        super().__init__()
+        self.reporter = reporter
+        self.frames_started = None
+
+    def bars_callback(self, bar, attr, value, old_value=None):
+        if bar != 't' or attr != 'index':
+            return
+        total = self.bars[bar].get('total')
+        if not total:
+            return
+        if self.frames_started is None:
+            self.frames_started = time.monotonic()
+        elapsed = time.monotonic() - self.frames_started
+        self.reporter.update(value / total, fps=value / elapsed if elapsed > 0 else None)
@@ -0,0 +1,75 @@
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime, timezone
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from videoapi.benchmarks import run_suite, environment, compare
+from videoapi.synthetic import CODECS, parse_size
+
+
+class Command(BaseCommand):
+    help = ('Benchmark trims, merges, upload validation and streaming on synthetic videos. '
+            'Runs against a throwaway test database and media directory, and writes the results as JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='360p,720p', help='Presets (360p, 720p, 1080p) or WIDTHxHEIGHT')
+        parser.add_argument('--codecs', default='h264,mpeg4', help=f'Any of {", ".join(CODECS)}')
+        parser.add_argument('--cases', default='validate,trim,merge,stream')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds of synthetic video per input')
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--output', default='benchmark-results.json')
+        parser.add_argument('--baseline', help='A previous results file to compare wall times against')
+        parser.add_argument('--threshold', type=float, default=0.1, help='Slowdown reported as a regression')
+
+    def handle(self, *args, **options):
+        sizes = options['sizes'].split(',')
+        codecs = options['codecs'].split(',')
+        for name in codecs:
+            if name not in CODECS:
+                raise CommandError(f'Unknown codec {name}')
+        try:
+            [parse_size(name) for name in sizes]
+        except ValueError:
+            raise CommandError('Sizes must be presets or WIDTHxHEIGHT')
+
+        workdir = tempfile.mkdtemp(prefix='videoapi_bench_')
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with override_settings(MEDIA_ROOT=workdir):
+                results = run_suite(
+                    workdir, sizes=sizes, codecs=codecs, duration=options['duration'], repeat=options['repeat'],
+                    cases=options['cases'].split(','), log=lambda message: self.stderr.write(message),
+                )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        report = {
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'environment': environment(),
+            'options': {key: options[key] for key in ('sizes', 'codecs', 'cases', 'duration', 'repeat')},
+            'results': results,
+        }
+        if options['baseline']:
+            with open(options['baseline']) as handle:
+                report['regressions'] = compare(results, json.load(handle), options['threshold'])
+        with open(options['output'], 'w') as handle:
+            json.dump(report, handle, indent=2)
+
+        for entry in results:
+            if 'error' in entry:
+                self.stdout.write(f"{entry['case']:<28} {entry['input']:<24} ERROR {entry['error']}")
+                continue
+            rates = ' '.join(f'{key}={entry[key]}' for key in ('fps', 'mb_per_s') if entry.get(key) is not None)
+            self.stdout.write(f"{entry['case']:<28} {entry['input']:<24} {entry['wall_time']:8.3f}s "
+                              f"rss={entry.get('peak_rss_mb', '-')}MB {rates}")
+        for regression in report.get('regressions', []):
+            self.stdout.write(self.style.WARNING(
+                f"regression: {regression['case']} on {regression['input']} is {regression['change']:.0%} slower"
+            ))
+        self.stdout.write(self.style.SUCCESS(f"Wrote {os.path.abspath(options['output'])}"))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from videoapi.objectstore import ObjectStoreServer
+
+
+class Command(BaseCommand):
+    help = ('Run the local S3-compatible object store, a stand-in for S3 or MinIO when '
+            'STORAGES["default"] uses videoapi.storage.ObjectStorage.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=9000)
+        parser.add_argument('--root', default='objectstore', help='Directory the objects are kept in')
+        parser.add_argument('--bucket', action='append', default=[], help='Bucket to create, may be repeated')
+        parser.add_argument('--access-key', default='videoverse', help='Access key clients must sign with')
+
+    def handle(self, *args, **options):
+        server = ObjectStoreServer((options['host'], options['port']), options['root'], options['access_key'],
+                                   buckets=options['bucket'] or ['videoverse'])
+        self.stdout.write(f'Serving {options["root"]} at {server.endpoint_url}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,664 @@
+# videoapi/media.py
+# Thin helpers around the ffmpeg binary bundled with imageio-ffmpeg.
+import os
+import re
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+import numpy as np
+from imageio_ffmpeg import get_ffmpeg_exe
+
+
+class MediaError(Exception):
+    pass
+
+
+def run_ffmpeg(args, progress=None, duration=None, stdin=None, stdout=None, pass_fds=()):
+    """
+    Run the bundled ffmpeg. With a `progress` callback, ffmpeg's machine-readable
+    progress output is parsed and the callback receives (fraction, fps), where
+    fraction is relative to `duration` seconds of output. `stdin`, `stdout` and
+    `pass_fds` hand pipes to the process, `stdout` only without `progress`.
+    """
+    cmd = [get_ffmpeg_exe(), '-hide_banner', '-nostdin', '-y']
+    if progress is None:
+        result = subprocess.run(cmd + [str(arg) for arg in args], stdin=stdin, stdout=stdout or subprocess.DEVNULL,
+                                stderr=subprocess.PIPE, pass_fds=pass_fds)
+        returncode, output = result.returncode, result.stderr.decode('utf8', errors='replace')
+    else:
+        cmd += ['-progress', 'pipe:1', '-nostats']
+        with tempfile.TemporaryFile() as errors:
+            process = subprocess.Popen(cmd + [str(arg) for arg in args], stdin=stdin, stdout=subprocess.PIPE,
+                                       stderr=errors, pass_fds=pass_fds)
+            stats = {}
+            for line in process.stdout:
+                key, _, value = line.decode('utf8', errors='replace').strip().partition('=')
+                stats[key] = value
+                if key == 'progress':
+                    # out_time_ms is reported in microseconds
+                    seconds = int(stats.get('out_time_ms') or 0) / 1000000
+                    fraction = min(max(seconds / duration, 0), 1) if duration else None
+                    try:
+                        fps = float(stats.get('fps') or 0) or None
+                    except ValueError:
+                        fps = None
+                    progress(fraction, fps)
+            returncode = process.wait()
+            errors.seek(0)
+            output = errors.read().decode('utf8', errors='replace')
+
+    if returncode != 0:
+        raise MediaError(output.strip().splitlines()[-1] if output.strip() else 'ffmpeg failed')
+    return output
+
+
+def encoder_args(profile=None, threads=None, pix_fmt=None):
+    """
+    Video output options for an encoding profile (a settings.ENCODING_PROFILES
+    entry). Without one, libx264 with its defaults. `threads` overrides the
+    profile, `pix_fmt` is used when the profile does not set one.
+    """
+    profile = profile or {}
+    args = ['-c:v', profile.get('codec', 'libx264')]
+    pix_fmt = profile.get('pix_fmt') or pix_fmt
+    if pix_fmt:
+        args += ['-pix_fmt', pix_fmt]
+    if profile.get('preset'):
+        args += ['-preset', profile['preset']]
+    if profile.get('crf') is not None:
+        args += ['-crf', profile['crf']]
+    elif profile.get('video_bitrate'):
+        args += ['-b:v', profile['video_bitrate']]
+    threads = threads or profile.get('threads')
+    if threads:
+        args += ['-threads', threads]
+    return args
+
+
+def audio_encoder_args(profile=None):
+    profile = profile or {}
+    args = ['-c:a', profile.get('audio_codec', 'aac')]
+    if profile.get('audio_bitrate'):
+        args += ['-b:a', profile['audio_bitrate']]
+    return args
+
+
+def scaled_progress(progress, start, span):
+    # Map a sub-step's 0..1 progress onto its share of the whole job
+    if progress is None:
+        return None
+    return lambda fraction, fps: progress(None if fraction is None else start + fraction * span, fps)
+
+
+class CombinedProgress:
+    """
+    Progress of steps running side by side in worker threads. `step(index)` is the
+    callback for the step of `lengths[index]` seconds, and `flush()` reports the
+    finished share of all of them from the calling thread, so `progress` (which
+    writes to the database) never runs inside a worker.
+    """
+
+    def __init__(self, progress, lengths):
+        self.progress = progress
+        self.lengths = lengths
+        self.total = sum(lengths) or 1
+        self.done = {}
+        self.fps = None
+        self.reported = None
+
+    def step(self, index):
+        def update(fraction, fps):
+            if fraction is not None:
+                self.done[index] = fraction * self.lengths[index]
+                self.fps = fps
+        return update
+
+    def flush(self):
+        fraction = sum(self.done.values()) / self.total
+        if self.progress is not None and fraction != self.reported:
+            self.reported = fraction
+            self.progress(fraction, self.fps)
+
+
+def wait_all(futures, combined, interval=0.5):
+    # Report progress while waiting, and stop queued steps as soon as one fails
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, timeout=interval, return_when=FIRST_EXCEPTION)
+        combined.flush()
+        if any(future.exception() for future in done):
+            for future in pending:
+                future.cancel()
+            break
+    return [future.result() for future in futures]
+
+
+def probe_streams(path):
+    """Read container and stream information from the `ffmpeg -i` banner."""
+    cmd = [get_ffmpeg_exe(), '-hide_banner', '-nostdin', '-i', path]
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    infos = result.stderr.decode('utf8', errors='replace')
+
+    match = re.search(r"Input #0, ([^,\s]+)", infos)
+    if not match:
+        raise MediaError(f'Unable to read media information from {path}')
+    info = {'container': match.group(1), 'duration': None, 'bitrate': None, 'video': None, 'audio': None}
+
+    match = re.search(r"Duration: (\d+):(\d+):(\d+\.\d+)", infos)
+    if match:
+        hours, minutes, seconds = match.groups()
+        info['duration'] = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    match = re.search(r"bitrate: (\d+) kb/s", infos)
+    if match:
+        info['bitrate'] = int(match.group(1)) * 1000
+
+    for line in infos.splitlines():
+        if ' Video: ' in line and info['video'] is None:
+            video = {'codec': line.split(' Video: ')[1].split()[0].rstrip(',')}
+            # The profile follows the codec in parentheses, e.g. "h264 (High) (avc1 / 0x31637661)"
+            profile = re.search(r" Video: \w+ \(([^)/]+)\)", line)
+            video['profile'] = profile.group(1) if profile else None
+            size = re.search(r" (\d{2,5})x(\d{2,5})[ ,]", line)
+            if size:
+                video['width'], video['height'] = int(size.group(1)), int(size.group(2))
+            pix_fmt = re.search(r", (yuv\w+|rgb\w+|gray\w*|nv\d+)[,( ]", line)
+            video['pix_fmt'] = pix_fmt.group(1) if pix_fmt else None
+            fps = re.search(r"([\d.]+)k? (fps|tbr)", line)
+            video['fps'] = float(fps.group(1)) if fps else None
+            tbn = re.search(r"([\d.]+)(k?) tbn", line)
+            video['tbn'] = int(float(tbn.group(1)) * (1000 if tbn.group(2) else 1)) if tbn else None
+            info['video'] = video
+        elif ' Audio: ' in line and info['audio'] is None:
+            audio = {'codec': line.split(' Audio: ')[1].split()[0].rstrip(',')}
+            rate = re.search(r"(\d+) Hz", line)
+            audio['sample_rate'] = int(rate.group(1)) if rate else None
+            layout = re.search(r"Hz, ([\w.()]+)", line)
+            audio['channels'] = {'mono': 1, 'stereo': 2}.get(layout.group(1), None) if layout else None
+            info['audio'] = audio
+    return info
+
+
+def h264_level(path):
+    """level_idc of the first H.264 sequence parameter set, e.g. 31 for level 3.1."""
+    output = run_ffmpeg(['-i', path, '-map', '0:v:0', '-c', 'copy', '-bsf:v', 'trace_headers',
+                         '-frames:v', '1', '-f', 'null', '-'])
+    match = re.search(r"level_idc\s+\d+ = (\d+)", output)
+    return int(match.group(1)) if match else None
+
+
+def keyframe_times(path):
+    # Only keyframes are decoded, so this is far cheaper than a full decode pass
+    output = run_ffmpeg(['-skip_frame', 'nokey', '-i', path, '-an', '-map', '0:v:0',
+                         '-vf', 'showinfo', '-f', 'null', '-'])
+    return sorted(float(value) for value in re.findall(r"pts_time:\s*([\d.]+)", output))
+
+
+def plan_fast_trim(keyframes, start, end, tolerance):
+    """
+    Split a trim into ('copy', start, end) and ('encode', start, end) segments.
+
+    The start snaps to a keyframe within `tolerance` seconds. Otherwise only the
+    partial GOP in front of the first keyframe inside the range is re-encoded and
+    the rest is copied. The end never needs a keyframe for packet copying.
+    """
+    before = [k for k in keyframes if k <= start]
+    after = [k for k in keyframes if start <= k < end]
+
+    if before and start - before[-1] <= tolerance:
+        return [('copy', before[-1], end)]
+    if after and after[0] - start <= tolerance:
+        return [('copy', after[0], end)]
+    if after:
+        return [('encode', start, after[0]), ('copy', after[0], end)]
+    return [('encode', start, end)]
+
+
+def stream_copy(src, start, end, dst, progress=None):
+    # Seek slightly past the keyframe so the demuxer does not step back a whole GOP
+    run_ffmpeg(['-ss', f'{start + 0.001:.3f}', '-i', src, '-t', f'{end - start:.3f}',
+                '-map', '0', '-c', 'copy', '-avoid_negative_ts', 'make_zero', dst],
+               progress=progress, duration=end - start)
+
+
+def encode_segment(src, start, end, dst, info=None, progress=None, codec_args=()):
+    args = ['-ss', f'{start:.3f}', '-i', src, '-t', f'{end - start:.3f}', '-map', '0',
+            '-c:v', 'libx264', *codec_args, '-c:a', 'aac']
+    video = (info or {}).get('video') or {}
+    audio = (info or {}).get('audio') or {}
+    if video.get('pix_fmt'):
+        args += ['-pix_fmt', video['pix_fmt']]
+    if video.get('fps'):
+        args += ['-r', video['fps']]
+    if audio.get('sample_rate'):
+        args += ['-ar', audio['sample_rate']]
+    run_ffmpeg(args + [dst], progress=progress, duration=end - start)
+
+
+def concat_copy(paths, dst, progress=None, duration=None):
+    # The concat demuxer joins files packet by packet without decoding them
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as listing:
+        for path in paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            listing.write(f"file '{escaped}'\n")
+    try:
+        run_ffmpeg(['-f', 'concat', '-safe', '0', '-i', listing.name, '-map', '0', '-c', 'copy',
+                    '-movflags', '+faststart', dst], progress=progress, duration=duration)
+    finally:
+        os.remove(listing.name)
+
+
+def streams_compatible(infos):
+    """True when the inputs share codecs and stream layout, so packets can be joined as-is."""
+    def signature(info):
+        video = info.get('video') or {}
+        audio = info.get('audio') or {}
+        return (
+            video.get('codec'), video.get('width'), video.get('height'), video.get('pix_fmt'), video.get('tbn'),
+            audio.get('codec'), audio.get('sample_rate'), audio.get('channels'),
+        )
+
+    if not infos or any(info.get('video') is None for info in infos):
+        return False
+    first = infos[0]
+    for info in infos[1:]:
+        if signature(info) != signature(first):
+            return False
+        # Frame rates printed by ffmpeg are rounded, so compare them loosely
+        fps, first_fps = info['video'].get('fps'), first['video'].get('fps')
+        if fps is None or first_fps is None or abs(fps - first_fps) > 0.01 * first_fps:
+            return False
+    return True
+
+
+# H.264 profiles as ffmpeg prints them, and the libx264 profile that encodes them
+X264_PROFILES = {
+    'Constrained Baseline': 'baseline',
+    'Baseline': 'baseline',
+    'Main': 'main',
+    'High': 'high',
+    'High 10': 'high10',
+    'High 4:2:2': 'high422',
+    'High 4:4:4 Predictive': 'high444',
+}
+
+
+def splice_args(src, info):
+    """
+    libx264 options for a head GOP that decodes with the same parameters as the
+    copied packets of `src`, or None when libx264 cannot produce such a stream.
+    """
+    video = info.get('video') or {}
+    profile = X264_PROFILES.get(video.get('profile'))
+    if video.get('codec') != 'h264' or profile is None or not video.get('pix_fmt'):
+        return None
+    args = ['-profile:v', profile]
+    level = h264_level(src)
+    if level:
+        args += ['-level', str(level)]
+    return args
+
+
+def splice_matches(video, head):
+    # Concatenated packets are decoded with one set of stream parameters
+    keys = ('codec', 'pix_fmt', 'width', 'height')
+    return (head is not None and all(video.get(key) == head.get(key) for key in keys)
+            and X264_PROFILES.get(video.get('profile')) == X264_PROFILES.get(head.get('profile')))
+
+
+def fast_trim(src, start, end, dst, tolerance=0.5, keyframes=None, progress=None):
+    """Trim with packet copying, re-encoding only the partial GOP at the start."""
+    if keyframes is None:
+        keyframes = keyframe_times(src)
+    plan = plan_fast_trim(keyframes, start, end, tolerance)
+    if plan == [('copy', plan[0][1], end)]:
+        stream_copy(src, plan[0][1], end, dst, progress=progress)
+        return plan
+
+    info = probe_streams(src)
+    if len(plan) == 1:
+        encode_segment(src, start, end, dst, info, progress=progress)
+        return plan
+
+    # Splicing an encoded head onto copied packets needs a stream we can reproduce
+    audio_codec = (info.get('audio') or {}).get('codec')
+    head_args = splice_args(src, info)
+    if head_args is None or audio_codec not in (None, 'aac'):
+        encode_segment(src, start, end, dst, info, progress=progress)
+        return [('encode', start, end)]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        parts = []
+        for index, (mode, seg_start, seg_end) in enumerate(plan):
+            part = os.path.join(workdir, f'part{index}.mkv')
+            step = scaled_progress(progress, (seg_start - start) / (end - start), (seg_end - seg_start) / (end - start))
+            if mode == 'copy':
+                stream_copy(src, seg_start, seg_end, part, progress=step)
+            else:
+                encode_segment(src, seg_start, seg_end, part, info, progress=step, codec_args=head_args)
+                if not splice_matches(info['video'], probe_streams(part).get('video')):
+                    encode_segment(src, start, end, dst, info, progress=progress)
+                    return [('encode', start, end)]
+            parts.append(part)
+        concat_copy(parts, dst)
+    return plan
+
+
+def batch_encode(src, ranges, dsts, info=None, profile=None, progress=None):
+    """
+    Cut several (start, end) ranges out of `src` in one decode pass. The decoded
+    frames are split across one trim branch and encoder per output, plus a null
+    output that tracks how far through the source the pass is for `progress`.
+    """
+    info = info or probe_streams(src)
+    video = info.get('video') or {}
+    audio = info.get('audio')
+    first = min(start for start, _ in ranges)
+    last = max(end for _, end in ranges)
+    count = len(ranges)
+
+    # Input seeking resets timestamps, so every trim is relative to the first start
+    graph = ['[0:v]split={}{}[vt]'.format(count + 1, ''.join(f'[v{i}]' for i in range(count)))]
+    if audio:
+        graph.append('[0:a]asplit={}{}'.format(count, ''.join(f'[a{i}]' for i in range(count))))
+    for index, (start, end) in enumerate(ranges):
+        graph.append(f'[v{index}]trim=start={start - first:.3f}:end={end - first:.3f},setpts=PTS-STARTPTS[ov{index}]')
+        if audio:
+            graph.append(f'[a{index}]atrim=start={start - first:.3f}:end={end - first:.3f},'
+                         f'asetpts=PTS-STARTPTS[oa{index}]')
+
+    args = ['-ss', f'{first:.3f}', '-t', f'{last - first:.3f}', '-i', src, '-filter_complex', ';'.join(graph)]
+    for index, dst in enumerate(dsts):
+        args += ['-map', f'[ov{index}]', *encoder_args(profile, pix_fmt=video.get('pix_fmt'))]
+        if audio:
+            args += ['-map', f'[oa{index}]', *audio_encoder_args(profile)]
+            if audio.get('sample_rate'):
+                args += ['-ar', audio['sample_rate']]
+        args += ['-movflags', '+faststart', dst]
+    args += ['-map', '[vt]', '-f', 'null', '-']
+    run_ffmpeg(args, progress=progress, duration=last - first)
+
+
+def batch_fast_trim(src, ranges, dsts, tolerance=0.5, keyframes=None, progress=None, workers=None):
+    """Fast-trim several ranges in parallel, sharing one keyframe scan of the source."""
+    if keyframes is None:
+        keyframes = keyframe_times(src)
+    combined = CombinedProgress(progress, [end - start for start, end in ranges])
+    with ThreadPoolExecutor(max_workers=workers or min(len(ranges), os.cpu_count() or 1)) as executor:
+        futures = [
+            executor.submit(fast_trim, src, start, end, dst, tolerance, keyframes, combined.step(index))
+            for index, ((start, end), dst) in enumerate(zip(ranges, dsts))
+        ]
+        return wait_all(futures, combined)
+
+
+def plan_chunks(duration, chunk_seconds, keyframes=None, fps=None):
+    """
+    Split [0, duration) into chunks of about `chunk_seconds`. Boundaries snap to a
+    source keyframe within half a chunk, so every chunk seeks straight to a GOP
+    start, and then onto the output frame grid so the chunks tile exactly.
+    """
+    bounds = [0.0]
+    while duration - bounds[-1] > chunk_seconds * 1.5:
+        target = bounds[-1] + chunk_seconds
+        near = [k for k in keyframes or [] if abs(k - target) <= chunk_seconds / 2 and k > bounds[-1]]
+        boundary = min(near, key=lambda k: abs(k - target)) if near else target
+        if fps:
+            boundary = round(boundary * fps) / fps
+        bounds.append(boundary)
+    bounds.append(duration)
+    return list(zip(bounds, bounds[1:]))
+
+
+def _encode_video_chunk(src, start, end, dst, width, height, fps, threads, profile=None, progress=None):
+    # The fps filter, unlike -r, also duplicates frames when the container allows a variable rate
+    graph = (f'fps={fps},scale={width}:{height}:force_original_aspect_ratio=decrease,'
+             f'pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1')
+    run_ffmpeg(['-ss', f'{start:.3f}', '-i', src, '-t', f'{end - start:.3f}', '-map', '0:v:0', '-an',
+                '-vf', graph, *encoder_args(profile, threads=threads, pix_fmt='yuv420p'), dst],
+               progress=progress, duration=end - start)
+
+
+def _encode_joined_audio(paths, infos, dst, sample_rate=44100, profile=None):
+    # Audio is cheap to encode and AAC priming would click at every chunk joint, so it is done in one pass
+    args, labels = [], []
+    for index, (path, info) in enumerate(zip(paths, infos)):
+        if info.get('audio'):
+            args += ['-i', path]
+        else:
+            args += ['-f', 'lavfi', '-t', f"{info['duration']:.3f}",
+                     '-i', f'anullsrc=channel_layout=stereo:sample_rate={sample_rate}']
+        labels.append(f'[{index}:a]aresample={sample_rate},aformat=channel_layouts=stereo[a{index}]')
+    graph = ';'.join(labels) + ';' + ''.join(f'[a{i}]' for i in range(len(paths)))
+    graph += f'concat=n={len(paths)}:v=0:a=1[out]'
+    run_ffmpeg(args + ['-filter_complex', graph, '-map', '[out]', *audio_encoder_args(profile), dst])
+
+
+def parallel_merge_encode(paths, dst, infos=None, keyframes=None, chunk_seconds=10, workers=None, profile=None,
+                          progress=None):
+    """
+    Merge `paths` with a full re-encode spread over several ffmpeg processes.
+
+    The timeline is cut into GOP-aligned chunks that are encoded in parallel to
+    the size and frame rate of the first input, while the audio of all inputs is
+    encoded in one pass alongside them. The chunks are then joined and muxed with
+    the audio by packet copy.
+    """
+    infos = infos or [probe_streams(path) for path in paths]
+    keyframes = keyframes or [None] * len(paths)
+    first = infos[0]['video']
+    width, height = first['width'], first['height']
+    fps = max(info['video'].get('fps') or 25 for info in infos)
+    workers = workers or os.cpu_count() or 1
+    # Each chunk gets its share of the cores instead of x264 spreading every chunk over all of them,
+    # whatever thread count the profile asks for
+    threads = max((os.cpu_count() or 1) // workers, 1)
+
+    jobs = []
+    for path, info, frames in zip(paths, infos, keyframes):
+        for start, end in plan_chunks(info['duration'], chunk_seconds, frames, fps):
+            jobs.append((path, start, end))
+    combined = CombinedProgress(progress, [end - start for _, start, end in jobs])
+
+    with tempfile.TemporaryDirectory() as workdir:
+        parts = [os.path.join(workdir, f'chunk{index:05d}.mkv') for index in range(len(jobs))]
+        audio = os.path.join(workdir, 'audio.m4a')
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(_encode_video_chunk, path, start, end, part, width, height, fps, threads, profile,
+                                combined.step(index))
+                for index, ((path, start, end), part) in enumerate(zip(jobs, parts))
+            ]
+            if any(info.get('audio') for info in infos):
+                futures.append(executor.submit(_encode_joined_audio, paths, infos, audio, profile=profile))
+            wait_all(futures, combined)
+
+        video = os.path.join(workdir, 'video.mkv')
+        concat_copy(parts, video)
+        args = ['-i', video]
+        if os.path.exists(audio):
+            args += ['-i', audio, '-map', '0:v:0', '-map', '1:a:0', '-shortest']
+        run_ffmpeg(args + ['-c', 'copy', '-movflags', '+faststart', dst])
+    return len(jobs)
+
+
+def hls_ladder(info, renditions):
+    """
+    The renditions worth producing for a source: every rung smaller than the
+    source, plus the source resolution itself as 'original'.
+    """
+    video = info.get('video') or {}
+    height = video.get('height')
+    if not height:
+        raise MediaError('Source has no video stream')
+    ladder = [dict(rung) for rung in sorted(renditions, key=lambda r: r['height']) if rung['height'] < height]
+    top = dict(ladder[-1]) if ladder else {'video_bitrate': 800000, 'audio_bitrate': 96000}
+    # Never spend more bits than the source had on its own resolution
+    source_bitrate = info.get('bitrate') or top['video_bitrate'] * 2
+    ladder.append({
+        'name': 'original', 'height': height,
+        'video_bitrate': max(min(source_bitrate, top['video_bitrate'] * 2), top['video_bitrate']),
+        'audio_bitrate': top['audio_bitrate'],
+    })
+    return ladder
+
+
+def package_hls(src, out_dir, ladder, segment_seconds=4, info=None, progress=None):
+    """
+    Encode `src` once per rendition in a single decode pass and write fMP4 HLS
+    under `out_dir`: one `<name>/index.m3u8` per rendition and `master.m3u8`.
+    Keyframes are forced on segment boundaries so every rendition switches cleanly.
+    """
+    info = info or probe_streams(src)
+    audio = info.get('audio')
+    count = len(ladder)
+    graph = '[0:v]split={}{};'.format(count, ''.join(f'[v{i}]' for i in range(count)))
+    graph += ';'.join(f'[v{i}]scale=-2:{rung["height"]}[o{i}]' for i, rung in enumerate(ladder))
+
+    args = ['-i', src, '-filter_complex', graph]
+    for index in range(count):
+        args += ['-map', f'[o{index}]']
+    if audio:
+        args += ['-map', '0:a:0'] * count
+    for index, rung in enumerate(ladder):
+        args += [f'-b:v:{index}', rung['video_bitrate'], f'-maxrate:v:{index}', int(rung['video_bitrate'] * 1.5),
+                 f'-bufsize:v:{index}', rung['video_bitrate'] * 2]
+        if audio:
+            args += [f'-b:a:{index}', rung['audio_bitrate']]
+    args += ['-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-sc_threshold', '0',
+             '-force_key_frames', f'expr:gte(t,n_forced*{segment_seconds})']
+    if audio:
+        args += ['-c:a', 'aac', '-ac', 2]
+    stream_map = ' '.join(
+        f'v:{index},a:{index},name:{rung["name"]}' if audio else f'v:{index},name:{rung["name"]}'
+        for index, rung in enumerate(ladder)
+    )
+    args += ['-f', 'hls', '-hls_time', segment_seconds, '-hls_playlist_type', 'vod',
+             '-hls_segment_type', 'fmp4', '-hls_flags', 'independent_segments', '-hls_fmp4_init_filename', 'init.mp4',
+             '-master_pl_name', 'master.m3u8', '-var_stream_map', stream_map,
+             '-hls_segment_filename', os.path.join(out_dir, '%v', 'seg_%05d.m4s'),
+             os.path.join(out_dir, '%v', 'index.m3u8')]
+    run_ffmpeg(args, progress=progress, duration=info.get('duration'))
+    return [rung['name'] for rung in ladder]
+
+
+def sample_frames(src, interval, width, height):
+    """Yield an RGB frame, a (height, width, 3) uint8 array, every `interval` seconds from one decode pass."""
+    cmd = [get_ffmpeg_exe(), '-hide_banner', '-nostdin', '-i', src, '-map', '0:v:0',
+           '-vf', f'fps={1 / interval:.6f},scale={width}:{height}', '-f', 'rawvideo', '-pix_fmt', 'rgb24', 'pipe:1']
+    frame_size = width * height * 3
+    with tempfile.TemporaryFile() as errors:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=errors)
+        data = b''
+        try:
+            while True:
+                data = process.stdout.read(frame_size)
+                if len(data) < frame_size:
+                    break
+                yield np.frombuffer(data, np.uint8).reshape(height, width, 3)
+        finally:
+            # Stopping early must not leave ffmpeg blocked on a full pipe
+            if process.poll() is None and len(data) == frame_size:
+                process.kill()
+            process.stdout.close()
+            returncode = process.wait()
+        if returncode > 0:
+            errors.seek(0)
+            output = errors.read().decode('utf8', errors='replace').strip()
+            raise MediaError(output.splitlines()[-1] if output else 'ffmpeg failed')
+
+
+def extract_frame(src, time, dst, width):
+    # Input seeking lands on the keyframe before `time`, so only a few frames are decoded
+    run_ffmpeg(['-ss', f'{time:.3f}', '-i', src, '-map', '0:v:0', '-frames:v', 1,
+                '-vf', f'scale={width}:-2', '-q:v', 3, dst])
+
+
+def _feed(write_fd, steps, errors):
+    # Run the decoders of a pipe one after another, then close it so the encoder sees the end of the stream
+    try:
+        for step in steps:
+            step(write_fd)
+    except (MediaError, OSError) as exc:
+        errors.append(exc)
+    finally:
+        os.close(write_fd)
+
+
+def _write_silence(write_fd, size):
+    chunk = bytes(min(size, 64 * 1024))
+    while size > 0:
+        size -= os.write(write_fd, chunk[:size])
+
+
+def sequential_merge_encode(paths, dst, infos=None, sample_rate=44100, profile=None, progress=None):
+    """
+    Merge `paths` with a full re-encode while only one input is decoded at a time.
+
+    Each input is decoded on its own, scaled and padded to the size of the first
+    input and resampled to the highest frame rate and to `sample_rate`, and its
+    raw frames and samples are written straight into the pipes of a single
+    encoder. Every input contributes a whole number of frames and the matching
+    number of samples, so the audio stays in sync however many inputs there are,
+    and memory use does not grow with their number.
+    """
+    infos = infos or [probe_streams(path) for path in paths]
+    for path, info in zip(paths, infos):
+        if not info.get('video') or not info.get('duration'):
+            raise MediaError(f'{os.path.basename(path)} has no video stream to merge')
+    first = infos[0]['video']
+    # Chroma subsampling needs even dimensions
+    width, height = first['width'] // 2 * 2, first['height'] // 2 * 2
+    fps = max(info['video'].get('fps') or 25 for info in infos)
+    graph = (f'fps={fps},scale={width}:{height}:force_original_aspect_ratio=decrease,'
+             f'pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,tpad=stop=-1:stop_mode=clone,format=yuv420p')
+
+    # Sample counts follow the running frame total, rounding never adds up to drift
+    frames, samples, total = [], [], 0
+    for info in infos:
+        count = max(round(info['duration'] * fps), 1)
+        samples.append(round((total + count) / fps * sample_rate) - round(total / fps * sample_rate))
+        frames.append(count)
+        total += count
+
+    def decode_video(path, count):
+        return lambda write_fd: run_ffmpeg(['-i', path, '-map', '0:v:0', '-an', '-vf', graph, '-frames:v', count,
+                                            '-f', 'rawvideo', 'pipe:1'], stdout=write_fd)
+
+    def decode_audio(path, info, count):
+        if not info.get('audio'):
+            return lambda write_fd: _write_silence(write_fd, count * 4)
+        chain = (f'aresample={sample_rate},aformat=sample_fmts=s16:channel_layouts=stereo,'
+                 f'apad=whole_len={count},atrim=end_sample={count}')
+        return lambda write_fd: run_ffmpeg(['-i', path, '-map', '0:a:0', '-vn', '-af', chain,
+                                            '-f', 's16le', 'pipe:1'], stdout=write_fd)
+
+    video_read, video_write = os.pipe()
+    feeds = [(video_write, [decode_video(path, count) for path, count in zip(paths, frames)])]
+    args = ['-f', 'rawvideo', '-pix_fmt', 'yuv420p', '-s', f'{width}x{height}', '-framerate', fps, '-i', 'pipe:0']
+    audio_read = None
+    if any(info.get('audio') for info in infos):
+        audio_read, audio_write = os.pipe()
+        feeds.append((audio_write, [decode_audio(path, info, count)
+                                    for path, info, count in zip(paths, infos, samples)]))
+        args += ['-f', 's16le', '-ar', sample_rate, '-ac', 2, '-i', f'pipe:{audio_read}',
+                 '-map', '0:v', '-map', '1:a', *audio_encoder_args(profile)]
+    args += [*encoder_args(profile, pix_fmt='yuv420p'), '-movflags', '+faststart', dst]
+
+    errors = []
+    threads = [threading.Thread(target=_feed, args=(write_fd, steps, errors), daemon=True) for write_fd, steps in feeds]
+    for thread in threads:
+        thread.start()
+    try:
+        run_ffmpeg(args, progress=progress, duration=total / fps, stdin=video_read,
+                   pass_fds=(audio_read,) if audio_read is not None else ())
+    finally:
+        # Decoders still writing get a broken pipe instead of blocking when the encoder failed
+        for read_fd in (video_read, audio_read):
+            if read_fd is not None:
+                os.close(read_fd)
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0] if isinstance(errors[0], MediaError) else MediaError(str(errors[0]))
+    return total
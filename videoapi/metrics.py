@@ -0,0 +1,296 @@
+# videoapi/metrics.py
+# Prometheus text exposition for /metrics. Request latency, task runtime and encode
+# throughput are counted in every process (web and Celery workers), which writes
+# its counters to METRICS_DIR from time to time; the view adds them up and reads
+# the job queue and storage gauges from the database when it is scraped. Files are
+# named by pid, the counters of processes that have exited are moved into one
+# archive file, so the directory does not grow with every worker restart.
+import fcntl
+import json
+import os
+import threading
+import time
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db.models import Count, Sum
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.decorators import sync_and_async_middleware
+from .models import Blob, Derivation, Job
+
+METRICS = {
+    'videoapi_http_request_duration_seconds': ('histogram', 'Time until an API response is returned, by URL name.'),
+    'videoapi_task_duration_seconds': ('histogram', 'Wall time of Celery tasks, by task and final state.'),
+    'videoapi_encode_fps': ('histogram', 'Frames written per second of task wall time by trim and merge tasks.'),
+    'videoapi_encode_frames_total': ('counter', 'Frames written by trim and merge tasks.'),
+    'videoapi_encode_input_bytes_total': ('counter', 'Bytes of the source videos of trim and merge tasks.'),
+    'videoapi_encode_output_bytes_total': ('counter', 'Bytes of the videos written by trim and merge tasks.'),
+    'videoapi_queue_jobs': ('gauge', 'Jobs waiting or running, by queue.'),
+    'videoapi_storage_bytes': ('gauge', 'Bytes stored, by area.'),
+    'videoapi_storage_files': ('gauge', 'Files stored, by area.'),
+}
+FPS_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+ARCHIVE = 'archive.json'
+
+# Counters of this process, keyed by (sample name, label pairs). Histograms are
+# kept as their _bucket, _sum and _count counters, so samples of all processes
+# are merged by adding them.
+_lock = threading.Lock()
+_values = {}
+_pid = None
+_last_flush = 0
+_task_started = {}
+_archive_lock = threading.Lock()
+_archived = None
+
+
+def _own():
+    # A forked Celery worker starts with a copy of its parent's counters, they are not its own
+    global _pid, _values
+    if _pid != os.getpid():
+        _pid, _values = os.getpid(), {}
+    return _values
+
+
+def _read(path):
+    with open(path) as handle:
+        return [(sample, tuple(tuple(pair) for pair in labels), value) for sample, labels, value in json.load(handle)]
+
+
+def _write(path, samples):
+    with open(f'{path}.tmp', 'w') as handle:
+        json.dump(samples, handle)
+    os.replace(f'{path}.tmp', path)
+
+
+def _exited(name):
+    pid = name[:-len('.json')]
+    if not name.endswith('.json') or not pid.isdigit():
+        return False
+    if int(pid) == os.getpid():
+        # Until this process writes its own file, one with its pid was left by an earlier process
+        return _archived != os.getpid()
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def _directory_lock(exclusive):
+    # Readers share the lock, so a scrape never sees counters both in the archive and in their own file
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    handle = open(os.path.join(settings.METRICS_DIR, 'archive.lock'), 'a')
+    fcntl.flock(handle, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+    return handle
+
+
+def archive_exited():
+    """Add the counters of processes that have exited to the archive file and remove their files."""
+    with _directory_lock(exclusive=True):
+        names = [name for name in os.listdir(settings.METRICS_DIR) if _exited(name)]
+        if not names:
+            return 0
+        archive = os.path.join(settings.METRICS_DIR, ARCHIVE)
+        totals = {}
+        for path in [archive] + [os.path.join(settings.METRICS_DIR, name) for name in names]:
+            try:
+                samples = _read(path)
+            except (OSError, ValueError):
+                continue
+            for sample, labels, value in samples:
+                totals[(sample, labels)] = totals.get((sample, labels), 0) + value
+        _write(archive, [[name, labels, value] for (name, labels), value in totals.items()])
+        for name in names:
+            os.remove(os.path.join(settings.METRICS_DIR, name))
+        return len(names)
+
+
+def _archive_once():
+    # Once per process, before it writes its own file for the first time
+    global _archived
+    with _archive_lock:
+        if _archived != os.getpid():
+            archive_exited()
+            _archived = os.getpid()
+
+
+def _format(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def inc(name, amount=1, labels=()):
+    key = (name, tuple(labels))
+    with _lock:
+        values = _own()
+        values[key] = values.get(key, 0) + amount
+
+
+def observe(name, value, buckets, labels=()):
+    labels = tuple(labels)
+    with _lock:
+        values = _own()
+        for bound in (*buckets, float('inf')):
+            key = (f'{name}_bucket', labels + (('le', '+Inf' if bound == float('inf') else _format(bound)),))
+            values[key] = values.get(key, 0) + (value <= bound)
+        for suffix, amount in (('_sum', value), ('_count', 1)):
+            key = (name + suffix, labels)
+            values[key] = values.get(key, 0) + amount
+
+
+def flush(force=False):
+    """Write this process's counters to METRICS_DIR, at most every METRICS_FLUSH_INTERVAL seconds."""
+    global _last_flush
+    with _lock:
+        now = time.monotonic()
+        if not force and now - _last_flush < settings.METRICS_FLUSH_INTERVAL:
+            return
+        _last_flush = now
+        samples = [[name, labels, value] for (name, labels), value in _own().items()]
+        pid = _pid
+    _archive_once()
+    _write(os.path.join(settings.METRICS_DIR, f'{pid}.json'), samples)
+
+
+def task_started(task_id):
+    _task_started[task_id] = time.perf_counter()
+
+
+def task_finished(task_id, name, state):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        observe('videoapi_task_duration_seconds', time.perf_counter() - started, settings.METRICS_TASK_BUCKETS,
+                (('task', name), ('state', state or 'UNKNOWN')))
+    # Workers may sit idle for a long time after a task, so it is written out right away
+    flush(force=True)
+
+
+def record_encode(task, sources, outputs, seconds):
+    """Count the frames and bytes a trim or merge task read and wrote in `seconds`."""
+    labels = (('task', task),)
+    frames = sum((video.duration or 0) * (video.fps or 0) for video in outputs)
+    inc('videoapi_encode_frames_total', round(frames), labels)
+    inc('videoapi_encode_input_bytes_total', sum(video.file_size or 0 for video in sources), labels)
+    inc('videoapi_encode_output_bytes_total', sum(video.file_size or 0 for video in outputs), labels)
+    if frames and seconds > 0:
+        observe('videoapi_encode_fps', frames / seconds, FPS_BUCKETS, labels)
+
+
+def _collect():
+    _archive_once()
+    with _lock:
+        totals = dict(_own())
+        own_file = f'{_pid}.json'
+    with _directory_lock(exclusive=False):
+        for name in os.listdir(settings.METRICS_DIR):
+            if not name.endswith('.json') or name == own_file:
+                continue
+            try:
+                samples = _read(os.path.join(settings.METRICS_DIR, name))
+            except (OSError, ValueError):
+                continue
+            for sample, labels, value in samples:
+                totals[(sample, labels)] = totals.get((sample, labels), 0) + value
+    return totals
+
+
+def _gauges():
+    samples = {}
+    for queue in settings.VIDEO_QUEUE_CONCURRENCY:
+        for state in (Job.PENDING, Job.STARTED):
+            samples[('videoapi_queue_jobs', (('queue', queue), ('state', state.lower())))] = 0
+    # Followers ride along with the job they joined, they are not queued themselves
+    jobs = Job.objects.filter(state__in=(Job.PENDING, Job.STARTED), leader__isnull=True)
+    jobs = jobs.values('queue', 'state').annotate(count=Count('pk'))
+    for row in jobs.order_by():
+        key = ('videoapi_queue_jobs', (('queue', row['queue'] or settings.CELERY_TASK_DEFAULT_QUEUE),
+                                       ('state', row['state'].lower())))
+        samples[key] = samples.get(key, 0) + row['count']
+
+    areas = {
+        'blobs': Blob.objects.aggregate(bytes=Sum('size'), files=Count('pk')),
+        'unreferenced_blobs': Blob.objects.filter(ref_count__lte=0).aggregate(bytes=Sum('size'), files=Count('pk')),
+        'derived': Derivation.objects.filter(blob__isnull=False).aggregate(bytes=Sum('size'), files=Count('pk')),
+    }
+    # Source files downloaded from object storage by this machine
+    cache = areas['storage_cache'] = {'bytes': 0, 'files': 0}
+    for root, _, names in os.walk(settings.STORAGE_CACHE_DIR):
+        for name in names:
+            try:
+                cache['bytes'] += os.lstat(os.path.join(root, name)).st_size
+                cache['files'] += 1
+            except FileNotFoundError:
+                pass
+    for area, totals in areas.items():
+        samples[('videoapi_storage_bytes', (('area', area),))] = totals['bytes'] or 0
+        samples[('videoapi_storage_files', (('area', area),))] = totals['files']
+    return samples
+
+
+def _metric_of(sample):
+    for suffix in ('_bucket', '_sum', '_count'):
+        if sample.endswith(suffix) and METRICS.get(sample[:-len(suffix)], ('',))[0] == 'histogram':
+            return sample[:-len(suffix)]
+    return sample
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _sort_key(item):
+    (sample, labels), _ = item
+    le = dict(labels).get('le')
+    return sample, [pair for pair in labels if pair[0] != 'le'], float(le) if le is not None else 0
+
+
+def render():
+    samples = _collect()
+    samples.update(_gauges())
+    grouped = {}
+    for item in samples.items():
+        grouped.setdefault(_metric_of(item[0][0]), []).append(item)
+
+    lines = []
+    for metric, (kind, description) in METRICS.items():
+        lines += [f'# HELP {metric} {description}', f'# TYPE {metric} {kind}']
+        for (sample, labels), value in sorted(grouped.get(metric, []), key=_sort_key):
+            text = ','.join(f'{name}="{_escape(value)}"' for name, value in labels)
+            lines.append(f'{sample}{{{text}}} {_format(value)}' if text else f'{sample} {_format(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    # Meant for a scraper on the same host, or behind a proxy that restricts it
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        return HttpResponseForbidden()
+    return HttpResponse(render(), content_type=CONTENT_TYPE)
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    """Time every request by URL name, up to the moment the response is returned."""
+
+    def record(request, response, started):
+        match = request.resolver_match
+        labels = (('view', match.view_name if match else 'unresolved'), ('method', request.method),
+                  ('status', str(response.status_code)))
+        observe('videoapi_http_request_duration_seconds', time.perf_counter() - started,
+                settings.METRICS_LATENCY_BUCKETS, labels)
+        flush()
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            started = time.perf_counter()
+            response = await get_response(request)
+            record(request, response, started)
+            return response
+    else:
+        def middleware(request):
+            started = time.perf_counter()
+            response = get_response(request)
+            record(request, response, started)
+            return response
+    return middleware
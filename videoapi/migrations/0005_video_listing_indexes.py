@@ -0,0 +1,58 @@
+# Generated by Django 5.1.1 on 2026-10-18 19:28
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_file_size(apps, schema_editor):
+    # One stat per existing row now, so listings never need one later
+    Video = apps.get_model('videoapi', 'Video')
+    for video in Video.objects.filter(file_size__isnull=True).iterator():
+        try:
+            video.file_size = video.video_file.size
+        except OSError:
+            continue
+        video.save(update_fields=['file_size'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videoapi', '0004_content_addressed_blobs'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='file_size',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='owner',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='videos', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['-uploaded_at', '-id'], name='video_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['owner', '-uploaded_at', '-id'], name='video_owner_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['is_trimmed', '-uploaded_at', '-id'], name='video_trimmed_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['is_merged', '-uploaded_at', '-id'], name='video_merged_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['duration'], name='video_duration_idx'),
+        ),
+        migrations.RunPython(backfill_file_size, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.1 on 2026-10-18 19:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videoapi', '0007_derivation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='estimated_cost',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='expected_wait',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='priority',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='queue',
+            field=models.CharField(blank=True, db_index=True, max_length=16),
+        ),
+    ]
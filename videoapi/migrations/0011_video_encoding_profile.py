@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 20:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videoapi', '0010_tags'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='encoding_profile',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.1.1 on 2026-10-19 09:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+MEDIA_FIELDS = ['encoding_profile', 'duration', 'container', 'video_codec', 'audio_codec', 'width', 'height', 'fps',
+                'bitrate', 'keyframe_count']
+
+
+def keep_outputs(apps, schema_editor):
+    # Each stored output becomes an artifact with its own reference on the blob
+    Derivation = apps.get_model('videoapi', 'Derivation')
+    Blob = apps.get_model('videoapi', 'Blob')
+    for derivation in Derivation.objects.filter(video__blob__isnull=False).select_related('video'):
+        video = derivation.video
+        derivation.blob_id = video.blob_id
+        derivation.media = {name: getattr(video, name) for name in MEDIA_FIELDS}
+        derivation.save(update_fields=['blob', 'media'])
+        Blob.objects.filter(pk=video.blob_id).update(ref_count=F('ref_count') + 1)
+    Derivation.objects.filter(video__isnull=False, blob__isnull=True).delete()
+
+
+def link_videos(apps, schema_editor):
+    Derivation = apps.get_model('videoapi', 'Derivation')
+    Video = apps.get_model('videoapi', 'Video')
+    for derivation in Derivation.objects.filter(blob__isnull=False):
+        flag = 'is_merged' if derivation.kind == 'merge' else 'is_trimmed'
+        Video.objects.filter(blob_id=derivation.blob_id, **{flag: True}).update(derivation=derivation)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videoapi', '0011_video_encoding_profile'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='derivation',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='videoapi.blob'),
+        ),
+        migrations.AddField(
+            model_name='derivation',
+            name='media',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='owner',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='leader',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='followers', to='videoapi.job'),
+        ),
+        migrations.RunPython(keep_outputs, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='derivation',
+            name='video',
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='derivation',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='videos', to='videoapi.derivation'),
+        ),
+        migrations.RunPython(link_videos, migrations.RunPython.noop),
+    ]
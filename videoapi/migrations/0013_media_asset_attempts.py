@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 20:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videoapi', '0012_derivation_artifacts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediaasset',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
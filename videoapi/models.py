@@ -1,8 +1,138 @@
+import uuid
+from django.conf import settings
 from django.db import models
 
+class Blob(models.Model):
+    # Content-addressed file shared by every Video with identical bytes
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to='blobs/')
+    size = models.PositiveBigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class Tag(models.Model):
+    name = models.CharField(max_length=64, unique=True)
+
+
 class Video(models.Model):
     title = models.CharField(max_length=255)
     video_file = models.FileField(upload_to='videos/')
     is_merged = models.BooleanField(default=False)
     is_trimmed = models.BooleanField(default=False)
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    blob = models.ForeignKey(Blob, null=True, blank=True, on_delete=models.PROTECT, related_name='videos')
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL, related_name='videos'
+    )
+    # Stored so that listings never stat the file
+    file_size = models.PositiveBigIntegerField(null=True, blank=True)
+    tags = models.ManyToManyField(Tag, blank=True, related_name='videos')
+    # ENCODING_PROFILES entry a trim or merge output was encoded with, empty when packets were copied
+    encoding_profile = models.CharField(max_length=32, blank=True, default='')
+    # The memoized trim/merge output this video was handed out from
+    derivation = models.ForeignKey('Derivation', null=True, blank=True, on_delete=models.SET_NULL, related_name='videos')
+
+    # Media metadata recorded by the prober when the file is stored
+    duration = models.FloatField(null=True, blank=True)
+    container = models.CharField(max_length=32, blank=True, default='')
+    video_codec = models.CharField(max_length=32, blank=True, default='')
+    audio_codec = models.CharField(max_length=32, blank=True, default='')
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    fps = models.FloatField(null=True, blank=True)
+    bitrate = models.PositiveIntegerField(null=True, blank=True)
+    keyframe_count = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        # Listings are keyset-paginated on (uploaded_at, id), newest first
+        indexes = [
+            models.Index(fields=['-uploaded_at', '-id'], name='video_recent_idx'),
+            models.Index(fields=['owner', '-uploaded_at', '-id'], name='video_owner_recent_idx'),
+            models.Index(fields=['is_trimmed', '-uploaded_at', '-id'], name='video_trimmed_recent_idx'),
+            models.Index(fields=['is_merged', '-uploaded_at', '-id'], name='video_merged_recent_idx'),
+            models.Index(fields=['duration'], name='video_duration_idx'),
+        ]
+
+
+class UploadSession(models.Model):
+    # A resumable upload, chunks are written straight into `file_name` under MEDIA_ROOT
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    title = models.CharField(max_length=255, blank=True)
+    filename = models.CharField(max_length=255)
+    file_name = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    offset = models.PositiveBigIntegerField(default=0)
+    sha256 = models.CharField(max_length=64, blank=True)
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.CASCADE, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class Job(models.Model):
+    # Tracks a trim/merge Celery task, the primary key doubles as the Celery task id
+    PENDING = 'PENDING'
+    STARTED = 'STARTED'
+    SUCCESS = 'SUCCESS'
+    FAILURE = 'FAILURE'
+    STATES = [(PENDING, 'Pending'), (STARTED, 'Started'), (SUCCESS, 'Success'), (FAILURE, 'Failure')]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(max_length=16)
+    state = models.CharField(max_length=16, choices=STATES, default=PENDING, db_index=True)
+    progress = models.FloatField(default=0)
+    eta = models.FloatField(null=True, blank=True)
+    encode_fps = models.FloatField(null=True, blank=True)
+    # Routing decided at submission, see videoapi/scheduling.py
+    queue = models.CharField(max_length=16, blank=True, db_index=True)
+    priority = models.PositiveSmallIntegerField(default=0)
+    estimated_cost = models.FloatField(default=0)
+    expected_wait = models.FloatField(null=True, blank=True)
+    video = models.ForeignKey(Video, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    # Whoever gets the output video. A request that joins a running derivation gets a job that follows
+    # the one running its task, see videoapi/derivations.py
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    leader = models.ForeignKey('self', null=True, blank=True, on_delete=models.CASCADE, related_name='followers')
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class Derivation(models.Model):
+    # A trim/merge output memoized by its sources and normalized parameters. The output is kept as a
+    # blob reference of its own plus the fields of its videos, every requester gets a Video of their own
+    key = models.CharField(max_length=64, unique=True)
+    kind = models.CharField(max_length=16)
+    params = models.JSONField()
+    job = models.ForeignKey(Job, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    blob = models.ForeignKey(Blob, null=True, blank=True, on_delete=models.PROTECT, related_name='+')
+    media = models.JSONField(null=True, blank=True)
+    size = models.PositiveBigIntegerField(null=True, blank=True)
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_accessed = models.DateTimeField(auto_now_add=True, db_index=True)
+
+
+class MediaAsset(models.Model):
+    # Files built from a stored blob after upload (HLS renditions, ...), kept in the `path` directory of MEDIA_ROOT
+    PENDING = 'PENDING'
+    READY = 'READY'
+    FAILED = 'FAILED'
+    STATES = [(PENDING, 'Pending'), (READY, 'Ready'), (FAILED, 'Failed')]
+
+    blob = models.ForeignKey(Blob, on_delete=models.CASCADE, related_name='assets')
+    kind = models.CharField(max_length=16)
+    state = models.CharField(max_length=16, choices=STATES, default=PENDING)
+    path = models.CharField(max_length=255, blank=True)
+    data = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    # Failed builds so far, a failed asset is retried with a growing delay up to POSTPROCESS_MAX_ATTEMPTS
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['blob', 'kind'], name='unique_blob_asset')]
@@ -0,0 +1,228 @@
+# videoapi/objectstore.py
+# A small S3-compatible server that keeps objects as files, a stand-in for a real
+# object store in tests and local development (`python manage.py objectstore`).
+# It speaks the subset ObjectStorage uses: object PUT/GET/HEAD/DELETE with
+# ranges and multipart uploads, over keep-alive HTTP/1.1.
+import os
+import re
+import shutil
+import threading
+import uuid
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit, parse_qs
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+COPY_CHUNK = 1024 * 1024
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+UPLOADS = '.uploads'
+
+
+class ObjectStoreHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _parse(self):
+        parts = urlsplit(self.path)
+        self.query = {key: values[0] for key, values in parse_qs(parts.query, keep_blank_values=True).items()}
+        bucket, _, key = unquote(parts.path).lstrip('/').partition('/')
+        if not bucket or bucket.startswith('.') or any(part in ('', '.', '..') for part in key.split('/') if key):
+            self.bucket_dir = self.object_path = None
+            return
+        self.bucket_dir = os.path.join(self.server.root, bucket)
+        self.object_path = os.path.join(self.bucket_dir, *key.split('/')) if key else None
+
+    def _authorized(self):
+        credential = f'Credential={self.server.access_key}/'
+        if credential in self.headers.get('Authorization', ''):
+            return True
+        self._error(403, 'AccessDenied')
+        return False
+
+    def _send(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _xml(self, status, tag, **fields):
+        body = ''.join(f'<{name}>{escape(str(value))}</{name}>' for name, value in fields.items())
+        self._send(status, f'<?xml version="1.0" encoding="UTF-8"?><{tag}>{body}</{tag}>'.encode(),
+                   {'Content-Type': 'application/xml'})
+
+    def _error(self, status, code):
+        self._xml(status, 'Error', Code=code)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def _write_body(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = f'{path}.{uuid.uuid4().hex}.part'
+        remaining = int(self.headers.get('Content-Length') or 0)
+        with open(partial, 'wb') as handle:
+            while remaining > 0:
+                data = self.rfile.read(min(COPY_CHUNK, remaining))
+                if not data:
+                    break
+                handle.write(data)
+                remaining -= len(data)
+        os.replace(partial, path)
+        return _etag(os.stat(path))
+
+    def _upload_dir(self, upload_id):
+        if not re.fullmatch(r'[0-9a-f]{32}', upload_id):
+            return None
+        path = os.path.join(self.server.root, UPLOADS, upload_id)
+        return path if os.path.isdir(path) else None
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        self._parse()
+        if not self._authorized():
+            return
+        if self.object_path is None or not os.path.isfile(self.object_path):
+            return self._error(404, 'NoSuchKey')
+
+        with open(self.object_path, 'rb') as handle:
+            stat = os.fstat(handle.fileno())
+            etag = _etag(stat)
+            if_match = self.headers.get('If-Match')
+            if if_match and if_match != etag:
+                return self._error(412, 'PreconditionFailed')
+            headers = {'ETag': etag, 'Last-Modified': formatdate(stat.st_mtime, usegmt=True),
+                       'Accept-Ranges': 'bytes', 'Content-Type': 'application/octet-stream'}
+            first, last, status = 0, stat.st_size - 1, 200
+            match = RANGE_RE.match(self.headers.get('Range', ''))
+            if match and match.groups() != ('', ''):
+                if match.group(1):
+                    first = int(match.group(1))
+                    last = min(int(match.group(2)), last) if match.group(2) else last
+                else:
+                    first = max(stat.st_size - int(match.group(2)), 0)
+                if first > last:
+                    return self._error(416, 'InvalidRange')
+                headers['Content-Range'] = f'bytes {first}-{last}/{stat.st_size}'
+                status = 206
+
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(last - first + 1))
+            self.end_headers()
+            if self.command == 'HEAD':
+                return
+            handle.seek(first)
+            remaining = last - first + 1
+            while remaining > 0:
+                data = handle.read(min(COPY_CHUNK, remaining))
+                if not data:
+                    break
+                self.wfile.write(data)
+                remaining -= len(data)
+
+    def do_PUT(self):
+        self._parse()
+        if not self._authorized():
+            return
+        if self.bucket_dir is None:
+            return self._error(400, 'InvalidURI')
+        if self.object_path is None:
+            os.makedirs(self.bucket_dir, exist_ok=True)
+            return self._send(200)
+        if not os.path.isdir(self.bucket_dir):
+            self._body()
+            return self._error(404, 'NoSuchBucket')
+
+        if 'uploadId' in self.query:
+            upload = self._upload_dir(self.query['uploadId'])
+            number = self.query.get('partNumber', '')
+            if upload is None or not number.isdigit():
+                self._body()
+                return self._error(404, 'NoSuchUpload')
+            etag = self._write_body(os.path.join(upload, f'{int(number):05d}'))
+        else:
+            etag = self._write_body(self.object_path)
+        self._send(200, headers={'ETag': etag})
+
+    def do_POST(self):
+        self._parse()
+        if not self._authorized():
+            return
+        if self.object_path is None:
+            return self._error(400, 'InvalidURI')
+        if 'uploads' in self.query:
+            if not os.path.isdir(self.bucket_dir):
+                return self._error(404, 'NoSuchBucket')
+            upload_id = uuid.uuid4().hex
+            os.makedirs(os.path.join(self.server.root, UPLOADS, upload_id))
+            return self._xml(200, 'InitiateMultipartUploadResult', UploadId=upload_id)
+
+        upload = self._upload_dir(self.query.get('uploadId', ''))
+        body = self._body()
+        if upload is None:
+            return self._error(404, 'NoSuchUpload')
+        parts = ElementTree.fromstring(body).iter()
+        numbers = [int(part.text) for part in parts if part.tag.endswith('PartNumber')]
+        paths = [os.path.join(upload, f'{number:05d}') for number in numbers]
+        if not numbers or numbers != sorted(set(numbers)) or not all(os.path.isfile(path) for path in paths):
+            return self._error(400, 'InvalidPart')
+
+        os.makedirs(os.path.dirname(self.object_path), exist_ok=True)
+        partial = f'{self.object_path}.{uuid.uuid4().hex}.part'
+        with open(partial, 'wb') as target:
+            for path in paths:
+                with open(path, 'rb') as source:
+                    shutil.copyfileobj(source, target, COPY_CHUNK)
+        os.replace(partial, self.object_path)
+        shutil.rmtree(upload, ignore_errors=True)
+        self.server.completed_uploads += 1
+        self._xml(200, 'CompleteMultipartUploadResult', ETag=_etag(os.stat(self.object_path)))
+
+    def do_DELETE(self):
+        self._parse()
+        if not self._authorized():
+            return
+        if 'uploadId' in self.query:
+            upload = self._upload_dir(self.query['uploadId'])
+            if upload is not None:
+                shutil.rmtree(upload, ignore_errors=True)
+            return self._send(204)
+        if self.object_path is not None and os.path.isfile(self.object_path):
+            os.remove(self.object_path)
+        self._send(204)
+
+
+def _etag(stat):
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+class ObjectStoreServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, root, access_key, buckets=()):
+        super().__init__(address, ObjectStoreHandler)
+        self.root = root
+        self.access_key = access_key
+        self.completed_uploads = 0
+        for bucket in buckets:
+            os.makedirs(os.path.join(root, bucket), exist_ok=True)
+
+    @property
+    def endpoint_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        """Serve from a daemon thread, for tests."""
+        thread = threading.Thread(target=self.serve_forever, name='objectstore', daemon=True)
+        thread.start()
+        return thread
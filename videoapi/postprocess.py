@@ -0,0 +1,136 @@
+# videoapi/postprocess.py
+# Optional stages run on a stored video after upload. Each stage builds a
+# MediaAsset for the video's blob, so identical uploads share one set of files.
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from django.conf import settings
+from django.core import checks
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import default_storage
+from django.db.models import F
+from django.utils import timezone
+from .media import hls_ladder, package_hls, probe_streams
+from .models import MediaAsset
+from .previews import build_previews
+from .storage import local_file, local_path
+from .waveform import build_waveform
+
+
+def asset_dir(blob, kind):
+    # Relative to MEDIA_ROOT, one directory per content hash and stage
+    return os.path.join(kind, blob.sha256[:2], blob.sha256)
+
+
+def build_hls(src, out_dir):
+    info = probe_streams(src)
+    ladder = hls_ladder(info, settings.HLS_RENDITIONS)
+    package_hls(src, out_dir, ladder, segment_seconds=settings.HLS_SEGMENT_SECONDS, info=info)
+    return {'renditions': [{'name': rung['name'], 'height': rung['height']} for rung in ladder]}
+
+
+# Stage name -> builder(source path, output directory) returning the asset's data
+STAGES = {
+    'hls': build_hls,
+    'previews': build_previews,
+    'waveform': build_waveform,
+}
+
+
+def assets_storable():
+    # Asset directories are written and served under MEDIA_ROOT, which only the local storage shares
+    return local_path(default_storage, 'videos') is not None
+
+
+def check_asset_storage(app_configs, **kwargs):
+    stages = [*settings.VIDEO_POSTPROCESS_STAGES, *settings.DERIVED_POSTPROCESS_STAGES]
+    if stages and not assets_storable():
+        return [checks.Error(
+            'Post-processing stages need a local default storage.',
+            hint='Set VIDEO_POSTPROCESS_STAGES and DERIVED_POSTPROCESS_STAGES to [] with object storage.',
+            id='videoapi.E001',
+        )]
+    return []
+
+
+def retry_at(asset):
+    """When a failed asset may be built again, None once it is out of attempts."""
+    if asset.attempts >= settings.POSTPROCESS_MAX_ATTEMPTS:
+        return None
+    return asset.updated_at + timedelta(seconds=settings.POSTPROCESS_RETRY_DELAY * 2 ** (asset.attempts - 1))
+
+
+def claim_assets(video, stages=None):
+    """
+    Create the missing assets of `video` for the enabled stages and return the
+    ones that need building. A failed asset is claimed back to PENDING once its
+    retry is due, by one caller only.
+    """
+    if not video.blob_id:
+        return []
+    claimed = []
+    for kind in stages if stages is not None else settings.VIDEO_POSTPROCESS_STAGES:
+        asset, created = MediaAsset.objects.get_or_create(blob_id=video.blob_id, kind=kind)
+        if created:
+            claimed.append(asset)
+        elif asset.state == MediaAsset.FAILED:
+            due = retry_at(asset)
+            if due is not None and due <= timezone.now() and MediaAsset.objects.filter(
+                pk=asset.pk, state=MediaAsset.FAILED, attempts=asset.attempts
+            ).update(state=MediaAsset.PENDING, updated_at=timezone.now()):
+                claimed.append(asset)
+    return claimed
+
+
+def build_asset(asset_id):
+    """Run a stage into a scratch directory and move the result in place once it is complete."""
+    asset = MediaAsset.objects.select_related('blob').get(pk=asset_id)
+    if asset.state != MediaAsset.PENDING:
+        # Built, or failed, by an earlier copy of the task
+        return asset.data
+    name = asset_dir(asset.blob, asset.kind)
+    target = os.path.join(settings.MEDIA_ROOT, name)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    scratch = tempfile.mkdtemp(dir=os.path.dirname(target))
+    try:
+        if not assets_storable():
+            raise ImproperlyConfigured('Post-processing stages need a local default storage.')
+        with local_file(asset.blob.file) as source:
+            data = STAGES[asset.kind](source, scratch)
+        shutil.rmtree(target, ignore_errors=True)
+        os.replace(scratch, target)
+    except Exception as exc:
+        shutil.rmtree(scratch, ignore_errors=True)
+        MediaAsset.objects.filter(pk=asset.pk).update(state=MediaAsset.FAILED, error=str(exc), attempts=F('attempts') + 1,
+                                                      updated_at=timezone.now())
+        raise
+    MediaAsset.objects.filter(pk=asset.pk).update(
+        state=MediaAsset.READY, path=name, data=data, error='', updated_at=timezone.now()
+    )
+    return data
+
+
+def build_derived_assets(video):
+    """Build the DERIVED_POSTPROCESS_STAGES of a trim or merge output in the task that wrote it."""
+    for asset in claim_assets(video, settings.DERIVED_POSTPROCESS_STAGES):
+        try:
+            build_asset(asset.pk)
+        except Exception:
+            # Recorded on the asset, the output itself is fine
+            pass
+
+
+def ready_asset(video, kind):
+    if not video.blob_id:
+        return None
+    return MediaAsset.objects.filter(blob_id=video.blob_id, kind=kind, state=MediaAsset.READY).first()
+
+
+def asset_file(asset, name):
+    """Absolute path of `name` inside an asset's directory, None for anything outside of it."""
+    root = os.path.realpath(os.path.join(settings.MEDIA_ROOT, asset.path))
+    path = os.path.realpath(os.path.join(root, name))
+    if os.path.commonpath([root, path]) != root or not os.path.isfile(path):
+        return None
+    return path
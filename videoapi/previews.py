@@ -0,0 +1,93 @@
+# videoapi/previews.py
+# Poster, scrub sprites with a WebVTT map and per-sample scene scores, built
+# from frames sampled at a fixed interval in one decode pass.
+import os
+import numpy as np
+from PIL import Image
+from django.conf import settings
+from .media import MediaError, probe_streams, sample_frames, extract_frame
+
+
+def tile(frames, columns):
+    """Lay (count, height, width, 3) frames out row by row on one sheet, the last row is padded with black."""
+    count, height, width, channels = frames.shape
+    rows = -(-count // columns)
+    padded = np.zeros((rows * columns, height, width, channels), dtype=frames.dtype)
+    padded[:count] = frames
+    return padded.reshape(rows, columns, height, width, channels).swapaxes(1, 2).reshape(
+        rows * height, columns * width, channels
+    )
+
+
+def scene_scores(frames):
+    # Mean absolute change from the previous sample, 0 for a still picture and 1 for black to white
+    if len(frames) < 2:
+        return [0.0] * len(frames)
+    changes = np.abs(np.diff(frames.astype(np.int16), axis=0)).mean(axis=(1, 2, 3)) / 255
+    return [0.0] + changes.round(4).tolist()
+
+
+def poster_index(frames):
+    # The sample with the most detail, which skips fades, black intros and title cards
+    gray = frames.mean(axis=3)
+    return int(gray.reshape(len(frames), -1).std(axis=1).argmax())
+
+
+def vtt_time(seconds):
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f'{int(hours):02d}:{int(minutes):02d}:{seconds:06.3f}'
+
+
+def build_vtt(times, duration, sheets, columns, per_sheet, width, height):
+    lines = ['WEBVTT', '']
+    for index, start in enumerate(times):
+        end = times[index + 1] if index + 1 < len(times) else max(duration, start)
+        position = index % per_sheet
+        x, y = position % columns * width, position // columns * height
+        lines += [f'{vtt_time(start)} --> {vtt_time(end)}', f'{sheets[index // per_sheet]}#xywh={x},{y},{width},{height}', '']
+    return '\n'.join(lines)
+
+
+def build_previews(src, out_dir):
+    info = probe_streams(src)
+    video = info.get('video') or {}
+    if not video.get('width') or not video.get('height'):
+        raise MediaError('Source has no video stream')
+    duration = info.get('duration') or 0
+    # Long videos are sampled less often so the index stays bounded
+    interval = max(settings.PREVIEW_INTERVAL, duration / settings.PREVIEW_MAX_SAMPLES)
+    width = settings.PREVIEW_THUMB_WIDTH
+    height = max(round(width * video['height'] / video['width'] / 2) * 2, 2)
+
+    frames = list(sample_frames(src, interval, width, height))
+    if not frames:
+        raise MediaError('No frames could be decoded from the source')
+    frames = np.stack(frames)
+    times = [round(index * interval, 3) for index in range(len(frames))]
+    scores = scene_scores(frames)
+
+    columns = settings.PREVIEW_SPRITE_COLUMNS
+    per_sheet = columns * settings.PREVIEW_SPRITE_ROWS
+    sheets = []
+    for start in range(0, len(frames), per_sheet):
+        name = f'sprite_{start // per_sheet}.jpg'
+        Image.fromarray(tile(frames[start:start + per_sheet], columns)).save(os.path.join(out_dir, name), quality=80)
+        sheets.append(name)
+    with open(os.path.join(out_dir, 'thumbnails.vtt'), 'w') as handle:
+        handle.write(build_vtt(times, duration, sheets, columns, per_sheet, width, height))
+
+    poster_time = times[poster_index(frames)]
+    extract_frame(src, poster_time, os.path.join(out_dir, 'poster.jpg'), min(settings.PREVIEW_POSTER_WIDTH, video['width']))
+
+    return {
+        'interval': interval,
+        'thumb_width': width,
+        'thumb_height': height,
+        'columns': columns,
+        'poster': 'poster.jpg',
+        'poster_time': poster_time,
+        'vtt': 'thumbnails.vtt',
+        'sprites': sheets,
+        'samples': [{'time': time, 'score': score} for time, score in zip(times, scores)],
+    }
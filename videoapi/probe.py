@@ -0,0 +1,264 @@
+# videoapi/probe.py
+# Lightweight media probing. MP4/MOV files are read straight from their atoms,
+# anything else goes through ffprobe (or the bundled ffmpeg when it is missing).
+import json
+import os
+import shutil
+import struct
+import subprocess
+from bisect import bisect_right
+from .media import MediaError, probe_streams, keyframe_times as decode_keyframe_times
+
+CONTAINER_ATOMS = {b'moov', b'trak', b'mdia', b'minf', b'stbl', b'edts'}
+CODEC_NAMES = {
+    'avc1': 'h264', 'avc3': 'h264', 'hvc1': 'hevc', 'hev1': 'hevc', 'mp4v': 'mpeg4', 'av01': 'av1',
+    'vp09': 'vp9', 'mp4a': 'aac', 'ac-3': 'ac3', 'ec-3': 'eac3', 'Opus': 'opus', '.mp3': 'mp3',
+}
+PARSE_ERRORS = (MediaError, struct.error, ValueError, TypeError, KeyError, IndexError, ZeroDivisionError)
+MEDIA_FIELDS = (
+    'duration', 'container', 'video_codec', 'audio_codec', 'width', 'height', 'fps', 'bitrate', 'keyframe_count',
+)
+
+
+def _iter_atoms(handle, start, end):
+    offset = start
+    while offset + 8 <= end:
+        handle.seek(offset)
+        header = handle.read(8)
+        if len(header) < 8:
+            return
+        size, kind = struct.unpack('>I4s', header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', handle.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size:
+            return
+        yield kind, offset + header_size, offset + size
+        offset += size
+
+
+def _read(handle, start, end):
+    handle.seek(start)
+    return handle.read(end - start)
+
+
+def _parse_track(handle, start, end):
+    track = {}
+    for kind, body_start, body_end in _iter_atoms(handle, start, end):
+        if kind in CONTAINER_ATOMS:
+            for key, value in _parse_track(handle, body_start, body_end).items():
+                track.setdefault(key, value)
+        elif kind == b'mdhd':
+            data = _read(handle, body_start, body_end)
+            if data[0] == 1:
+                track['timescale'], track['media_duration'] = struct.unpack('>IQ', data[20:32])
+            else:
+                track['timescale'], track['media_duration'] = struct.unpack('>II', data[12:20])
+        elif kind == b'hdlr' and 'handler' not in track:
+            # QuickTime files carry a second, data-reference hdlr inside minf
+            track['handler'] = _read(handle, body_start + 8, body_start + 12).decode('latin1')
+        elif kind == b'stsd':
+            data = _read(handle, body_start, min(body_end, body_start + 64))
+            track['fourcc'] = data[12:16].decode('latin1')
+            # Only meaningful for visual sample entries
+            track['width'], track['height'] = struct.unpack('>HH', data[40:44])
+        elif kind == b'stts':
+            data = _read(handle, body_start, body_end)
+            count = struct.unpack('>I', data[4:8])[0]
+            track['stts'] = [struct.unpack('>II', data[8 + i * 8:16 + i * 8]) for i in range(count)]
+        elif kind == b'ctts':
+            data = _read(handle, body_start, body_end)
+            count = struct.unpack('>I', data[4:8])[0]
+            signed = data[0] == 1
+            track['ctts'] = [struct.unpack('>Ii' if signed else '>II', data[8 + i * 8:16 + i * 8]) for i in range(count)]
+        elif kind == b'stss':
+            data = _read(handle, body_start, body_end)
+            count = struct.unpack('>I', data[4:8])[0]
+            track['stss'] = struct.unpack(f'>{count}I', data[8:8 + count * 4])
+        elif kind == b'elst':
+            data = _read(handle, body_start, body_end)
+            if struct.unpack('>I', data[4:8])[0]:
+                if data[0] == 1:
+                    track['media_time'] = struct.unpack('>q', data[16:24])[0]
+                else:
+                    track['media_time'] = struct.unpack('>i', data[12:16])[0]
+    return track
+
+
+def _sync_sample_times(track):
+    # Decode times from stts, shifted by the composition offset and the edit list
+    starts, time, sample = [], 0, 1
+    for count, delta in track.get('stts', []):
+        starts.append((sample, time, delta))
+        sample += count
+        time += count * delta
+    offsets, sample = [], 1
+    for count, offset in track.get('ctts', []):
+        offsets.append((sample, offset))
+        sample += count
+
+    # Without an stss atom every sample is a sync sample
+    total = sum(count for count, _ in track.get('stts', []))
+    sync = track.get('stss') or range(1, total + 1)
+    sample_numbers = [entry[0] for entry in starts]
+    offset_numbers = [entry[0] for entry in offsets]
+    times = []
+    for number in sync:
+        first, base, delta = starts[bisect_right(sample_numbers, number) - 1]
+        dts = base + (number - first) * delta
+        if offsets:
+            dts += offsets[bisect_right(offset_numbers, number) - 1][1]
+        times.append(max(dts - max(track.get('media_time', 0), 0), 0) / track['timescale'])
+    return times
+
+
+def parse_mp4(handle):
+    """Read duration, codecs, geometry and keyframes from an MP4/MOV without decoding it."""
+    handle.seek(0, os.SEEK_END)
+    file_size = handle.tell()
+    info = {'container': None, 'duration': None}
+    tracks = []
+    fragmented = False
+    for kind, body_start, body_end in _iter_atoms(handle, 0, file_size):
+        if kind == b'moof':
+            fragmented = True
+        elif kind == b'ftyp':
+            brand = _read(handle, body_start, body_start + 4)
+            info['container'] = 'mov' if brand == b'qt  ' else 'mp4'
+        elif kind == b'moov':
+            for child, child_start, child_end in _iter_atoms(handle, body_start, body_end):
+                if child == b'mvhd':
+                    data = _read(handle, child_start, child_end)
+                    if data[0] == 1:
+                        timescale, duration = struct.unpack('>IQ', data[20:32])
+                    else:
+                        timescale, duration = struct.unpack('>II', data[12:20])
+                    info['duration'] = duration / timescale if timescale else None
+                elif child == b'trak':
+                    tracks.append(_parse_track(handle, child_start, child_end))
+                elif child == b'mvex':
+                    fragmented = True
+    if info['container'] is None or info['duration'] is None:
+        raise MediaError('Not an MP4/MOV file')
+    if fragmented or not info['duration']:
+        # The samples of a fragmented file are in its moof atoms, moov only has an empty index
+        raise MediaError('Fragmented MP4, the moov atom does not describe the samples')
+
+    video = next((t for t in tracks if t.get('handler') == 'vide' and t.get('timescale')), None)
+    audio = next((t for t in tracks if t.get('handler') == 'soun'), None)
+    info.update({
+        'video_codec': CODEC_NAMES.get(video.get('fourcc'), video.get('fourcc')) if video else None,
+        'audio_codec': CODEC_NAMES.get(audio.get('fourcc'), audio.get('fourcc')) if audio else None,
+        'width': video.get('width') if video else None,
+        'height': video.get('height') if video else None,
+        'fps': None,
+        'bitrate': int(file_size * 8 / info['duration']) if info['duration'] else None,
+        'keyframe_count': None,
+        'keyframes': None,
+    })
+    if video and video.get('stts') and video.get('media_duration'):
+        samples = sum(count for count, _ in video['stts'])
+        info['fps'] = round(samples * video['timescale'] / video['media_duration'], 3)
+        info['keyframes'] = _sync_sample_times(video)
+        info['keyframe_count'] = len(info['keyframes'])
+    return info
+
+
+def _probe_with_ffprobe(path):
+    output = subprocess.run(
+        ['ffprobe', '-v', 'error', '-show_format', '-show_streams', '-of', 'json', path],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True,
+    ).stdout
+    data = json.loads(output)
+    streams = data.get('streams', [])
+    video = next((s for s in streams if s.get('codec_type') == 'video'), {})
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), {})
+    fmt = data.get('format', {})
+    fps = None
+    if video.get('avg_frame_rate', '0/0') != '0/0':
+        numerator, denominator = video['avg_frame_rate'].split('/')
+        fps = round(int(numerator) / int(denominator), 3) if int(denominator) else None
+    return {
+        'container': fmt.get('format_name', '').split(',')[0] or None,
+        'duration': float(fmt['duration']) if fmt.get('duration') else None,
+        'video_codec': video.get('codec_name'),
+        'audio_codec': audio.get('codec_name'),
+        'width': video.get('width'),
+        'height': video.get('height'),
+        'fps': fps,
+        'bitrate': int(fmt['bit_rate']) if fmt.get('bit_rate') else None,
+        'keyframe_count': None,
+        'keyframes': None,
+    }
+
+
+def _probe_with_ffmpeg(path):
+    streams = probe_streams(path)
+    video = streams['video'] or {}
+    audio = streams['audio'] or {}
+    return {
+        'container': streams['container'],
+        'duration': streams['duration'],
+        'video_codec': video.get('codec'),
+        'audio_codec': audio.get('codec'),
+        'width': video.get('width'),
+        'height': video.get('height'),
+        'fps': video.get('fps'),
+        'bitrate': streams['bitrate'],
+        'keyframe_count': None,
+        'keyframes': None,
+    }
+
+
+def probe_media(source):
+    """
+    Probe a path or an uploaded file. Returns a dict with the MEDIA_FIELDS plus
+    `keyframes` (a list of seconds, or None when only an external prober was used).
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as handle:
+            try:
+                return parse_mp4(handle)
+            except PARSE_ERRORS:
+                pass
+        path = os.fspath(source)
+    else:
+        position = source.tell()
+        try:
+            return parse_mp4(source)
+        except PARSE_ERRORS:
+            pass
+        finally:
+            source.seek(position)
+        if not hasattr(source, 'temporary_file_path'):
+            raise MediaError('Unsupported video format')
+        path = source.temporary_file_path()
+
+    if shutil.which('ffprobe'):
+        try:
+            return _probe_with_ffprobe(path)
+        except (subprocess.CalledProcessError, ValueError, KeyError):
+            pass
+    return _probe_with_ffmpeg(path)
+
+
+def media_fields(info):
+    # Video model field values for a probe result, text fields must not be None
+    fields = {name: info.get(name) for name in MEDIA_FIELDS}
+    for name in ('container', 'video_codec', 'audio_codec'):
+        fields[name] = fields[name] or ''
+    return fields
+
+
+def keyframe_times(path):
+    info = None
+    try:
+        info = probe_media(path)
+    except MediaError:
+        pass
+    if info and info.get('keyframes') is not None:
+        return info['keyframes']
+    return decode_keyframe_times(path)
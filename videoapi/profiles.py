@@ -0,0 +1,43 @@
+# videoapi/profiles.py
+# Named encoding profiles (settings.ENCODING_PROFILES) that trim and merge requests pick from.
+from django.conf import settings
+
+
+def profile_name(name=None):
+    """Validate a requested profile name, None picks DEFAULT_ENCODING_PROFILE."""
+    name = settings.DEFAULT_ENCODING_PROFILE if name is None else name
+    if not isinstance(name, str) or name not in settings.ENCODING_PROFILES:
+        choices = ', '.join(f'"{choice}"' for choice in settings.ENCODING_PROFILES)
+        raise ValueError(f'Profile must be one of {choices}.')
+    return name
+
+
+def get_profile(name=None):
+    return settings.ENCODING_PROFILES[profile_name(name)]
+
+
+def encoding_params(name=None):
+    # The settings are part of the derivation key, so retuning a profile makes new outputs
+    name = profile_name(name)
+    return {'profile': name, 'encoding': get_profile(name)}
+
+
+def moviepy_options(name=None):
+    """Keyword arguments for moviepy's write_videofile."""
+    profile = get_profile(name)
+    params = ['-pix_fmt', profile['pix_fmt']] if profile.get('pix_fmt') else []
+    if profile.get('crf') is not None:
+        params += ['-crf', str(profile['crf'])]
+    options = {
+        'codec': profile.get('codec', 'libx264'),
+        'audio_codec': profile.get('audio_codec', 'aac'),
+        'threads': profile.get('threads') or None,
+        'ffmpeg_params': params,
+    }
+    if profile.get('preset'):
+        options['preset'] = profile['preset']
+    if profile.get('crf') is None and profile.get('video_bitrate'):
+        options['bitrate'] = str(profile['video_bitrate'])
+    if profile.get('audio_bitrate'):
+        options['audio_bitrate'] = str(profile['audio_bitrate'])
+    return options
@@ -0,0 +1,160 @@
+# videoapi/profiling.py
+# Opt-in cProfile runs of API requests and Celery tasks, written to PROFILE_DIR as
+# pstats files (snakeviz, tuna or flameprof turn them into flame graphs). With
+# PROFILING_ENABLED off the middleware removes itself and the task hooks return
+# straight away.
+import cProfile
+import hmac
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.decorators import sync_and_async_middleware
+
+HEADER = 'X-Profile'
+SEPARATOR = '__'
+
+# One profile at a time: profilers hook the interpreter, and a second one would
+# either replace the first or fail to start
+_active = threading.Lock()
+_task_profiles = {}
+
+
+class Profile:
+    """A cProfile run of one request or task. `stop()` writes it and returns the file name."""
+
+    def __init__(self, kind, target):
+        self.kind = kind
+        self.target = target
+        self.profiler = None
+
+    def start(self):
+        if not _active.acquire(blocking=False):
+            return False
+        self.started = time.perf_counter()
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+        return True
+
+    def stop(self, target=None):
+        if self.profiler is None:
+            return None
+        self.profiler.disable()
+        _active.release()
+        elapsed = time.perf_counter() - self.started
+        target = re.sub(r'[^\w.-]+', '-', target or self.target).strip('-') or 'unknown'
+        name = SEPARATOR.join([time.strftime('%Y%m%dT%H%M%S'), self.kind, target, f'{elapsed * 1000:.0f}ms',
+                               uuid.uuid4().hex[:8]]) + '.prof'
+        os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+        self.profiler.dump_stats(os.path.join(settings.PROFILE_DIR, name))
+        self.profiler = None
+        trim_profiles()
+        return name
+
+
+def list_profiles():
+    """The stored profiles, newest first, with the fields encoded in their names."""
+    try:
+        names = [name for name in os.listdir(settings.PROFILE_DIR) if name.endswith('.prof')]
+    except FileNotFoundError:
+        return []
+    profiles = []
+    for name in sorted(names, reverse=True):
+        fields = name[:-len('.prof')].split(SEPARATOR)
+        if len(fields) != 5:
+            continue
+        try:
+            size = os.path.getsize(os.path.join(settings.PROFILE_DIR, name))
+        except FileNotFoundError:
+            continue
+        created, kind, target, duration, _ = fields
+        profiles.append({'name': name, 'created': created, 'kind': kind, 'target': target,
+                         'duration_ms': int(duration[:-2]), 'size': size})
+    return profiles
+
+
+def profile_path(name):
+    # Only names listed in PROFILE_DIR, never a path
+    if os.path.basename(name) != name or not name.endswith('.prof'):
+        return None
+    path = os.path.join(settings.PROFILE_DIR, name)
+    return path if os.path.isfile(path) else None
+
+
+def trim_profiles():
+    for profile in list_profiles()[settings.PROFILE_MAX_FILES:]:
+        try:
+            os.remove(os.path.join(settings.PROFILE_DIR, profile['name']))
+        except FileNotFoundError:
+            pass
+
+
+def wants_profile(request):
+    token = settings.PROFILE_HEADER_TOKEN
+    header = request.headers.get(HEADER)
+    if token and header is not None:
+        return hmac.compare_digest(header.encode(), token.encode())
+    return random.random() < settings.PROFILE_SAMPLE_RATE
+
+
+@sync_and_async_middleware
+def profiling_middleware(get_response):
+    """
+    Profile sampled requests and those that carry `X-Profile: <PROFILE_HEADER_TOKEN>`.
+    The response names the file in an X-Profile-Id header. Profiles of async
+    views include whatever else ran on the event loop in the meantime.
+    """
+    if not settings.PROFILING_ENABLED:
+        raise MiddlewareNotUsed
+
+    def finish(profile, request, response):
+        match = request.resolver_match
+        name = profile.stop(match.view_name if match else request.path)
+        if name:
+            response['X-Profile-Id'] = name
+        return response
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            profile = Profile('request', request.path)
+            if not wants_profile(request) or not profile.start():
+                return await get_response(request)
+            try:
+                response = await get_response(request)
+            except BaseException:
+                profile.stop()
+                raise
+            return finish(profile, request, response)
+    else:
+        def middleware(request):
+            profile = Profile('request', request.path)
+            if not wants_profile(request) or not profile.start():
+                return get_response(request)
+            try:
+                response = get_response(request)
+            except BaseException:
+                profile.stop()
+                raise
+            return finish(profile, request, response)
+    return middleware
+
+
+def task_started(task_id, name):
+    if not settings.PROFILING_ENABLED:
+        return
+    if '*' not in settings.PROFILE_TASKS and name not in settings.PROFILE_TASKS:
+        return
+    profile = Profile('task', name)
+    if profile.start():
+        _task_profiles[task_id] = profile
+
+
+def task_finished(task_id):
+    profile = _task_profiles.pop(task_id, None)
+    if profile is not None:
+        profile.stop()
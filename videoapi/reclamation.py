@@ -0,0 +1,81 @@
+# videoapi/reclamation.py
+# Background removal of files nothing references any more, run by the
+# reclaim_storage task that django_celery_beat schedules.
+import os
+import shutil
+import time
+from django.conf import settings
+from .blobs import reclaim_blobs
+from .models import Blob, MediaAsset, UploadSession, Video
+from .postprocess import STAGES, asset_dir
+from .storage import local_path
+
+
+def _mtime(path):
+    try:
+        return os.lstat(path).st_mtime
+    except FileNotFoundError:
+        return None
+
+
+def _sweep_files(directory, referenced, cutoff):
+    # Files under MEDIA_ROOT/`directory` whose name is not referenced and that were not touched since `cutoff`
+    removed = 0
+    for root, _, names in os.walk(os.path.join(settings.MEDIA_ROOT, directory)):
+        for name in names:
+            path = os.path.join(root, name)
+            relative = os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, '/')
+            mtime = _mtime(path)
+            if relative in referenced or mtime is None or mtime >= cutoff:
+                continue
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+def sweep_orphans(min_age=None):
+    """
+    Delete what is left under MEDIA_ROOT without a row pointing at it and untouched
+    for `min_age` seconds: outputs of failed tasks, files of deleted videos that
+    predate the blob store, blob copies whose row was never written and abandoned
+    post-processing directories. Returns the number of files and directories removed.
+    """
+    min_age = settings.RECLAIM_ORPHAN_MIN_AGE if min_age is None else min_age
+    cutoff = time.time() - min_age
+
+    # Task outputs and uploads are staged in the upload directory of Video.video_file
+    staging = Video._meta.get_field('video_file').upload_to
+    referenced = set(Video.objects.filter(video_file__startswith=staging).values_list('video_file', flat=True))
+    referenced.update(UploadSession.objects.values_list('file_name', flat=True))
+    removed = _sweep_files(staging, referenced, cutoff)
+
+    blob_field = Blob._meta.get_field('file')
+    if local_path(blob_field.storage, blob_field.upload_to) is not None:
+        removed += _sweep_files(blob_field.upload_to, set(Blob.objects.values_list('file', flat=True)), cutoff)
+
+    for kind in STAGES:
+        expected = {
+            asset_dir(Blob(sha256=sha256), kind)
+            for sha256 in MediaAsset.objects.filter(kind=kind).values_list('blob__sha256', flat=True)
+        }
+        root = os.path.join(settings.MEDIA_ROOT, kind)
+        if not os.path.isdir(root):
+            continue
+        for prefix in os.listdir(root):
+            if not os.path.isdir(os.path.join(root, prefix)):
+                continue
+            for name in os.listdir(os.path.join(root, prefix)):
+                path = os.path.join(root, prefix, name)
+                mtime = _mtime(path)
+                if os.path.join(kind, prefix, name) in expected or mtime is None or mtime >= cutoff:
+                    continue
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+    return removed
+
+
+def reclaim_storage(min_age=None):
+    return {'blobs': reclaim_blobs(), 'orphans': sweep_orphans(min_age)}
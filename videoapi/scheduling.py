@@ -0,0 +1,87 @@
+# videoapi/scheduling.py
+# Cost estimates and queue routing for trim/merge jobs. Stream copies go to the
+# "fast" queue, re-encodes to "encode", and re-encoding merges to "merge", so a
+# long merge never sits in front of a two second cut.
+import math
+from django.conf import settings
+from django.db.models import F, Q, Sum
+from .models import Job
+
+# Assumed length of a video whose duration was never probed
+UNKNOWN_DURATION = 60
+REFERENCE_PIXELS = 1280 * 720
+
+
+def stored_metadata_matches(videos):
+    # Cheap pre-check on the probed fields before any input is opened
+    probed = [v for v in videos if v.duration is not None]
+    signatures = {(v.video_codec, v.audio_codec, v.width, v.height, round(v.fps or 0, 1)) for v in probed}
+    return len(signatures) <= 1
+
+
+def _duration(video):
+    return video.duration if video.duration is not None else UNKNOWN_DURATION
+
+
+def _scale(videos):
+    # Encoding cost grows with the frame size, unknown sizes count as 720p
+    pixels = max((v.width or 0) * (v.height or 0) for v in videos) or REFERENCE_PIXELS
+    return pixels / REFERENCE_PIXELS
+
+
+def estimate_cost(kind, videos, params):
+    """
+    Estimate a job's queue and its cost in worker seconds, from the stored
+    duration, resolution and number of inputs. Rates come from JOB_COST_RATES.
+    """
+    rates = settings.JOB_COST_RATES
+    scale = _scale(videos)
+    if kind == 'trim':
+        length = params['end'] - params['start']
+        if params['mode'] == 'fast':
+            # Only the partial GOP in front of the cut is encoded
+            return 'fast', rates['overhead'] + rates['copy'] * length + rates['encode'] * scale * min(length, 2)
+        return 'encode', rates['overhead'] + (rates['decode'] + rates['encode']) * scale * length
+    if kind == 'batch_trim':
+        ranges = params['ranges']
+        lengths = sum(end - start for start, end in ranges)
+        if params['mode'] == 'fast':
+            return 'fast', rates['overhead'] * len(ranges) + rates['copy'] * lengths + rates['encode'] * scale * 2
+        span = max(end for _, end in ranges) - min(start for start, _ in ranges)
+        return 'encode', rates['overhead'] + rates['decode'] * scale * span + rates['encode'] * scale * lengths
+    if kind == 'merge':
+        total = sum(_duration(video) for video in videos)
+        overhead = rates['overhead'] * len(videos)
+        if all(v.duration is not None for v in videos) and stored_metadata_matches(videos):
+            return 'fast', overhead + rates['copy'] * total
+        return 'merge', overhead + (rates['decode'] + rates['encode']) * scale * total
+    return 'encode', rates['overhead']
+
+
+def priority_for(cost):
+    # 0 is served first, a job twice as expensive drops roughly one step
+    return min(int(math.log2(1 + cost)), 9)
+
+
+def expected_wait(queue, priority):
+    """
+    Seconds until a new job on `queue` should start: the remaining work of the
+    running jobs plus every queued job that will be served before it, spread
+    over the queue's workers.
+    """
+    ahead = Job.objects.filter(queue=queue, leader__isnull=True).filter(
+        Q(state=Job.STARTED) | Q(state=Job.PENDING, priority__lte=priority)
+    ).aggregate(work=Sum(F('estimated_cost') * (1 - F('progress'))))['work'] or 0
+    return ahead / settings.VIDEO_QUEUE_CONCURRENCY.get(queue, 1)
+
+
+def plan_job(kind, videos, params):
+    """Field values for a new Job: queue, priority, estimated cost and expected wait."""
+    queue, cost = estimate_cost(kind, videos, params)
+    priority = priority_for(cost)
+    return {
+        'queue': queue,
+        'priority': priority,
+        'estimated_cost': round(cost, 2),
+        'expected_wait': round(expected_wait(queue, priority), 2),
+    }
@@ -1,43 +1,51 @@
 # videoapi/serializers.py
 from rest_framework import serializers
-from .models import Video
-from moviepy.editor import VideoFileClip
+from .models import Video, Job
+from .media import MediaError
+from .probe import probe_media, media_fields, MEDIA_FIELDS
 import os
 
-class VideoSerializer(serializers.ModelSerializer):
-    file_size = serializers.SerializerMethodField()
-    title = serializers.CharField(required=False, allow_blank=True)
+# Upload limits shared by the multipart and the resumable upload APIs
+MIN_VIDEO_SIZE = 5 * 1024 * 1024  # 5 MB
+MAX_VIDEO_SIZE = 25 * 1024 * 1024  # 25 MB
+MIN_VIDEO_DURATION = 5
+MAX_VIDEO_DURATION = 25
 
-    class Meta:
-        model = Video
-        fields = ['id', 'title', 'is_merged', 'video_file', 'uploaded_at', 'file_size', 'is_trimmed']
 
-    def get_file_size(self, obj):
-        return obj.video_file.size
+def check_video_size(size):
+    if size < MIN_VIDEO_SIZE:
+        raise serializers.ValidationError("Video size must be at least 5MB")
+    if size > MAX_VIDEO_SIZE:
+        raise serializers.ValidationError("Video size must not exceed 25MB")
 
-    def validate_video_file(self, value):
-        # Define the minimum and maximum file size in bytes
-        min_size = 5 * 1024 * 1024  # 5 MB
-        max_size = 25 * 1024 * 1024  # 25 MB
 
-        # Check file size
-        if value.size < min_size:
-            raise serializers.ValidationError("Video size must be at least 5MB")
-        if value.size > max_size:
-            raise serializers.ValidationError("Video size must not exceed 25MB")
+def check_video_duration(duration):
+    if duration < MIN_VIDEO_DURATION or duration > MAX_VIDEO_DURATION:
+        raise serializers.ValidationError(
+            f"Video must be between {MIN_VIDEO_DURATION} and {MAX_VIDEO_DURATION} seconds long"
+        )
 
-        # Check duration using moviepy
-        video = VideoFileClip(value.temporary_file_path())
-        duration = video.duration
-        video.close()
+class VideoSerializer(serializers.ModelSerializer):
+    title = serializers.CharField(required=False, allow_blank=True)
+    tags = serializers.SlugRelatedField(many=True, read_only=True, slug_field='name')
 
-        # Define the minimum and maximum duration in seconds
-        min_duration = 5
-        max_duration = 25
+    class Meta:
+        model = Video
+        fields = [
+            'id', 'title', 'is_merged', 'video_file', 'uploaded_at', 'file_size', 'is_trimmed', 'owner', 'tags',
+            'encoding_profile', *MEDIA_FIELDS
+        ]
+        read_only_fields = ['file_size', 'owner', 'encoding_profile', *MEDIA_FIELDS]
 
-        if duration < min_duration or duration > max_duration:
-            raise serializers.ValidationError(f"Video must be between {min_duration} and {max_duration} seconds long")
+    def validate_video_file(self, value):
+        check_video_size(value.size)
 
+        # Probe the container instead of starting a decoder, the result is stored on the video
+        try:
+            self._media_info = probe_media(value)
+        except MediaError:
+            raise serializers.ValidationError("Unsupported or unreadable video file")
+        check_video_duration(self._media_info['duration'] or 0)
         return value
 
     def validate(self, attrs):
@@ -46,4 +54,22 @@ class VideoSerializer(serializers.ModelSerializer):
             video_file = attrs.get('video_file')
             if video_file:
                 attrs['title'] = os.path.splitext(video_file.name)[0]
+        if getattr(self, '_media_info', None):
+            attrs.update(media_fields(self._media_info))
         return attrs
+
+
+class JobSerializer(serializers.ModelSerializer):
+    percent = serializers.SerializerMethodField()
+    video = VideoSerializer(read_only=True)
+
+    class Meta:
+        model = Job
+        fields = [
+            'id', 'kind', 'state', 'percent', 'eta', 'encode_fps', 'queue', 'priority', 'estimated_cost',
+            'expected_wait', 'video', 'result', 'error',
+            'created_at', 'started_at', 'finished_at', 'updated_at',
+        ]
+
+    def get_percent(self, obj):
+        return round(obj.progress * 100, 1)
@@ -0,0 +1,54 @@
+import os
+import shutil
+from celery.signals import task_prerun, task_postrun
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, m2m_changed
+from django.dispatch import receiver
+from .models import Video, MediaAsset
+from .blobs import release_blob
+from . import metrics, profiling
+from .caching import invalidate
+
+
+@receiver(post_delete, sender=Video)
+def release_video_blob(sender, instance, **kwargs):
+    if instance.blob_id:
+        transaction.on_commit(lambda: release_blob(instance.blob_id))
+
+
+@receiver([post_save, post_delete], sender=Video)
+def invalidate_cached_video(sender, instance, **kwargs):
+    invalidate([instance.pk])
+
+
+@receiver(m2m_changed, sender=Video.tags.through)
+def invalidate_cached_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith('post_'):
+            invalidate([instance.pk])
+    elif action == 'pre_clear':
+        # tag.videos.clear(), the videos losing the tag are only known beforehand
+        invalidate(instance.videos.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        invalidate(pk_set)
+
+
+@receiver(post_delete, sender=MediaAsset)
+def remove_asset_files(sender, instance, **kwargs):
+    # Assets go away with their blob, once nothing references the content
+    if instance.path:
+        path = os.path.join(settings.MEDIA_ROOT, instance.path)
+        transaction.on_commit(lambda: shutil.rmtree(path, ignore_errors=True))
+
+
+@task_prerun.connect
+def start_task_timer(task_id=None, task=None, **kwargs):
+    metrics.task_started(task_id)
+    profiling.task_started(task_id, task.name)
+
+
+@task_postrun.connect
+def record_task_runtime(task_id=None, task=None, state=None, **kwargs):
+    profiling.task_finished(task_id)
+    metrics.task_finished(task_id, task.name, state)
@@ -0,0 +1,414 @@
+# videoapi/storage.py
+# Object storage for videos and blobs: a Django storage backend for S3-compatible
+# stores (AWS S3, MinIO, `python manage.py objectstore`), and a read-through cache
+# that gives workers a local copy of any stored file for ffmpeg and moviepy.
+import datetime
+import fcntl
+import hashlib
+import hmac
+import io
+import os
+import shutil
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import quote, urlsplit
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+import urllib3
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import Storage
+from django.utils.deconstruct import deconstructible
+
+MB = 1024 * 1024
+UNSIGNED_PAYLOAD = 'UNSIGNED-PAYLOAD'
+
+
+class ObjectStoreError(OSError):
+    pass
+
+
+def _uri_encode(value):
+    return quote(str(value), safe='-_.~')
+
+
+def _hmac(key, message):
+    return hmac.new(key, message.encode(), hashlib.sha256).digest()
+
+
+def sign_request(method, url, headers, access_key, secret_key, region, now=None):
+    """Add the AWS Signature Version 4 headers to `headers` (lower-case names) and return them."""
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    stamp = now.strftime('%Y%m%dT%H%M%SZ')
+    scope = f'{stamp[:8]}/{region}/s3/aws4_request'
+    parts = urlsplit(url)
+    headers['host'] = parts.netloc
+    headers['x-amz-date'] = stamp
+    headers.setdefault('x-amz-content-sha256', UNSIGNED_PAYLOAD)
+
+    names = sorted(headers)
+    canonical = '\n'.join([
+        method, parts.path or '/', parts.query,
+        ''.join(f'{name}:{str(headers[name]).strip()}\n' for name in names),
+        ';'.join(names), headers['x-amz-content-sha256'],
+    ])
+    string_to_sign = f'AWS4-HMAC-SHA256\n{stamp}\n{scope}\n{hashlib.sha256(canonical.encode()).hexdigest()}'
+    key = f'AWS4{secret_key}'.encode()
+    for part in (stamp[:8], region, 's3', 'aws4_request'):
+        key = _hmac(key, part)
+    signature = hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+    headers['authorization'] = (f'AWS4-HMAC-SHA256 Credential={access_key}/{scope}, '
+                                f'SignedHeaders={";".join(names)}, Signature={signature}')
+    return headers
+
+
+class ObjectReader(io.RawIOBase):
+    """
+    Seekable, read-only view of a stored object. Sequential reads walk the object
+    in `window` sized ranged GETs over pooled connections, a seek starts a new one.
+    """
+
+    def __init__(self, storage, name, size, window):
+        super().__init__()
+        self.storage = storage
+        self.name = name
+        self.size = size
+        self.window = window
+        self.position = 0
+        self.response = None
+        self.remaining = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset != self.position:
+            self._release()
+            self.position = offset
+        return self.position
+
+    def readinto(self, buffer):
+        if self.position >= self.size:
+            return 0
+        if self.response is None:
+            last = min(self.position + self.window, self.size) - 1
+            self.response = self.storage.request(
+                'GET', self.name, headers={'range': f'bytes={self.position}-{last}'}, preload=False, ok=(206,)
+            )
+            self.remaining = last - self.position + 1
+        data = self.response.read(min(len(buffer), self.remaining))
+        if not data:
+            raise ObjectStoreError(f'Object {self.name} ended early')
+        buffer[:len(data)] = data
+        self.position += len(data)
+        self.remaining -= len(data)
+        if not self.remaining:
+            # Fully read, the connection goes back to the pool
+            self.response.release_conn()
+            self.response = None
+        return len(data)
+
+    def _release(self):
+        if self.response is not None:
+            # Unread bytes would poison a pooled connection, so it is closed instead
+            self.response.close()
+            self.response.release_conn()
+            self.response = None
+
+    def close(self):
+        self._release()
+        super().close()
+
+
+class ObjectFile(File):
+    def __init__(self, file, name, size):
+        super().__init__(file, name)
+        self.size = size
+
+
+@deconstructible
+class ObjectStorage(Storage):
+    """
+    Storage backend for an S3-compatible bucket with path-style URLs. Connections
+    are pooled per process, objects above `multipart_threshold` are uploaded and
+    downloaded in `multipart_chunk_size` parts by `transfer_workers` threads.
+    """
+
+    def __init__(self, endpoint_url, bucket, access_key, secret_key, region='us-east-1', max_connections=16,
+                 multipart_threshold=16 * MB, multipart_chunk_size=8 * MB, transfer_workers=8, timeout=60):
+        self.endpoint_url = endpoint_url.rstrip('/')
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.max_connections = max_connections
+        self.multipart_threshold = multipart_threshold
+        self.multipart_chunk_size = multipart_chunk_size
+        self.transfer_workers = transfer_workers
+        self.timeout = timeout
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+
+    @property
+    def pool(self):
+        # Forked Celery workers must not share the parent's sockets
+        if self._pool_pid != os.getpid():
+            with self._pool_lock:
+                if self._pool_pid != os.getpid():
+                    self._pool = urllib3.PoolManager(
+                        maxsize=self.max_connections, block=True,
+                        retries=urllib3.Retry(total=3, backoff_factor=0.2, redirect=False, raise_on_status=False),
+                        timeout=urllib3.Timeout(connect=5, read=self.timeout),
+                    )
+                    self._pool_pid = os.getpid()
+        return self._pool
+
+    def _url(self, name, query=None):
+        url = f'{self.endpoint_url}/{self.bucket}/{quote(name, safe="/-_.~")}'
+        if query:
+            url += '?' + '&'.join(f'{_uri_encode(key)}={_uri_encode(value)}' for key, value in sorted(query.items()))
+        return url
+
+    def request(self, method, name, query=None, headers=None, body=None, preload=True, ok=(200,)):
+        url = self._url(name, query)
+        headers = sign_request(method, url, dict(headers or {}), self.access_key, self.secret_key, self.region)
+        response = self.pool.request(method, url, headers=headers, body=body, preload_content=preload)
+        if response.status not in ok:
+            data = response.data if preload else response.read()
+            response.release_conn()
+            if response.status == 404:
+                raise FileNotFoundError(f'{name} is not stored')
+            code = ElementTree.fromstring(data).findtext('{*}Code') if data.startswith(b'<') else ''
+            raise ObjectStoreError(f'{method} {name} failed: {response.status} {code}'.strip())
+        return response
+
+    def _head(self, name):
+        return self.request('HEAD', name).headers
+
+    def exists(self, name):
+        try:
+            self._head(name)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def size(self, name):
+        return int(self._head(name)['Content-Length'])
+
+    def get_modified_time(self, name):
+        return parsedate_to_datetime(self._head(name)['Last-Modified'])
+
+    def delete(self, name):
+        self.request('DELETE', name, ok=(200, 204, 404))
+
+    def url(self, name):
+        return self._url(name)
+
+    def _open(self, name, mode='rb'):
+        if set(mode) - set('rb'):
+            raise ValueError('Stored objects can only be opened for reading')
+        size = self.size(name)
+        reader = ObjectReader(self, name, size, window=self.multipart_chunk_size)
+        return ObjectFile(io.BufferedReader(reader, buffer_size=settings.STREAM_CHUNK_SIZE), name, size)
+
+    def _save(self, name, content):
+        if hasattr(content, 'seek') and content.seekable():
+            content.seek(0)
+        if content.size is not None and content.size <= self.multipart_threshold:
+            self.request('PUT', name, body=content.read())
+        else:
+            self._multipart_upload(name, content)
+        return name
+
+    def _upload_part(self, name, upload_id, number, data):
+        response = self.request('PUT', name, {'partNumber': number, 'uploadId': upload_id}, body=data)
+        return number, response.headers['ETag']
+
+    def _multipart_upload(self, name, content):
+        response = self.request('POST', name, {'uploads': ''})
+        upload_id = ElementTree.fromstring(response.data).findtext('{*}UploadId')
+        etags = {}
+        try:
+            with ThreadPoolExecutor(self.transfer_workers, thread_name_prefix='object-upload') as pool:
+                pending, number = set(), 0
+                for data in iter(lambda: content.read(self.multipart_chunk_size), b''):
+                    number += 1
+                    pending.add(pool.submit(self._upload_part, name, upload_id, number, data))
+                    if len(pending) >= self.transfer_workers:
+                        # Parts are read ahead only as far as there are free workers
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        etags.update(future.result() for future in done)
+                etags.update(future.result() for future in wait(pending)[0])
+
+            parts = ''.join(f'<Part><PartNumber>{number}</PartNumber><ETag>{escape(etag)}</ETag></Part>'
+                            for number, etag in sorted(etags.items()))
+            response = self.request('POST', name, {'uploadId': upload_id},
+                                    body=f'<CompleteMultipartUpload>{parts}</CompleteMultipartUpload>'.encode())
+            # A completion can fail after the 200 status line was sent
+            if ElementTree.fromstring(response.data).tag.endswith('Error'):
+                raise ObjectStoreError(f'Completing the upload of {name} failed')
+        except BaseException:
+            self.request('DELETE', name, {'uploadId': upload_id}, ok=(200, 204, 404))
+            raise
+
+    def _download_range(self, name, fd, first, last, etag):
+        response = self.request('GET', name, headers={'range': f'bytes={first}-{last}', 'if-match': etag},
+                                preload=False, ok=(206,))
+        try:
+            offset = first
+            for data in response.stream(MB):
+                os.pwrite(fd, data, offset)
+                offset += len(data)
+        finally:
+            response.release_conn()
+        if offset != last + 1:
+            raise ObjectStoreError(f'Object {name} ended early')
+
+    def download(self, name, path):
+        """Write the object to the local `path`, large objects in parallel ranges. Returns its size."""
+        headers = self._head(name)
+        size = int(headers['Content-Length'])
+        if size <= self.multipart_threshold:
+            response = self.request('GET', name, preload=False)
+            try:
+                with open(path, 'wb') as handle:
+                    for data in response.stream(MB):
+                        handle.write(data)
+            finally:
+                response.release_conn()
+            return size
+
+        with open(path, 'wb') as handle:
+            handle.truncate(size)
+        fd = os.open(path, os.O_WRONLY)
+        try:
+            # If-Match makes every range fail instead of mixing two versions of the object
+            with ThreadPoolExecutor(self.transfer_workers, thread_name_prefix='object-download') as pool:
+                futures = [pool.submit(self._download_range, name, fd, first,
+                                       min(first + self.multipart_chunk_size, size) - 1, headers['ETag'])
+                           for first in range(0, size, self.multipart_chunk_size)]
+                for future in futures:
+                    future.result()
+        finally:
+            os.close(fd)
+        return size
+
+
+def local_path(storage, name):
+    # None for storages that keep their files elsewhere
+    try:
+        return storage.path(name)
+    except NotImplementedError:
+        return None
+
+
+def cache_path(name):
+    # Stored names never get new content (blobs are named by their hash), so the name is the key
+    digest = hashlib.sha256(name.encode()).hexdigest()
+    return os.path.join(settings.STORAGE_CACHE_DIR, digest[:2], digest + os.path.splitext(name)[1].lower())
+
+
+def _fetch(storage, name, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = f'{path}.{uuid.uuid4().hex}.part'
+    try:
+        if hasattr(storage, 'download'):
+            storage.download(name, partial)
+        else:
+            with storage.open(name, 'rb') as source, open(partial, 'wb') as target:
+                shutil.copyfileobj(source, target, MB)
+        os.replace(partial, path)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+
+
+@contextmanager
+def local_file(field_file):
+    """
+    A local path with the bytes of a stored file for the duration of the block:
+    the file itself on local storage, otherwise a copy in the worker's read-through
+    cache. Cached copies are not evicted while a block is using them.
+    """
+    path = local_path(field_file.storage, field_file.name)
+    if path is not None:
+        yield path
+        return
+
+    path = cache_path(field_file.name)
+    for _ in range(3):
+        fetched = not os.path.exists(path)
+        if fetched:
+            _fetch(field_file.storage, field_file.name, path)
+        try:
+            handle = open(path, 'rb')
+        except FileNotFoundError:
+            continue
+        with handle:
+            # A shared lock keeps trim_cache away, an entry evicted before it was taken is fetched again
+            fcntl.flock(handle, fcntl.LOCK_SH)
+            try:
+                if os.stat(path).st_ino != os.fstat(handle.fileno()).st_ino:
+                    continue
+            except FileNotFoundError:
+                continue
+            os.utime(path)
+            if fetched:
+                trim_cache()
+            yield path
+            return
+    raise ObjectStoreError(f'Could not cache {field_file.name}')
+
+
+def seed_cache(name, path):
+    """Move a local file that was just stored as `name` into the cache, so this worker never downloads it."""
+    target = cache_path(name)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    shutil.move(path, target)
+    trim_cache()
+
+
+def trim_cache(max_bytes=None):
+    """Delete the least recently used cached files above STORAGE_CACHE_MAX_BYTES, skipping ones in use."""
+    max_bytes = settings.STORAGE_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    entries = []
+    for directory, _, names in os.walk(settings.STORAGE_CACHE_DIR):
+        for name in names:
+            if name.endswith('.part'):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            with open(path, 'rb') as handle:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                os.remove(path)
+        except (BlockingIOError, FileNotFoundError):
+            continue
+        total -= size
+        removed += 1
+    return removed
@@ -0,0 +1,263 @@
+# videoapi/streaming.py
+# Range and conditional request handling for the stream and download views.
+import asyncio
+import mimetypes
+import os
+import re
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from .storage import local_path
+
+# More ranges than this in a single request is treated as abuse and answered in full
+MAX_RANGES = 16
+RANGE_RE = re.compile(r'^\s*(\d*)\s*-\s*(\d*)\s*$')
+ASSET_CONTENT_TYPES = {'.m3u8': 'application/vnd.apple.mpegurl', '.m4s': 'video/iso.segment', '.mp4': 'video/mp4'}
+
+
+def video_etag(video, size):
+    # Content-addressed files are named by their hash, older rows fall back to id, upload time and size
+    if video.blob_id:
+        return f'"{video.blob.sha256}"'
+    return f'"{video.pk}-{int(video.uploaded_at.timestamp())}-{size}"'
+
+
+def parse_range_header(header, size):
+    """
+    Parse a `Range: bytes=...` header into sorted, merged (first, last) byte pairs.
+
+    Returns None when the header is missing or malformed (serve the whole file)
+    and an empty list when no range can be satisfied.
+    """
+    if not header or not header.startswith('bytes='):
+        return None
+    if size == 0:
+        return []
+
+    ranges = []
+    for spec in header[len('bytes='):].split(','):
+        match = RANGE_RE.match(spec)
+        if not match or match.groups() == ('', ''):
+            return None
+        first, last = match.groups()
+        if first == '':
+            # Suffix range, the final N bytes of the file
+            length = int(last)
+            if length == 0:
+                continue
+            first, last = max(size - length, 0), size - 1
+        else:
+            first = int(first)
+            if last and int(last) < first:
+                return None
+            if first >= size:
+                continue
+            last = min(int(last), size - 1) if last else size - 1
+        ranges.append((first, last))
+
+    if len(ranges) > MAX_RANGES:
+        return None
+
+    # Overlapping or adjacent ranges are sent as one part
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+    return merged
+
+
+def iter_file_range(file_handle, first, last, chunk_size=None):
+    chunk_size = chunk_size or settings.STREAM_CHUNK_SIZE
+    file_handle.seek(first)
+    remaining = last - first + 1
+    while remaining > 0:
+        data = file_handle.read(min(chunk_size, remaining))
+        if not data:
+            break
+        remaining -= len(data)
+        yield data
+
+
+def _single_range(file_handle, first, last):
+    try:
+        yield from iter_file_range(file_handle, first, last)
+    finally:
+        file_handle.close()
+
+
+def _multipart_ranges(file_handle, ranges, headers):
+    try:
+        for (first, last), part_header in zip(ranges, headers):
+            yield part_header
+            yield from iter_file_range(file_handle, first, last)
+        yield headers[-1]
+    finally:
+        file_handle.close()
+
+
+_read_pool = None
+
+
+def read_pool():
+    # Shared by every viewer of the process, so the number of blocking reads in flight stays bounded
+    global _read_pool
+    if _read_pool is None:
+        _read_pool = ThreadPoolExecutor(settings.STREAM_READ_THREADS, thread_name_prefix='stream-read')
+    return _read_pool
+
+
+async def offloaded(iterator):
+    """
+    Async iteration over a blocking chunk iterator, each chunk is read on the read
+    pool. The next chunk is only read once the server took the previous one, so
+    a slow viewer holds a single chunk in memory instead of buffering ahead.
+    """
+    read = None
+    try:
+        while True:
+            read = read_pool().submit(next, iterator, None)
+            chunk = await asyncio.wrap_future(read)
+            if chunk is None:
+                break
+            yield chunk
+    finally:
+        if read is not None and not read.done():
+            # Cancelled (client gone) while the generator runs on the pool, it can only be closed once the read returns
+            read.add_done_callback(lambda _: iterator.close())
+        else:
+            iterator.close()
+
+
+def _body(request, iterator):
+    # Django reads a sync iterator into memory whole before sending it over ASGI
+    return offloaded(iterator) if isinstance(request, ASGIRequest) else iterator
+
+
+def _range_applies(request, etag, last_modified):
+    # If-Range only allows a partial response while the representation is unchanged
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    since = parse_http_date_safe(if_range)
+    return since is not None and int(last_modified) <= since
+
+
+def offload_response(request, path, content_type):
+    """
+    An empty response telling the front proxy to send `path` itself (FILE_OFFLOAD),
+    or None when Django has to stream the body: offloading is off, the file has
+    no local path, or an If-Range validator only Django can check is present.
+    """
+    mode = settings.FILE_OFFLOAD
+    if not mode or path is None:
+        return None
+    if request.META.get('HTTP_IF_RANGE') and request.META.get('HTTP_RANGE'):
+        return None
+
+    response = HttpResponse(content_type=content_type)
+    if mode == 'x-accel-redirect':
+        relative = os.path.relpath(path, settings.MEDIA_ROOT)
+        if relative.startswith(os.pardir):
+            return None
+        response['X-Accel-Redirect'] = settings.FILE_OFFLOAD_ACCEL_PREFIX + quote(relative.replace(os.sep, '/'))
+    elif mode == 'x-sendfile':
+        response['X-Sendfile'] = path
+    else:
+        raise ImproperlyConfigured(f'Unknown FILE_OFFLOAD mode {mode!r}')
+    return response
+
+
+def serve_video(request, video):
+    """
+    Build the response for a stored video honouring Range, If-Range, If-None-Match
+    and If-Modified-Since. Full responses use FileResponse, which WSGI servers that
+    provide `wsgi.file_wrapper` (gunicorn, uWSGI) hand to os.sendfile. Under ASGI
+    every body is an async iterator over offloaded, chunked reads.
+    """
+    size = video.video_file.size
+    filename = os.path.basename(video.video_file.name)
+    response = serve_file(
+        request, lambda: video.video_file.open('rb'), size, video_etag(video, size), video.uploaded_at.timestamp(),
+        filename, mimetypes.guess_type(filename)[0] or 'video/mp4', path=local_path(video.video_file.storage, video.video_file.name),
+    )
+    # Share links are valid for an hour, the bytes behind them only ever change with the ETag
+    response['Cache-Control'] = 'private, max-age=3600'
+    return response
+
+
+def serve_file(request, open_file, size, etag, last_modified, filename, content_type, path=None):
+    """
+    Conditional and Range-aware response for any file, `open_file()` returns a binary
+    handle. With FILE_OFFLOAD set, conditional requests are still answered here and
+    the proxy sends the body (and handles Range) from the local `path`.
+    """
+    response = get_conditional_response(request, etag=etag, last_modified=int(last_modified))
+    if response is None:
+        response = offload_response(request, path, content_type)
+    if response is None:
+        ranges = None
+        if _range_applies(request, etag, last_modified):
+            ranges = parse_range_header(request.META.get('HTTP_RANGE'), size)
+
+        if ranges == []:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+        elif ranges is None and isinstance(request, ASGIRequest):
+            response = StreamingHttpResponse(_body(request, _single_range(open_file(), 0, size - 1)),
+                                             content_type=content_type)
+            response['Content-Length'] = size
+        elif ranges is None:
+            response = FileResponse(open_file(), content_type=content_type)
+        elif len(ranges) == 1:
+            first, last = ranges[0]
+            response = StreamingHttpResponse(
+                _body(request, _single_range(open_file(), first, last)), status=206, content_type=content_type
+            )
+            response['Content-Range'] = f'bytes {first}-{last}/{size}'
+            response['Content-Length'] = last - first + 1
+        else:
+            boundary = secrets.token_hex(16)
+            headers = [
+                (f'\r\n--{boundary}\r\nContent-Type: {content_type}\r\n'
+                 f'Content-Range: bytes {first}-{last}/{size}\r\n\r\n').encode()
+                for first, last in ranges
+            ]
+            headers.append(f'\r\n--{boundary}--\r\n'.encode())
+            response = StreamingHttpResponse(
+                _body(request, _multipart_ranges(open_file(), ranges, headers)),
+                status=206, content_type=f'multipart/byteranges; boundary={boundary}'
+            )
+            response['Content-Length'] = sum(len(header) for header in headers) + sum(
+                last - first + 1 for first, last in ranges
+            )
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Content-Disposition'] = f'inline; filename="{filename}"'
+    return response
+
+
+def serve_asset(request, asset, path):
+    """
+    Serve a file of a MediaAsset. Asset files never change, so the client may keep
+    them for good, but they are behind a login or a share token, so shared caches may not.
+    """
+    name = os.path.basename(path)
+    stat = os.stat(path)
+    etag = f'"{asset.blob.sha256[:16]}-{asset.kind}-{int(stat.st_mtime)}-{stat.st_size}"'
+    content_type = ASSET_CONTENT_TYPES.get(os.path.splitext(name)[1]) or mimetypes.guess_type(name)[0]
+    response = serve_file(request, lambda: open(path, 'rb'), stat.st_size, etag, stat.st_mtime, name,
+                          content_type or 'application/octet-stream', path=path)
+    response['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
@@ -0,0 +1,84 @@
+# videoapi/synthetic.py
+# Deterministic synthetic videos for benchmarks: NumPy frames piped into the bundled ffmpeg.
+import subprocess
+import tempfile
+import numpy as np
+from imageio_ffmpeg import get_ffmpeg_exe
+from .media import MediaError
+
+SIZES = {
+    '360p': (640, 360),
+    '720p': (1280, 720),
+    '1080p': (1920, 1080),
+}
+CODECS = {
+    'h264': {'extension': '.mp4', 'video': ['-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p'],
+             'audio': ['-c:a', 'aac']},
+    'hevc': {'extension': '.mp4', 'video': ['-c:v', 'libx265', '-preset', 'veryfast', '-pix_fmt', 'yuv420p',
+                                            '-tag:v', 'hvc1', '-x265-params', 'log-level=error'],
+             'audio': ['-c:a', 'aac']},
+    'mpeg4': {'extension': '.mp4', 'video': ['-c:v', 'mpeg4', '-q:v', '5', '-pix_fmt', 'yuv420p'],
+              'audio': ['-c:a', 'aac']},
+    'vp9': {'extension': '.webm', 'video': ['-c:v', 'libvpx-vp9', '-deadline', 'realtime', '-cpu-used', '8',
+                                            '-b:v', '1M', '-pix_fmt', 'yuv420p'],
+            'audio': ['-c:a', 'libopus']},
+}
+
+
+def parse_size(name):
+    """A preset from SIZES or a literal 'WIDTHxHEIGHT'."""
+    if name in SIZES:
+        return SIZES[name]
+    width, _, height = name.partition('x')
+    return int(width), int(height)
+
+
+def synthetic_frames(width, height, count, seed=0):
+    """
+    Yield `count` RGB frames. Scrolling gradients over a fixed noise texture plus
+    a moving block give the encoder both detail and motion, and the same seed
+    always produces the same frames.
+    """
+    rng = np.random.default_rng(seed)
+    texture = rng.integers(0, 48, size=(height, width), dtype=np.uint16)
+    block_color = rng.integers(0, 256, size=3, dtype=np.uint8)
+    y, x = np.mgrid[0:height, 0:width].astype(np.uint16)
+    block = max(min(width, height) // 4, 2)
+    for index in range(count):
+        frame = np.empty((height, width, 3), np.uint8)
+        frame[..., 0] = (x + texture + index * 4) % 256
+        frame[..., 1] = (y + texture + index * 2) % 256
+        frame[..., 2] = ((x + y) // 2 + texture + index * 3) % 256
+        left = index * 8 % max(width - block, 1)
+        top = index * 4 % max(height - block, 1)
+        frame[top:top + block, left:left + block] = block_color
+        yield frame
+
+
+def generate_video(path, width, height, duration=10, fps=25, codec='h264', audio=True, seed=0, gop=None):
+    """Encode `duration` seconds of synthetic frames (plus a sine tone) into `path`."""
+    options = CODECS[codec]
+    count = int(round(duration * fps))
+    cmd = [get_ffmpeg_exe(), '-hide_banner', '-nostdin', '-y', '-loglevel', 'error',
+           '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}', '-r', str(fps), '-i', 'pipe:0']
+    if audio:
+        cmd += ['-f', 'lavfi', '-i', f'sine=frequency={220 + seed % 20 * 20}:sample_rate=48000', '-t', f'{duration}']
+    cmd += options['video'] + ['-g', str(gop or fps * 2)]
+    if audio:
+        cmd += options['audio'] + ['-shortest']
+    cmd += [path]
+
+    with tempfile.TemporaryFile() as errors:
+        process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=errors)
+        try:
+            for frame in synthetic_frames(width, height, count, seed):
+                process.stdin.write(frame.tobytes())
+        except BrokenPipeError:
+            pass
+        finally:
+            process.stdin.close()
+        if process.wait() != 0:
+            errors.seek(0)
+            output = errors.read().decode('utf8', errors='replace').strip()
+            raise MediaError(output.splitlines()[-1] if output else 'ffmpeg failed')
+    return path
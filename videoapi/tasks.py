@@ -1,41 +1,202 @@
+from contextlib import ExitStack
+from functools import partial
 from celery import shared_task
-from moviepy.editor import VideoFileClip, concatenate_videoclips
+from moviepy.editor import VideoFileClip
 from .models import Video
+from django.db import transaction
 from django.conf import settings
 import os
+import time
 from .utils import generate_unique_filename
+from .blobs import ingest_file
+from .storage import local_file
+from .media import (fast_trim, probe_streams, streams_compatible, concat_copy, batch_encode, batch_fast_trim,
+                    parallel_merge_encode, sequential_merge_encode)
+from .probe import probe_media, media_fields, keyframe_times
+from .jobs import JobReporter, MoviepyProgressLogger
+from .scheduling import stored_metadata_matches
+from .postprocess import claim_assets, build_asset, build_derived_assets
+from .reclamation import reclaim_storage
+from .profiles import profile_name, get_profile, moviepy_options, encoding_params
+from .metrics import record_encode
+from .derivations import (record_output, record_keyed_output, stored_outputs, evict_derivations, derivation_key,
+                          trim_params, finish_followers)
 
 
-@shared_task
-def trim_video_task(video_id, start, end):
-    video = Video.objects.get(pk=video_id)
-    clip = VideoFileClip(video.video_file.path)
-    trimmed_clip = clip.subclip(start, end)
-    upload_to = video.video_file.field.upload_to
-    original_filename = os.path.basename(video.video_file.name)
-    output_filename = generate_unique_filename(f'trimmed_{original_filename}', video_id)
-    output_path = os.path.join(settings.MEDIA_ROOT, upload_to, output_filename)
+@shared_task(bind=True)
+def trim_video_task(self, video_id, start, end, mode='exact', profile=None):
+    reporter = JobReporter(self.request.id)
+    reporter.start()
+    try:
+        # Fast trims copy packets, only exact ones are encoded with a profile
+        profile = profile_name(profile) if mode == 'exact' else ''
+        video = Video.objects.get(pk=video_id)
+        upload_to = video.video_file.field.upload_to
+        original_filename = os.path.basename(video.video_file.name)
+        output_filename = generate_unique_filename(f'trimmed_{original_filename}', video_id)
+        output_path = os.path.join(settings.MEDIA_ROOT, upload_to, output_filename)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+        with local_file(video.video_file) as source:
+            if mode == 'fast':
+                # Copy packets instead of decoding, only the GOP in front of the cut is re-encoded
+                fast_trim(source, start, end, output_path, tolerance=settings.TRIM_KEYFRAME_TOLERANCE,
+                          keyframes=keyframe_times(source), progress=reporter.update)
+            else:
+                clip = VideoFileClip(source)
+                trimmed_clip = clip.subclip(start, end)
+                trimmed_clip.write_videofile(output_path, logger=MoviepyProgressLogger(reporter),
+                                             **moviepy_options(profile))
+                trimmed_clip.close()
+
+        info = probe_media(output_path)
+        blob = ingest_file(output_path)
+        trimmed_video = record_output(self.request.id, 'trim', blob, dict(media_fields(info), encoding_profile=profile),
+                                      reporter.owner_id or video.owner_id)
+        record_encode(self.name, [video], [trimmed_video], time.monotonic() - reporter.started)
+        build_derived_assets(trimmed_video)
+    except Exception as exc:
+        reporter.fail(exc)
+        raise
+
+    result = {'message': 'Video trimmed', 'file': os.path.basename(blob.file.name), 'id': trimmed_video.id}
+    reporter.finish(trimmed_video, result)
+    finish_followers(self.request.id, result['message'])
+    return result
+
+@shared_task(bind=True)
+def batch_trim_video_task(self, video_id, ranges, mode='exact', profile=None):
+    reporter = JobReporter(self.request.id)
+    reporter.start()
+    try:
+        profile = profile_name(profile) if mode == 'exact' else ''
+        video = Video.objects.select_related('blob').get(pk=video_id)
+        upload_to = video.video_file.field.upload_to
+        original_filename = os.path.basename(video.video_file.name)
+
+        # Segments a previous request already produced are reused as they are
+        params = [trim_params(start, end, mode, profile) for start, end in ranges]
+        keys = [derivation_key('trim', [video], segment) for segment in params]
+        owner_id = reporter.owner_id or video.owner_id
+        outputs = stored_outputs(keys, owner_id)
+        # A range repeated in the request is cut once, every copy gets the same video
+        todo = [index for index, key in enumerate(keys) if key not in outputs and key not in keys[:index]]
+
+        if todo:
+            todo_ranges = [ranges[index] for index in todo]
+            paths = []
+            for index in todo:
+                output_filename = generate_unique_filename(f'trimmed_{index}_{original_filename}', video_id)
+                paths.append(os.path.join(settings.MEDIA_ROOT, upload_to, output_filename))
+            os.makedirs(os.path.dirname(paths[0]), exist_ok=True)
+
+            with local_file(video.video_file) as source:
+                if mode == 'fast':
+                    batch_fast_trim(source, todo_ranges, paths, tolerance=settings.TRIM_KEYFRAME_TOLERANCE,
+                                    keyframes=keyframe_times(source), progress=reporter.update)
+                else:
+                    # One decode of the source feeds an encoder per segment
+                    batch_encode(source, todo_ranges, paths, profile=get_profile(profile), progress=reporter.update)
 
-    trimmed_clip.write_videofile(output_path)
-    trimmed_clip.close()
+            for index, path in zip(todo, paths):
+                info = probe_media(path)
+                blob = ingest_file(path)
+                outputs[keys[index]] = record_keyed_output(keys[index], 'trim', params[index], blob,
+                                                           dict(media_fields(info), encoding_profile=profile), owner_id)
+            record_encode(self.name, [video], [outputs[keys[index]] for index in todo],
+                          time.monotonic() - reporter.started)
+            for index in todo:
+                build_derived_assets(outputs[keys[index]])
+    except Exception as exc:
+        reporter.fail(exc)
+        raise
 
-    trimmed_video = Video(video_file=os.path.join(upload_to, output_filename), is_trimmed=True)
-    trimmed_video.save()
+    videos = [outputs[key] for key in keys]
+    result = {
+        'message': f'Video trimmed into {len(videos)} segments',
+        'files': [os.path.basename(v.video_file.name) for v in videos],
+        'ids': [v.id for v in videos],
+    }
+    reporter.finish(None, result)
+    return result
+
+@shared_task(bind=True)
+def merge_videos_task(self, video_ids, profile=None):
+    reporter = JobReporter(self.request.id)
+    reporter.start()
+    try:
+        profile = profile_name(profile)
+        encoding = get_profile(profile)
+        videos = [Video.objects.get(pk=id) for id in video_ids]
+        owner_id = reporter.owner_id or videos[0].owner_id
+        upload_to = Video._meta.get_field('video_file').upload_to
+        output_filename = generate_unique_filename('merged_video.mp4', '_'.join(map(str, video_ids)))
+        output_path = os.path.join(settings.MEDIA_ROOT, upload_to, output_filename)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+        merged_video = key = None
+        with ExitStack() as stack:
+            paths = [stack.enter_context(local_file(video.video_file)) for video in videos]
+            infos = [probe_streams(path) for path in paths] if stored_metadata_matches(videos) else None
+            if infos and streams_compatible(infos):
+                # Same codecs and layout everywhere, so the packets can be joined without decoding
+                total = sum(info['duration'] or 0 for info in infos)
+                concat_copy(paths, output_path, progress=reporter.update, duration=total)
+                profile = ''
+            else:
+                # An encode is stored under its profile's key, also when the request was keyed as a copy
+                key = derivation_key('merge', videos, encoding_params(profile))
+                merged_video = stored_outputs([key], owner_id).get(key)
+            if merged_video is None and key is not None:
+                infos = infos or [probe_streams(path) for path in paths]
+                total = sum(info['duration'] or 0 for info in infos)
+                if total >= settings.MERGE_PARALLEL_MIN_DURATION and all(info['video'] for info in infos):
+                    # GOP-aligned chunks are encoded side by side and joined without another encode
+                    parallel_merge_encode(paths, output_path, infos=infos, keyframes=[keyframe_times(p) for p in paths],
+                                          chunk_seconds=settings.MERGE_CHUNK_SECONDS,
+                                          workers=settings.MERGE_PARALLEL_WORKERS, profile=encoding,
+                                          progress=reporter.update)
+                else:
+                    # Inputs are decoded one at a time into a single encoder
+                    sequential_merge_encode(paths, output_path, infos=infos, profile=encoding,
+                                            progress=reporter.update)
+
+        if merged_video is None:
+            info = probe_media(output_path)
+            blob = ingest_file(output_path)
+            media = dict(media_fields(info), encoding_profile=profile)
+            if key is None:
+                merged_video = record_output(self.request.id, 'merge', blob, media, owner_id)
+            else:
+                merged_video = record_keyed_output(key, 'merge', encoding_params(profile), blob, media, owner_id)
+            record_encode(self.name, videos, [merged_video], time.monotonic() - reporter.started)
+            build_derived_assets(merged_video)
+    except Exception as exc:
+        reporter.fail(exc)
+        raise
+
+    result = {'message': 'Videos merged', 'file': os.path.basename(merged_video.video_file.name), 'id': merged_video.id}
+    reporter.finish(merged_video, result)
+    finish_followers(self.request.id, result['message'], merged_video.derivation_id)
+    return result
+
+@shared_task
+def evict_derived_videos():
+    return {'evicted': evict_derivations()}
 
-    return {'message': 'Video trimmed', 'file': output_filename, 'id': trimmed_video.id}
 
 @shared_task
-def merge_videos_task(video_ids):
-    clips = [VideoFileClip(Video.objects.get(pk=id).video_file.path) for id in video_ids]
-    final_clip = concatenate_videoclips(clips)
-    upload_to = Video._meta.get_field('video_file').upload_to
-    output_filename = generate_unique_filename('merged_video.mp4', '_'.join(map(str, video_ids)))
-    output_path = os.path.join(settings.MEDIA_ROOT, upload_to, output_filename)
+def reclaim_storage_task():
+    return reclaim_storage()
 
-    final_clip.write_videofile(output_path)
-    final_clip.close()
 
-    merged_video = Video(video_file=os.path.join(upload_to, output_filename), is_merged=True)
-    merged_video.save()
+@shared_task
+def postprocess_asset_task(asset_id):
+    build_asset(asset_id)
+    return {'asset': asset_id}
+
 
-    return {'message': 'Videos merged', 'file': output_filename, 'id': merged_video.id}
\ No newline at end of file
+def schedule_postprocessing(video, stages=None):
+    # Post-processing is background work, so it queues behind user-facing encodes
+    for asset in claim_assets(video, stages):
+        transaction.on_commit(partial(postprocess_asset_task.apply_async, args=[asset.pk], queue='encode', priority=9))
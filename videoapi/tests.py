@@ -1,10 +1,33 @@
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, ANY
 from django.core.files.base import ContentFile
 from django.urls import reverse
 from rest_framework.test import APITestCase
 from rest_framework import status
 from videoapi.models import Video
+import os
 from django.contrib.auth.models import User
+from django.test import override_settings
+import shutil
+import tempfile
+
+TEST_MEDIA_ROOT = tempfile.mkdtemp(prefix='videoapi_tests_')
+
+
+def tearDownModule():
+    shutil.rmtree(TEST_MEDIA_ROOT, ignore_errors=True)
+
+
+def make_test_video(path, duration=6, gop=25, padding=0):
+    from videoapi.media import run_ffmpeg
+    run_ffmpeg(['-f', 'lavfi', '-i', f'testsrc=size=64x48:rate=25:duration={duration}',
+                '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}',
+                '-c:v', 'libx264', '-g', gop, '-pix_fmt', 'yuv420p', '-c:a', 'aac', '-shortest', path])
+    if padding:
+        # A trailing free atom grows the file past the upload size limit without changing the media
+        with open(path, 'ab') as handle:
+            handle.write((padding + 8).to_bytes(4, 'big') + b'free' + b'\x00' * padding)
+    return path
+
 
 class VideoAPITests(APITestCase):
     def setUp(self):
@@ -30,7 +53,7 @@ class VideoAPITests(APITestCase):
         response = self.client.post(url, {'video_file': large_content}, format='multipart')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
-    @patch('videoapi.serializers.VideoFileClip')
+    @patch('videoapi.serializers.probe_media')
     def test_video_trimming_valid(self, mock_video_clip):
         mock_clip = MagicMock()
         mock_video_clip.return_value.__enter__.return_value = mock_clip
@@ -43,7 +66,7 @@ class VideoAPITests(APITestCase):
         response = self.client.post(url, data)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
-    @patch('videoapi.serializers.VideoFileClip')
+    @patch('videoapi.serializers.probe_media')
     def test_video_trimming_invalid(self, mock_video_clip):
         mock_clip = MagicMock()
         mock_video_clip.return_value.__enter__.return_value = mock_clip
@@ -54,7 +77,7 @@ class VideoAPITests(APITestCase):
         response = self.client.post(url, data)
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
-    @patch('videoapi.serializers.VideoFileClip')
+    @patch('videoapi.serializers.probe_media')
     def test_video_merging(self, mock_video_clip):
         mock_clip = MagicMock()
         mock_video_clip.return_value.__enter__.return_value = mock_clip
@@ -67,3 +90,1662 @@ class VideoAPITests(APITestCase):
         response = self.client.post(url, data)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class FastTrimTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='trimuser', password='12345')
+        self.client.force_authenticate(user=self.user)
+        self.video = Video.objects.create(title='Sample Video', video_file=ContentFile(b'\x00', name='trim.mp4'))
+
+    def test_plan_snaps_to_nearby_keyframe(self):
+        from videoapi.media import plan_fast_trim
+        self.assertEqual(plan_fast_trim([0.0, 2.0, 4.0], 2.2, 3.5, 0.5), [('copy', 2.0, 3.5)])
+        self.assertEqual(plan_fast_trim([0.0, 2.0, 4.0], 1.8, 3.5, 0.5), [('copy', 2.0, 3.5)])
+
+    def test_plan_reencodes_only_partial_gop(self):
+        from videoapi.media import plan_fast_trim
+        self.assertEqual(plan_fast_trim([0.0, 2.0, 4.0], 1.0, 3.5, 0.5), [('encode', 1.0, 2.0), ('copy', 2.0, 3.5)])
+        self.assertEqual(plan_fast_trim([0.0, 2.0, 4.0], 0.8, 1.5, 0.5), [('encode', 0.8, 1.5)])
+
+    def test_spliced_head_matches_source_stream(self):
+        from videoapi.media import run_ffmpeg, probe_streams, fast_trim
+        with tempfile.TemporaryDirectory() as workdir:
+            src = os.path.join(workdir, 'src.mp4')
+            run_ffmpeg(['-f', 'lavfi', '-i', 'testsrc=size=64x48:rate=25:duration=4', '-c:v', 'libx264',
+                        '-g', 25, '-pix_fmt', 'yuv444p', src])
+            dst = os.path.join(workdir, 'out.mp4')
+            plan = fast_trim(src, 0.5, 3.0, dst, tolerance=0.1)
+            self.assertEqual(plan[0][0], 'encode')
+            self.assertEqual(plan[-1][0], 'copy')
+            source, output = probe_streams(src)['video'], probe_streams(dst)['video']
+            self.assertEqual(output['profile'], 'High 4:4:4 Predictive')
+            for key in ('profile', 'pix_fmt', 'width', 'height'):
+                self.assertEqual(output[key], source[key])
+
+    def test_unreproducible_stream_is_encoded_whole(self):
+        from videoapi.media import run_ffmpeg, fast_trim
+        with tempfile.TemporaryDirectory() as workdir:
+            src = os.path.join(workdir, 'src.mp4')
+            run_ffmpeg(['-f', 'lavfi', '-i', 'testsrc=size=64x48:rate=25:duration=4', '-c:v', 'mpeg4', '-g', 25, src])
+            self.assertEqual(fast_trim(src, 0.5, 3.0, os.path.join(workdir, 'out.mp4'), tolerance=0.1),
+                             [('encode', 0.5, 3.0)])
+
+    @patch('videoapi.views.trim_video_task')
+    def test_trim_mode_is_passed_to_task(self, mock_task):
+        url = reverse('trim-video', kwargs={'pk': self.video.pk})
+        response = self.client.post(url, {'start': 1, 'end': 4, 'mode': 'fast'})
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        mock_task.apply_async.assert_called_once_with(args=[self.video.pk, 1.0, 4.0, 'fast'],
+                                                      task_id=response.data['task_id'], queue='fast', priority=ANY)
+
+    def test_trim_rejects_unknown_mode(self):
+        url = reverse('trim-video', kwargs={'pk': self.video.pk})
+        response = self.client.post(url, {'start': 1, 'end': 4, 'mode': 'lossless'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class MergeCompatibilityTests(APITestCase):
+    def make_info(self, **video):
+        info = {
+            'video': {'codec': 'h264', 'width': 640, 'height': 360, 'pix_fmt': 'yuv420p', 'fps': 25.0, 'tbn': 12800},
+            'audio': {'codec': 'aac', 'sample_rate': 44100, 'channels': 2},
+        }
+        info['video'].update(video)
+        return info
+
+    def test_matching_streams_are_compatible(self):
+        from videoapi.media import streams_compatible
+        self.assertTrue(streams_compatible([self.make_info(), self.make_info(fps=25.02)]))
+
+    def test_different_streams_need_reencoding(self):
+        from videoapi.media import streams_compatible
+        self.assertFalse(streams_compatible([self.make_info(), self.make_info(width=1280, height=720)]))
+        self.assertFalse(streams_compatible([self.make_info(), self.make_info(codec='mpeg4')]))
+        self.assertFalse(streams_compatible([self.make_info(), self.make_info(fps=30.0)]))
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class StreamRangeTests(APITestCase):
+    def setUp(self):
+        from itsdangerous import URLSafeTimedSerializer
+        self.payload = bytes(range(256)) * 40
+        self.video = Video.objects.create(title='Stream', video_file=ContentFile(self.payload, name='stream.mp4'))
+        token = URLSafeTimedSerializer('SECRET_KEY').dumps({'video_id': self.video.pk}, salt='share_video')
+        self.url = reverse('video-stream', kwargs={'pk': self.video.pk, 'token': token})
+
+    def read(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_parse_range_header(self):
+        from videoapi.streaming import parse_range_header
+        self.assertEqual(parse_range_header('bytes=0-99', 1000), [(0, 99)])
+        self.assertEqual(parse_range_header('bytes=-100', 1000), [(900, 999)])
+        self.assertEqual(parse_range_header('bytes=900-', 1000), [(900, 999)])
+        self.assertEqual(parse_range_header('bytes=0-10,5-20,500-600', 1000), [(0, 20), (500, 600)])
+        self.assertEqual(parse_range_header('bytes=2000-3000', 1000), [])
+        self.assertIsNone(parse_range_header('bytes=abc', 1000))
+        self.assertIsNone(parse_range_header(None, 1000))
+
+    def test_full_response_advertises_ranges_and_validators(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+        self.assertEqual(self.read(response), self.payload)
+
+    def test_single_range(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.payload)}')
+        self.assertEqual(self.read(response), self.payload[100:200])
+
+    def test_multiple_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9,1000-1009')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertTrue(response['Content-Type'].startswith('multipart/byteranges'))
+        body = self.read(response)
+        self.assertEqual(len(body), int(response['Content-Length']))
+        self.assertIn(self.payload[1000:1010], body)
+
+    def test_unsatisfiable_range(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=999999-')
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+
+    def test_if_none_match_returns_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class ProbeTests(APITestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.workdir = tempfile.mkdtemp(dir=TEST_MEDIA_ROOT)
+        cls.sample = make_test_video(os.path.join(cls.workdir, 'sample.mp4'), padding=5 * 1024 * 1024)
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='probeuser', password='12345')
+        self.client.force_authenticate(user=self.user)
+
+    def test_mp4_atoms_are_parsed_without_ffmpeg(self):
+        from videoapi.probe import probe_media
+        with patch('videoapi.probe.probe_streams') as mock_probe:
+            info = probe_media(self.sample)
+        mock_probe.assert_not_called()
+        self.assertEqual(info['container'], 'mp4')
+        self.assertEqual((info['video_codec'], info['audio_codec']), ('h264', 'aac'))
+        self.assertEqual((info['width'], info['height']), (64, 48))
+        self.assertAlmostEqual(info['fps'], 25, places=1)
+        self.assertAlmostEqual(info['duration'], 6, delta=0.1)
+        self.assertEqual(info['keyframes'][:3], [0.0, 1.0, 2.0])
+        self.assertEqual(info['keyframe_count'], len(info['keyframes']))
+
+    def test_upload_stores_probe_metadata(self):
+        with open(self.sample, 'rb') as handle:
+            response = self.client.post(reverse('video-upload'), {'video_file': handle}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        video = Video.objects.get(pk=response.data['id'])
+        self.assertEqual(video.video_codec, 'h264')
+        self.assertEqual(video.width, 64)
+        self.assertAlmostEqual(video.duration, 6, delta=0.1)
+        self.assertEqual(response.data['keyframe_count'], video.keyframe_count)
+
+    def test_fragmented_mp4_falls_back_to_ffmpeg(self):
+        from videoapi.media import MediaError, run_ffmpeg
+        from videoapi.probe import parse_mp4
+        path = os.path.join(self.workdir, 'fragmented.mp4')
+        run_ffmpeg(['-i', make_test_video(os.path.join(self.workdir, 'plain.mp4'), duration=8), '-c', 'copy',
+                    '-movflags', 'frag_keyframe+empty_moov', path])
+        with open(path, 'ab') as handle:
+            handle.write((5 * 1024 * 1024 + 8).to_bytes(4, 'big') + b'free' + b'\x00' * 5 * 1024 * 1024)
+        with open(path, 'rb') as handle:
+            with self.assertRaises(MediaError):
+                parse_mp4(handle)
+
+        with open(path, 'rb') as handle:
+            response = self.client.post(reverse('video-upload'), {'video_file': handle}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        self.assertAlmostEqual(Video.objects.get(pk=response.data['id']).duration, 8, delta=0.1)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class ResumableUploadTests(APITestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.workdir = tempfile.mkdtemp(dir=TEST_MEDIA_ROOT)
+        cls.sample = make_test_video(os.path.join(cls.workdir, 'sample.mp4'), padding=5 * 1024 * 1024)
+        with open(cls.sample, 'rb') as handle:
+            cls.payload = handle.read()
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='uploaduser', password='12345')
+        self.client.force_authenticate(user=self.user)
+
+    def send_chunk(self, session_id, offset, data):
+        url = reverse('upload-session-detail', kwargs={'pk': session_id})
+        return self.client.generic('PATCH', url, data, content_type='application/offset+octet-stream',
+                                   HTTP_UPLOAD_OFFSET=str(offset))
+
+    def test_chunked_upload_resumes_and_finalizes(self):
+        import hashlib
+        response = self.client.post(reverse('upload-session'), {'filename': 'clip.mp4', 'size': len(self.payload)})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        session_id = response.data['id']
+
+        middle = len(self.payload) // 2
+        self.assertEqual(self.send_chunk(session_id, 0, self.payload[:middle]).status_code, status.HTTP_204_NO_CONTENT)
+
+        # A client that lost track of the offset is told where to resume
+        conflict = self.send_chunk(session_id, 0, self.payload[:middle])
+        self.assertEqual(conflict.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(int(conflict['Upload-Offset']), middle)
+
+        # A fresh hasher state forces the prefix to be re-read, as on another worker
+        from videoapi import uploads
+        uploads._hashers.clear()
+        response = self.send_chunk(session_id, middle, self.payload[middle:])
+        self.assertEqual(int(response['Upload-Offset']), len(self.payload))
+
+        response = self.client.post(reverse('upload-session-finalize', kwargs={'pk': session_id}))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['sha256'], hashlib.sha256(self.payload).hexdigest())
+        video = Video.objects.get(pk=response.data['id'])
+        self.assertEqual(video.title, 'clip')
+        self.assertEqual(video.video_codec, 'h264')
+        with video.video_file.open('rb') as handle:
+            self.assertEqual(handle.read(), self.payload)
+
+    def test_incomplete_upload_cannot_be_finalized(self):
+        response = self.client.post(reverse('upload-session'), {'filename': 'clip.mp4', 'size': len(self.payload)})
+        response = self.client.post(reverse('upload-session-finalize', kwargs={'pk': response.data['id']}))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_sessions_belong_to_their_user(self):
+        import uuid
+        response = self.client.post(reverse('upload-session'), {'filename': 'clip.mp4', 'size': len(self.payload)})
+        session_id = response.data['id']
+        self.client.force_authenticate(user=User.objects.create_user(username='otheruser', password='12345'))
+        detail = reverse('upload-session-detail', kwargs={'pk': session_id})
+        self.assertEqual(self.client.get(detail).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.send_chunk(session_id, 0, self.payload[:10]).status_code, status.HTTP_404_NOT_FOUND)
+        finalize = reverse('upload-session-finalize', kwargs={'pk': session_id})
+        self.assertEqual(self.client.post(finalize).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.delete(detail).status_code, status.HTTP_404_NOT_FOUND)
+        unknown = reverse('upload-session-detail', kwargs={'pk': uuid.uuid4()})
+        self.assertEqual(self.client.get(unknown).status_code, status.HTTP_404_NOT_FOUND)
+
+        self.client.force_authenticate(user=self.user)
+        self.assertEqual(self.client.get(detail).data['offset'], 0)
+
+    def test_session_rejects_oversized_files(self):
+        response = self.client.post(reverse('upload-session'), {'filename': 'big.mp4', 'size': 30 * 1024 * 1024})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class ContentAddressedStorageTests(APITestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.workdir = tempfile.mkdtemp(dir=TEST_MEDIA_ROOT)
+        cls.sample = make_test_video(os.path.join(cls.workdir, 'sample.mp4'), padding=5 * 1024 * 1024)
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='blobuser', password='12345')
+        self.client.force_authenticate(user=self.user)
+
+    def upload(self):
+        with open(self.sample, 'rb') as handle:
+            response = self.client.post(reverse('video-upload'), {'video_file': handle}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return Video.objects.get(pk=response.data['id'])
+
+    def test_identical_uploads_share_one_blob(self):
+        from videoapi.models import Blob
+        first, second = self.upload(), self.upload()
+        self.assertEqual(first.blob_id, second.blob_id)
+        self.assertEqual(first.video_file.name, second.video_file.name)
+        self.assertEqual(Blob.objects.get(pk=first.blob_id).ref_count, 2)
+        self.assertEqual(len(os.listdir(os.path.dirname(first.video_file.path))), 1)
+
+    def test_blob_is_reclaimed_with_the_last_reference(self):
+        from videoapi.models import Blob
+        first, second = self.upload(), self.upload()
+        path = first.video_file.path
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(Blob.objects.get(pk=second.blob_id).ref_count, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(Blob.objects.exists())
+
+    def test_replaced_file_is_stored_as_a_new_blob(self):
+        from videoapi.models import Blob
+        video = self.upload()
+        old_blob = video.blob
+        detail = reverse('video-detail', kwargs={'pk': video.pk})
+        etag = self.client.get(detail)['ETag']
+        replacement = make_test_video(os.path.join(self.workdir, 'replacement.mp4'), duration=8,
+                                      padding=6 * 1024 * 1024)
+        with open(replacement, 'rb') as handle, patch('videoapi.tasks.postprocess_asset_task'):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.put(detail, {'video_file': handle, 'title': 'New'}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        video.refresh_from_db()
+        self.assertNotEqual(video.blob_id, old_blob.pk)
+        self.assertEqual(video.file_size, os.path.getsize(replacement))
+        self.assertAlmostEqual(video.duration, 8, delta=0.1)
+        self.assertEqual(video.video_file.name, video.blob.file.name)
+        self.assertFalse(Blob.objects.filter(pk=old_blob.pk).exists())
+        self.assertFalse(os.path.exists(old_blob.file.path))
+        response = self.client.get(detail, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class VideoListPaginationTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='listuser', password='12345')
+        self.other = User.objects.create_user(username='otheruser', password='12345')
+        self.client.force_authenticate(user=self.user)
+        for index in range(5):
+            Video.objects.create(title=f'Video {index}', video_file=f'videos/{index}.mp4', file_size=1000 + index,
+                                 owner=self.user if index % 2 else self.other, is_trimmed=index == 4,
+                                 duration=index * 5)
+
+    def test_cursor_pages_cover_every_row_once(self):
+        seen = []
+        url = reverse('video-list') + '?page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen += [video['id'] for video in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(seen, list(Video.objects.order_by('-uploaded_at', '-id').values_list('id', flat=True)))
+
+    def test_listing_does_not_stat_files(self):
+        with patch('django.core.files.storage.FileSystemStorage.size') as mock_size:
+            response = self.client.get(reverse('video-list'))
+        mock_size.assert_not_called()
+        self.assertEqual(sorted(video['file_size'] for video in response.data['results']), [1000, 1001, 1002, 1003, 1004])
+
+    def test_filters(self):
+        response = self.client.get(reverse('video-list'), {'owner': 'me'})
+        self.assertEqual({video['title'] for video in response.data['results']}, {'Video 1', 'Video 3'})
+        response = self.client.get(reverse('video-list'), {'is_trimmed': 'true'})
+        self.assertEqual([video['title'] for video in response.data['results']], ['Video 4'])
+        response = self.client.get(reverse('video-list'), {'min_duration': 5, 'max_duration': 10})
+        self.assertEqual({video['title'] for video in response.data['results']}, {'Video 1', 'Video 2'})
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('video-list'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ResponseCacheTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='cacheduser', password='12345')
+        self.other = User.objects.create_user(username='othercacheduser', password='12345')
+        self.client.force_authenticate(user=self.user)
+        self.video = Video.objects.create(title='First', video_file='videos/first.mp4', owner=self.user)
+        Video.objects.create(title='Second', video_file='videos/second.mp4', owner=self.other)
+
+    def test_list_is_served_from_the_cache_and_revalidated(self):
+        url = reverse('video-list')
+        first = self.client.get(url, {'owner': 'me'})
+        with self.assertNumQueries(0):
+            second = self.client.get(url, {'owner': 'me'})
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['ETag'], first['ETag'])
+        response = self.client.get(url, {'owner': 'me'}, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Keyed by user, "me" is somebody else for them
+        self.client.force_authenticate(user=self.other)
+        response = self.client.get(url, {'owner': 'me'})
+        self.assertEqual([video['title'] for video in response.data['results']], ['Second'])
+
+    def test_changes_invalidate_list_and_detail(self):
+        from videoapi.bulk import bulk_update
+        from videoapi.models import Tag
+        list_url, detail_url = reverse('video-list'), reverse('video-detail', kwargs={'pk': self.video.pk})
+        etag = self.client.get(list_url)['ETag']
+        self.assertEqual(self.client.get(detail_url).data['title'], 'First')
+
+        self.video.title = 'Renamed'
+        self.video.save()
+        response = self.client.get(list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('Renamed', [video['title'] for video in response.data['results']])
+        self.assertEqual(self.client.get(detail_url).data['title'], 'Renamed')
+
+        bulk_update(Video.objects.filter(pk=self.video.pk), tags={'set': ['a']})
+        self.assertEqual(self.client.get(detail_url).data['tags'], ['a'])
+        Tag.objects.get(name='a').videos.clear()
+        self.assertEqual(self.client.get(detail_url).data['tags'], [])
+
+        self.video.delete()
+        self.assertEqual(self.client.get(detail_url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual([video['title'] for video in self.client.get(list_url).data['results']], ['Second'])
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT, JOB_EVENTS_POLL_INTERVAL=0.01)
+class JobStatusTests(APITestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.workdir = tempfile.mkdtemp(dir=TEST_MEDIA_ROOT)
+        cls.sample = make_test_video(os.path.join(cls.workdir, 'sample.mp4'))
+
+    def setUp(self):
+        from videoapi.models import Job
+        self.user = User.objects.create_user(username='jobuser', password='12345')
+        self.client.force_authenticate(user=self.user)
+        shutil.copy(self.sample, os.path.join(self.workdir, 'source.mp4'))
+        self.video = Video.objects.create(title='Source', video_file=os.path.relpath(
+            os.path.join(self.workdir, 'source.mp4'), TEST_MEDIA_ROOT))
+        self.job = Job.objects.create(kind='trim', owner=self.user)
+
+    def test_task_reports_result_on_its_job(self):
+        from videoapi.tasks import trim_video_task
+        trim_video_task.apply(args=[self.video.pk, 1.0, 3.0, 'fast'], task_id=str(self.job.id))
+
+        # The job endpoints are async views that authenticate the JWT themselves
+        from rest_framework_simplejwt.tokens import RefreshToken
+        token = RefreshToken.for_user(self.user).access_token
+        response = self.client.get(reverse('job-detail', kwargs={'pk': self.job.id}), HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['state'], 'SUCCESS')
+        self.assertEqual(response.json()['percent'], 100)
+        trimmed = Video.objects.get(pk=response.json()['video']['id'])
+        self.assertTrue(trimmed.is_trimmed)
+        self.assertAlmostEqual(trimmed.duration, 2, delta=0.2)
+
+    def test_jobs_of_other_users_are_not_found(self):
+        from rest_framework_simplejwt.tokens import RefreshToken
+        other = User.objects.create_user(username='otherjobuser', password='12345')
+        token = RefreshToken.for_user(other).access_token
+        for name in ('job-detail', 'job-events'):
+            response = self.client.get(reverse(name, kwargs={'pk': self.job.id}), HTTP_AUTHORIZATION=f'Bearer {token}')
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_failed_task_marks_job_failed(self):
+        from videoapi.tasks import trim_video_task
+        trim_video_task.apply(args=[0, 1.0, 3.0, 'fast'], task_id=str(self.job.id))
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.state, 'FAILURE')
+        self.assertTrue(self.job.error)
+
+    async def test_job_events_stream_until_done(self):
+        from asgiref.sync import sync_to_async
+        from rest_framework_simplejwt.tokens import RefreshToken
+        from videoapi.models import Job
+        await Job.objects.filter(pk=self.job.pk).aupdate(state=Job.SUCCESS, progress=1)
+        token = await sync_to_async(lambda: str(RefreshToken.for_user(self.user).access_token))()
+        url = reverse('job-events', kwargs={'pk': self.job.id})
+
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 401)
+
+        response = await self.async_client.get(url, headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertIn('event: done', body)
+        self.assertIn('"state": "SUCCESS"', body)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class DerivationCacheTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='cacheuser', password='12345')
+        self.client.force_authenticate(user=self.user)
+        self.video = Video.objects.create(title='Source', video_file=ContentFile(b'\x00', name='source.mp4'))
+        self.other = Video.objects.create(title='Other', video_file=ContentFile(b'\x00', name='other.mp4'))
+
+    def make_blob(self, content):
+        from videoapi.blobs import ingest_file
+        path = os.path.join(tempfile.mkdtemp(dir=TEST_MEDIA_ROOT), 'out.mp4')
+        with open(path, 'wb') as handle:
+            handle.write(content)
+        return ingest_file(path)
+
+    @patch('videoapi.views.trim_video_task')
+    def test_identical_trims_share_one_task_then_hit_the_cache(self, mock_task):
+        from videoapi.derivations import record_output
+        url = reverse('trim-video', kwargs={'pk': self.video.pk})
+        first = self.client.post(url, {'start': 1, 'end': 4})
+        second = self.client.post(url, {'start': '1.0', 'end': '4.0'})
+        self.assertEqual(second.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(second.data['task_id'], first.data['task_id'])
+        mock_task.apply_async.assert_called_once()
+
+        self.assertEqual(self.client.post(url, {'start': 1, 'end': 5}).status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(mock_task.apply_async.call_count, 2)
+
+        output = record_output(first.data['task_id'], 'trim', self.make_blob(b'trimmed'), {'duration': 3},
+                               self.user.pk)
+        self.assertEqual((output.owner, output.is_trimmed, output.duration), (self.user, True, 3))
+        cached = self.client.post(url, {'start': 1, 'end': 4})
+        self.assertEqual(cached.status_code, status.HTTP_200_OK)
+        self.assertTrue(cached.data['cached'])
+        self.assertEqual(cached.data['video']['id'], output.id)
+        self.assertEqual(mock_task.apply_async.call_count, 2)
+
+    @patch('videoapi.views.trim_video_task')
+    def test_every_requester_gets_a_video_of_their_own(self, mock_task):
+        from videoapi.derivations import record_output, finish_followers
+        from videoapi.models import Job
+        url = reverse('trim-video', kwargs={'pk': self.video.pk})
+        first = self.client.post(url, {'start': 1, 'end': 4})
+        other = User.objects.create_user(username='otheruser', password='12345')
+        self.client.force_authenticate(user=other)
+        joined = self.client.post(url, {'start': 1, 'end': 4})
+        self.assertEqual(joined.status_code, status.HTTP_202_ACCEPTED)
+        self.assertNotEqual(joined.data['task_id'], first.data['task_id'])
+        self.assertEqual(self.client.post(url, {'start': 1, 'end': 4}).data['task_id'], joined.data['task_id'])
+        mock_task.apply_async.assert_called_once()
+
+        blob = self.make_blob(b'trimmed')
+        output = record_output(first.data['task_id'], 'trim', blob, {'duration': 3}, self.user.pk)
+        finish_followers(first.data['task_id'], 'Video trimmed')
+        follower = Job.objects.get(pk=joined.data['task_id'])
+        self.assertEqual(follower.state, Job.SUCCESS)
+        self.assertEqual(follower.video.owner, other)
+        self.assertNotEqual(follower.video.pk, output.pk)
+        self.assertEqual(follower.video.blob, blob)
+        self.assertEqual(follower.result['id'], follower.video.pk)
+        # Held by the cache and by both videos
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 3)
+
+    @patch('videoapi.views.merge_videos_task')
+    def test_merge_order_is_part_of_the_key(self, mock_task):
+        url = reverse('merge-videos')
+        first = self.client.post(url, {'video_ids': [self.video.pk, self.other.pk]}, format='json')
+        same = self.client.post(url, {'video_ids': [self.video.pk, self.other.pk]}, format='json')
+        reversed_order = self.client.post(url, {'video_ids': [self.other.pk, self.video.pk]}, format='json')
+        self.assertEqual(same.data['task_id'], first.data['task_id'])
+        self.assertNotEqual(reversed_order.data['task_id'], first.data['task_id'])
+        self.assertEqual(mock_task.apply_async.call_count, 2)
+
+        missing = self.client.post(url, {'video_ids': [self.video.pk, 0]}, format='json')
+        self.assertEqual(missing.status_code, status.HTTP_404_NOT_FOUND)
+
+    @patch('videoapi.views.trim_video_task')
+    def test_unknown_source_is_not_found(self, mock_task):
+        response = self.client.post(reverse('trim-video', kwargs={'pk': 0}), {'start': 1, 'end': 4})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        mock_task.apply_async.assert_not_called()
+
+    @patch('videoapi.views.trim_video_task')
+    def test_failed_derivation_is_retried(self, mock_task):
+        from videoapi.models import Job
+        url = reverse('trim-video', kwargs={'pk': self.video.pk})
+        first = self.client.post(url, {'start': 1, 'end': 4})
+        Job.objects.filter(pk=first.data['task_id']).update(state=Job.FAILURE)
+        retry = self.client.post(url, {'start': 1, 'end': 4})
+        self.assertNotEqual(retry.data['task_id'], first.data['task_id'])
+        self.assertEqual(mock_task.apply_async.call_count, 2)
+
+    def test_eviction_drops_idle_then_least_recently_used(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from videoapi.derivations import evict_derivations, materialize
+        from videoapi.models import Blob, Derivation
+        now = timezone.now()
+        blobs = []
+        for index, age in enumerate([timedelta(days=30), timedelta(hours=3), timedelta(hours=2), timedelta(hours=1)]):
+            blob = self.make_blob(str(index).encode() * 100)
+            derivation = Derivation.objects.create(key=str(index), kind='trim', params={}, blob=blob, media={},
+                                                   size=100)
+            Derivation.objects.filter(pk=derivation.pk).update(last_accessed=now - age)
+            blobs.append(blob)
+        # A video handed out from the oldest output outlives its eviction
+        output = materialize(Derivation.objects.get(key='0'), self.user.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(evict_derivations(max_bytes=200, max_idle=7 * 24 * 60 * 60), 2)
+        self.assertEqual(set(Derivation.objects.values_list('key', flat=True)), {'2', '3'})
+        self.assertTrue(Video.objects.filter(pk=output.pk).exists())
+        self.assertEqual(Blob.objects.get(pk=blobs[0].pk).ref_count, 1)
+        self.assertFalse(Blob.objects.filter(pk=blobs[1].pk).exists())
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class BatchTrimTests(APITestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.workdir = tempfile.mkdtemp(dir=TEST_MEDIA_ROOT)
+        cls.sample = make_test_video(os.path.join(cls.workdir, 'sample.mp4'), duration=8)
+
+    def setUp(self):
+        from videoapi.models import Job
+        self.user = User.objects.create_user(username='batchuser', password='12345')
+        self.client.force_authenticate(user=self.user)
+        shutil.copy(self.sample, os.path.join(self.workdir, 'source.mp4'))
+        self.video = Video.objects.create(title='Source', video_file=os.path.relpath(
+            os.path.join(self.workdir, 'source.mp4'), TEST_MEDIA_ROOT))
+        self.job = Job.objects.create(kind='batch_trim', owner=self.user)
+
+    def test_batch_cuts_every_range_and_fills_the_cache(self):
+        from videoapi.tasks import batch_trim_video_task
+        ranges = [[0.5, 2.0], [1.5, 4.0], [6.0, 7.5]]
+        result = batch_trim_video_task.apply(args=[self.video.pk, ranges, 'exact'], task_id=str(self.job.id)).get()
+
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.state, 'SUCCESS')
+        self.assertEqual(self.job.result['ids'], result['ids'])
+        durations = [Video.objects.get(pk=pk).duration for pk in result['ids']]
+        for duration, (start, end) in zip(durations, ranges):
+            self.assertAlmostEqual(duration, end - start, delta=0.1)
+
+        url = reverse('batch-trim-video', kwargs={'pk': self.video.pk})
+        response = self.client.post(url, {'ranges': ranges}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([v['id'] for v in response.data['videos']], result['ids'])
+
+        single = self.client.post(reverse('trim-video', kwargs={'pk': self.video.pk}), {'start': 1.5, 'end': 4})
+        self.assertEqual(single.status_code, status.HTTP_200_OK)
+        self.assertEqual(single.data['video']['id'], result['ids'][1])
+
+    def test_repeated_range_is_cut_once(self):
+        from videoapi.tasks import batch_trim_video_task
+        result = batch_trim_video_task.apply(args=[self.video.pk, [[0.5, 2.0], [3.0, 4.0], [0.5, 2.0]], 'fast'],
+                                             task_id=str(self.job.id)).get()
+        self.assertEqual(result['ids'][0], result['ids'][2])
+        self.assertEqual(Video.objects.filter(owner=self.user, is_trimmed=True).count(), 2)
+
+    @patch('videoapi.views.batch_trim_video_task')
+    def test_batch_request_validation(self, mock_task):
+        url = reverse('batch-trim-video', kwargs={'pk': self.video.pk})
+        for ranges in ([], [[2, 1]], [['a', 1]], [[1]], 'oops'):
+            response = self.client.post(url, {'ranges': ranges}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        mock_task.apply_async.assert_not_called()
+        missing = self.client.post(reverse('batch-trim-video', kwargs={'pk': 0}), {'ranges': [[0, 1]]}, format='json')
+        self.assertEqual(missing.status_code, status.HTTP_404_NOT_FOUND)
+
+        response = self.client.post(url, {'ranges': [[0, 1], [2, 3]], 'mode': 'fast'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        mock_task.apply_async.assert_called_once_with(args=[self.video.pk, [[0.0, 1.0], [2.0, 3.0]], 'fast'],
+                                                      task_id=response.data['task_id'], queue='fast', priority=ANY)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class JobSchedulingTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='scheduser', password='12345')
+        self.client.force_authenticate(user=self.user)
+
+    def make_video(self, duration, width=1280, height=720, **fields):
+        return Video.objects.create(title='', video_file=ContentFile(b'\x00', name='s.mp4'), duration=duration,
+                                    width=width, height=height, video_codec='h264', audio_codec='aac', fps=25, **fields)
+
+    def test_jobs_are_routed_by_cost(self):
+        from videoapi.scheduling import plan_job
+        short = self.make_video(10)
+        long = self.make_video(1800, width=1920, height=1080)
+
+        fast = plan_job('trim', [short], {'start': 1, 'end': 3, 'mode': 'fast'})
+        exact = plan_job('trim', [long], {'start': 0, 'end': 600, 'mode': 'exact'})
+        copy_merge = plan_job('merge', [short, short], {})
+        encode_merge = plan_job('merge', [short, long], {})
+        self.assertEqual([fast['queue'], exact['queue'], copy_merge['queue'], encode_merge['queue']],
+                         ['fast', 'encode', 'fast', 'merge'])
+        self.assertLess(fast['estimated_cost'], exact['estimated_cost'])
+        self.assertLess(fast['priority'], exact['priority'])
+
+    @override_settings(VIDEO_QUEUE_CONCURRENCY={'encode': 2})
+    def test_expected_wait_counts_work_served_first(self):
+        from videoapi.models import Job
+        from videoapi.scheduling import expected_wait
+        Job.objects.create(kind='trim', queue='encode', state=Job.STARTED, progress=0.5, estimated_cost=100, priority=6)
+        Job.objects.create(kind='trim', queue='encode', priority=2, estimated_cost=20)
+        Job.objects.create(kind='trim', queue='encode', priority=8, estimated_cost=400)
+        Job.objects.create(kind='trim', queue='fast', priority=1, estimated_cost=50)
+        Job.objects.create(kind='trim', queue='encode', state=Job.SUCCESS, estimated_cost=900)
+
+        self.assertEqual(expected_wait('encode', 2), (50 + 20) / 2)
+        self.assertEqual(expected_wait('encode', 9), (50 + 20 + 400) / 2)
+
+    @patch('videoapi.views.merge_videos_task')
+    def test_submission_reports_queue_and_wait(self, mock_task):
+        videos = [self.make_video(30), self.make_video(30, width=640, height=360)]
+        response = self.client.post(reverse('merge-videos'), {'video_ids': [v.pk for v in videos]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['queue'], 'merge')
+        self.assertEqual(response.data['expected_wait'], 0)
+        self.assertGreater(response.data['estimated_cost'], 0)
+        self.assertEqual(mock_task.apply_async.call_args.kwargs['queue'], 'merge')
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT, MERGE_PARALLEL_MIN_DURATION=0, MERGE_CHUNK_SECONDS=2)
+class ParallelMergeTests(APITestCase):
+    def test_chunks_snap_to_keyframes_and_frame_grid(self):
+        from videoapi.media import plan_chunks
+        self.assertEqual(plan_chunks(25, 10), [(0.0, 10), (10, 25)])
+        self.assertEqual(plan_chunks(30, 10, keyframes=[0, 8.61, 12, 21], fps=25),
+                         [(0.0, 8.6), (8.6, 21.0), (21.0, 30)])
+
+    def test_mismatched_inputs_are_merged_in_parallel_chunks(self):
+        from videoapi.media import run_ffmpeg, probe_streams
+        from videoapi.models import Job
+        from videoapi.tasks import merge_videos_task
+        workdir = tempfile.mkdtemp(dir=TEST_MEDIA_ROOT)
+        first = make_test_video(os.path.join(workdir, 'first.mp4'), duration=5)
+        second = os.path.join(workdir, 'second.mp4')
+        run_ffmpeg(['-f', 'lavfi', '-i', 'testsrc=size=96x64:rate=30', '-t', '3', '-c:v', 'libx264',
+                    '-pix_fmt', 'yuv420p', second])
+        videos = [Video.objects.create(title=os.path.basename(path), video_file=os.path.relpath(path, TEST_MEDIA_ROOT))
+                  for path in (first, second)]
+        job = Job.objects.create(kind='merge')
+
+        merge_videos_task.apply(args=[[v.pk for v in videos]], task_id=str(job.id))
+        job.refresh_from_db()
+        self.assertEqual(job.state, 'SUCCESS', job.error)
+        info = probe_streams(job.video.video_file.path)
+        self.assertAlmostEqual(info['duration'], 8, delta=0.1)
+        self.assertEqual((info['video']['width'], info['video']['height'], info['video']['fps']), (64, 48, 30.0))
+        self.assertEqual(info['audio']['codec'], 'aac')
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class EncodingProfileTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='profileuser', password='12345')
+        self.client.force_authenticate(user=self.user)
+
+    def test_profile_options(self):
+        from videoapi.media import encoder_args, audio_encoder_args
+        from videoapi.profiles import moviepy_options
+        profile = {'codec': 'libx264', 'preset': 'slow', 'crf': 18, 'threads': 0, 'pix_fmt': 'yuv420p',
+                   'audio_codec': 'aac', 'audio_bitrate': 192000}
+        self.assertEqual(encoder_args(profile, threads=2),
+                         ['-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-preset', 'slow', '-crf', 18, '-threads', 2])
+        self.assertEqual(encoder_args(pix_fmt='yuv444p'), ['-c:v', 'libx264', '-pix_fmt', 'yuv444p'])
+        self.assertEqual(audio_encoder_args(profile), ['-c:a', 'aac', '-b:a', 192000])
+        with self.settings(ENCODING_PROFILES={'archive': profile}):
+            self.assertEqual(moviepy_options('archive'), {
+                'codec': 'libx264', 'audio_codec': 'aac', 'threads': None, 'preset': 'slow',
+                'ffmpeg_params': ['-pix_fmt', 'yuv420p', '-crf', '18'], 'audio_bitrate': '192000',
+            })
+
+    @patch('videoapi.views.merge_videos_task')
+    def test_profile_is_validated_and_part_of_the_key(self, mock_task):
+        first = Video.objects.create(title='First', video_file=ContentFile(b'\x00', name='first.mp4'))
+        second = Video.objects.create(title='Second', video_file=ContentFile(b'\x00', name='second.mp4'))
+        url = reverse('merge-videos')
+        ids = [first.pk, second.pk]
+        response = self.client.post(url, {'video_ids': ids, 'profile': 'lossless'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        default = self.client.post(url, {'video_ids': ids}, format='json')
+        balanced = self.client.post(url, {'video_ids': ids, 'profile': 'balanced'}, format='json')
+        archive = self.client.post(url, {'video_ids': ids, 'profile': 'archive'}, format='json')
+        self.assertEqual(balanced.data['task_id'], default.data['task_id'])
+        self.assertNotEqual(archive.data['task_id'], default.data['task_id'])
+        self.assertEqual([call.kwargs['args'] for call in mock_task.apply_async.call_args_list],
+                         [[ids, 'balanced'], [ids, 'archive']])
+
+    @patch('videoapi.views.merge_videos_task')
+    def test_stream_copy_merge_is_keyed_without_profile(self, mock_task):
+        fields = {'duration': 4.0, 'video_codec': 'h264', 'audio_codec': 'aac', 'width': 64, 'height': 48, 'fps': 25.0}
+        first = Video.objects.create(title='First', video_file=ContentFile(b'\x00', name='first.mp4'), **fields)
+        second = Video.objects.create(title='Second', video_file=ContentFile(b'\x00', name='second.mp4'), **fields)
+        url = reverse('merge-videos')
+        ids = [first.pk, second.pk]
+        balanced = self.client.post(url, {'video_ids': ids, 'profile': 'balanced'}, format='json')
+        archive = self.client.post(url, {'video_ids': ids, 'profile': 'archive'}, format='json')
+        self.assertEqual(archive.data['task_id'], balanced.data['task_id'])
+        self.assertEqual(mock_task.apply_async.call_count, 1)
+
+        Video.objects.filter(pk=second.pk).update(width=128, height=96)
+        resized = self.client.post(url, {'video_ids': ids, 'profile': 'archive'}, format='json')
+        self.assertNotEqual(resized.data['task_id'], balanced.data['task_id'])
+
+    @patch('videoapi.views.merge_videos_task')
+    def test_merge_keyed_as_copy_stores_an_encode_under_its_profile(self, mock_task):
+        from videoapi.media import run_ffmpeg
+        from videoapi.models import Job
+        from videoapi.probe import probe_media, media_fields
+        from videoapi.tasks import merge_videos_task
+        workdir = tempfile.mkdtemp(dir=TEST_MEDIA_ROOT)
+        first = make_test_video(os.path.join(workdir, 'first.mp4'), duration=2)
+        # Same stored metadata, but a pixel format the packets cannot be joined across
+        second = os.path.join(workdir, 'second.mp4')
+        run_ffmpeg(['-f', 'lavfi', '-i', 'testsrc=size=64x48:rate=25:duration=2', '-f', 'lavfi', '-i',
+                    'sine=frequency=440:duration=2', '-c:v', 'libx264', '-g', 25, '-pix_fmt', 'yuv444p',
+                    '-c:a', 'aac', '-shortest', second])
+        ids = [Video.objects.create(title=os.path.basename(path), video_file=os.path.relpath(path, TEST_MEDIA_ROOT),
+                                    **media_fields(probe_media(path))).pk for path in (first, second)]
+        url = reverse('merge-videos')
+
+        def merge(profile):
+            response = self.client.post(url, {'video_ids': ids, 'profile': profile}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+            merge_videos_task.apply(args=[ids, profile], task_id=response.data['task_id'])
+            job = Job.objects.get(pk=response.data['task_id'])
+            self.assertEqual(job.state, Job.SUCCESS, job.error)
+            return job.video
+
+        output = merge('fast-preview')
+        self.assertEqual(output.encoding_profile, 'fast-preview')
+        self.assertEqual(merge('archive').encoding_profile, 'archive')
+        self.assertEqual(merge('fast-preview').pk, output.pk)
+
+    def test_exact_trim_records_its_profile(self):
+        from videoapi.media import probe_streams
+        from videoapi.models import Job
+        from videoapi.tasks import trim_video_task
+        workdir = tempfile.mkdtemp(dir=TEST_MEDIA_ROOT)
+        path = make_test_video(os.path.join(workdir, 'source.mp4'), duration=2)
+        video = Video.objects.create(title='Source', video_file=os.path.relpath(path, TEST_MEDIA_ROOT))
+
+        for mode, expected in (('exact', 'fast-preview'), ('fast', '')):
+            job = Job.objects.create(kind='trim')
+            trim_video_task.apply(args=[video.pk, 0, 1, mode, 'fast-preview'], task_id=str(job.id))
+            job.refresh_from_db()
+            self.assertEqual(job.state, 'SUCCESS', job.error)
+            self.assertEqual(job.video.encoding_profile, expected)
+        self.assertEqual(probe_streams(job.video.video_file.path)['video']['codec'], 'h264')
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class SequentialMergeTests(APITestCase):
+    def test_mismatched_inputs_are_decoded_one_at_a_time(self):
+        import threading
+        from videoapi import media
+        from videoapi.models import Job
+        from videoapi.tasks import merge_videos_task
+        workdir = tempfile.mkdtemp(dir=TEST_MEDIA_ROOT)
+        first = make_test_video(os.path.join(workdir, 'first.mp4'), duration=2)
+        silent = os.path.join(workdir, 'silent.mp4')
+        media.run_ffmpeg(['-f', 'lavfi', '-i', 'testsrc=size=97x65:rate=30', '-t', '1', '-c:v', 'libx264', silent])
+        resampled = os.path.join(workdir, 'resampled.mkv')
+        media.run_ffmpeg(['-f', 'lavfi', '-i', 'testsrc=size=128x96:rate=24:duration=1',
+                          '-f', 'lavfi', '-i', 'sine=duration=1:sample_rate=22050', '-c:v', 'mpeg4', resampled])
+        paths = [first, silent, resampled] * 2
+        videos = [Video.objects.create(title=os.path.basename(path), video_file=os.path.relpath(path, TEST_MEDIA_ROOT))
+                  for path in paths]
+        job = Job.objects.create(kind='merge')
+
+        run_ffmpeg, running, peak, lock = media.run_ffmpeg, [0], [0], threading.Lock()
+
+        def counting(*args, **kwargs):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            try:
+                return run_ffmpeg(*args, **kwargs)
+            finally:
+                with lock:
+                    running[0] -= 1
+
+        with patch('videoapi.media.run_ffmpeg', side_effect=counting):
+            merge_videos_task.apply(args=[[v.pk for v in videos]], task_id=str(job.id))
+        job.refresh_from_db()
+        self.assertEqual(job.state, 'SUCCESS', job.error)
+        # The encoder plus one video and one audio decoder, whatever the number of inputs
+        self.assertLessEqual(peak[0], 3)
+        info = media.probe_streams(job.video.video_file.path)
+        self.assertAlmostEqual(info['duration'], 8, delta=0.2)
+        self.assertEqual((info['video']['width'], info['video']['height'], info['video']['fps']), (64, 48, 30.0))
+        self.assertEqual((info['audio']['codec'], info['audio']['sample_rate']), ('aac', 44100))
+
+    def test_inputs_without_video_are_rejected(self):
+        from videoapi.media import MediaError, sequential_merge_encode
+        infos = [{'duration': 1, 'video': {'width': 64, 'height': 48, 'fps': 25}}, {'duration': 1, 'video': None}]
+        with self.assertRaises(MediaError):
+            sequential_merge_encode(['first.mp4', 'audio.m4a'], os.path.join(TEST_MEDIA_ROOT, 'out.mp4'), infos=infos)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT, VIDEO_POSTPROCESS_STAGES=['hls'], HLS_SEGMENT_SECONDS=2,
+                   HLS_RENDITIONS=[{'name': '24p', 'height': 24, 'video_bitrate': 50000, 'audio_bitrate': 32000}])
+class HlsPackagingTests(APITestCase):
+    def setUp(self):
+        from videoapi.blobs import ingest_file
+        self.user = User.objects.create_user(username='hlsuser', password='12345')
+        self.client.force_authenticate(user=self.user)
+        workdir = tempfile.mkdtemp(dir=TEST_MEDIA_ROOT)
+        blob = ingest_file(make_test_video(os.path.join(workdir, 'source.mp4'), duration=5))
+        self.video = Video.objects.create(title='Source', video_file=blob.file.name, blob=blob, file_size=blob.size)
+
+    def test_ladder_skips_rungs_above_the_source(self):
+        from videoapi.media import hls_ladder
+        info = {'bitrate': 5000000, 'video': {'height': 540}}
+        ladder = hls_ladder(info, [{'name': '720p', 'height': 720, 'video_bitrate': 2800000, 'audio_bitrate': 128000},
+                                   {'name': '360p', 'height': 360, 'video_bitrate': 800000, 'audio_bitrate': 96000}])
+        self.assertEqual([(rung['name'], rung['height']) for rung in ladder], [('360p', 360), ('original', 540)])
+        self.assertEqual(ladder[-1]['video_bitrate'], 1600000)
+
+    @patch('videoapi.tasks.postprocess_asset_task')
+    def test_share_link_requests_renditions_then_serves_them(self, mock_task):
+        from videoapi.models import MediaAsset
+        from videoapi.postprocess import build_asset
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.get(reverse('share-video', kwargs={'pk': self.video.pk}))
+        self.assertNotIn('hls', response.data)
+        asset = MediaAsset.objects.get(blob=self.video.blob, kind='hls')
+        mock_task.apply_async.assert_called_once_with(args=[asset.pk], queue='encode', priority=9)
+
+        build_asset(asset.pk)
+        response = self.client.get(reverse('share-video', kwargs={'pk': self.video.pk}))
+        token = response.data['link'].rstrip('/').split('/')[-1]
+        self.assertTrue(response.data['hls'].endswith(f'{token}/hls/master.m3u8'))
+
+        def fetch(name):
+            return self.client.get(reverse('video-stream-hls', kwargs={'pk': self.video.pk, 'token': token, 'name': name}))
+
+        master = fetch('master.m3u8')
+        self.assertEqual(master['Content-Type'], 'application/vnd.apple.mpegurl')
+        playlist_names = [line for line in b''.join(master.streaming_content).decode().splitlines()
+                          if line.endswith('.m3u8')]
+        self.assertEqual(playlist_names, ['24p/index.m3u8', 'original/index.m3u8'])
+
+        playlist = b''.join(fetch('original/index.m3u8').streaming_content).decode()
+        self.assertIn('#EXT-X-ENDLIST', playlist)
+        self.assertIn('#EXT-X-MAP:URI="init', playlist)
+        segment = fetch('original/' + [line for line in playlist.splitlines() if line.endswith('.m4s')][0])
+        self.assertEqual(segment.status_code, status.HTTP_200_OK)
+        self.assertIn('immutable', segment['Cache-Control'])
+        self.assertEqual(fetch('../../../../settings.py').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_assets_are_removed_with_their_blob(self):
+        from videoapi.models import MediaAsset
+        from videoapi.postprocess import build_asset
+        asset = MediaAsset.objects.create(blob=self.video.blob, kind='hls')
+        build_asset(asset.pk)
+        path = os.path.join(TEST_MEDIA_ROOT, MediaAsset.objects.get(pk=asset.pk).path)
+        self.assertTrue(os.path.exists(os.path.join(path, 'master.m3u8')))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.video.delete()
+        self.assertFalse(os.path.exists(path))
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT, VIDEO_POSTPROCESS_STAGES=['previews'], PREVIEW_INTERVAL=1,
+                   PREVIEW_THUMB_WIDTH=32, PREVIEW_SPRITE_COLUMNS=2, PREVIEW_SPRITE_ROWS=2)
+class PreviewTests(APITestCase):
+    def test_tile_lays_frames_out_row_by_row(self):
+        import numpy as np
+        from videoapi.previews import tile, scene_scores
+        frames = np.arange(3, dtype=np.uint8).reshape(3, 1, 1, 1).repeat(3, axis=3)
+        sheet = tile(frames, 2)
+        self.assertEqual(sheet.shape, (2, 2, 3))
+        self.assertEqual(sheet[:, :, 0].tolist(), [[0, 1], [2, 0]])
+
+        still = np.zeros((3, 2, 2, 3), dtype=np.uint8)
+        still[2] = 255
+        self.assertEqual(scene_scores(still), [0.0, 0.0, 1.0])
+
+    def test_source_without_frames_fails_cleanly(self):
+        from videoapi.media import MediaError
+        from videoapi.previews import build_previews
+        info = {'duration': 0.0, 'video': {'width': 64, 'height': 48}}
+        with patch('videoapi.previews.probe_streams', return_value=info):
+            with patch('videoapi.previews.sample_frames', return_value=iter([])), self.assertRaises(MediaError):
+                build_previews('empty.mp4', tempfile.mkdtemp(dir=TEST_MEDIA_ROOT))
+
+    @patch('videoapi.tasks.postprocess_asset_task')
+    def test_previews_are_built_and_served(self, mock_task):
+        from videoapi.blobs import ingest_file
+        from videoapi.models import MediaAsset
+        from videoapi.postprocess import build_asset
+        user = User.objects.create_user(username='previewuser', password='12345')
+        self.client.force_authenticate(user=user)
+        workdir = tempfile.mkdtemp(dir=TEST_MEDIA_ROOT)
+        blob = ingest_file(make_test_video(os.path.join(workdir, 'source.mp4'), duration=6))
+        video = Video.objects.create(title='Source', video_file=blob.file.name, blob=blob, file_size=blob.size)
+
+        url = reverse('video-previews', kwargs={'pk': video.pk})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_202_ACCEPTED)
+        build_asset(mock_task.apply_async.call_args.kwargs['args'][0])
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['samples']), 6)
+        self.assertEqual(response.data['sprites'], ['sprite_0.jpg', 'sprite_1.jpg'])
+        self.assertEqual((response.data['thumb_width'], response.data['thumb_height']), (32, 24))
+
+        vtt = self.client.get(response.data['vtt_url'])
+        body = b''.join(vtt.streaming_content).decode()
+        self.assertTrue(body.startswith('WEBVTT'))
+        self.assertIn('00:00:04.000 --> 00:00:05.000\nsprite_1.jpg#xywh=0,0,32,24', body)
+        self.assertTrue(body.rstrip().endswith('sprite_1.jpg#xywh=32,0,32,24'))
+        poster = self.client.get(response.data['poster_url'])
+        self.assertEqual(poster['Content-Type'], 'image/jpeg')
+        self.assertEqual(poster['Cache-Control'], 'private, max-age=31536000, immutable')
+        self.assertEqual(MediaAsset.objects.get(blob=blob, kind='previews').state, MediaAsset.READY)
+
+    @patch('videoapi.tasks.postprocess_asset_task')
+    def test_failed_previews_are_retried_once_the_delay_is_over(self, mock_task):
+        from datetime import timedelta
+        from django.utils import timezone
+        from videoapi.blobs import ingest_file
+        from videoapi.media import MediaError
+        from videoapi.models import MediaAsset
+        from videoapi.postprocess import build_asset
+        user = User.objects.create_user(username='retryuser', password='12345')
+        self.client.force_authenticate(user=user)
+        path = os.path.join(tempfile.mkdtemp(dir=TEST_MEDIA_ROOT), 'broken.mp4')
+        with open(path, 'wb') as handle:
+            handle.write(b'not a video')
+        blob = ingest_file(path)
+        video = Video.objects.create(title='Broken', video_file=blob.file.name, blob=blob, file_size=blob.size)
+        url = reverse('video-previews', kwargs={'pk': video.pk})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(url)
+        with self.assertRaises(MediaError):
+            build_asset(mock_task.apply_async.call_args.kwargs['args'][0])
+
+        # Polling during the delay queues nothing
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertGreater(int(response['Retry-After']), 0)
+        self.assertEqual(mock_task.apply_async.call_count, 1)
+
+        asset = MediaAsset.objects.get(blob=blob, kind='previews')
+        MediaAsset.objects.filter(pk=asset.pk).update(updated_at=timezone.now() - timedelta(hours=1))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_202_ACCEPTED)
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(mock_task.apply_async.call_count, 2)
+        self.assertEqual(MediaAsset.objects.get(pk=asset.pk).state, MediaAsset.PENDING)
+
+        MediaAsset.objects.filter(pk=asset.pk).update(state=MediaAsset.FAILED, attempts=3,
+                                                      updated_at=timezone.now() - timedelta(days=1))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(mock_task.apply_async.call_count, 2)
+        self.assertEqual(self.client.get(reverse('video-previews', kwargs={'pk': 0})).status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class BenchmarkTests(APITestCase):
+    def test_synthetic_frames_are_deterministic(self):
+        import numpy as np
+        from videoapi.synthetic import synthetic_frames
+        first = np.stack(list(synthetic_frames(32, 16, 3, seed=7)))
+        second = np.stack(list(synthetic_frames(32, 16, 3, seed=7)))
+        self.assertEqual(first.shape, (3, 16, 32, 3))
+        self.assertTrue((first == second).all())
+        self.assertFalse((first[0] == first[1]).all())
+
+    def test_suite_reports_every_case(self):
+        from videoapi.benchmarks import run_suite, compare
+        workdir = tempfile.mkdtemp(dir=TEST_MEDIA_ROOT)
+        results = run_suite(workdir, sizes=['64x48'], codecs=['h264', 'vp9'], duration=2, repeat=1,
+                            cases=['validate', 'stream'])
+        by_case = {(entry['case'], entry['input']): entry for entry in results}
+        self.assertEqual(set(by_case), {
+            ('generate', '64x48_h264.mp4'), ('generate', '64x48_vp9.webm'),
+            ('validate_video_file', '64x48_h264.mp4'), ('validate_video_file', '64x48_vp9.webm'),
+            ('stream', '64x48_h264.mp4'), ('stream', '64x48_vp9.webm'),
+        })
+        stream = by_case[('stream', '64x48_h264.mp4')]
+        self.assertNotIn('error', stream)
+        self.assertEqual(stream['bytes'], os.path.getsize(os.path.join(workdir, 'inputs', '64x48_h264.mp4')))
+        self.assertGreater(stream['peak_rss_mb'], 0)
+
+        slower = [dict(entry, wall_time=entry['wall_time'] * 2) for entry in results]
+        self.assertEqual(len(compare(slower, {'results': results})), len(results))
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT, FILE_OFFLOAD='x-accel-redirect')
+class FileOffloadTests(APITestCase):
+    def setUp(self):
+        from itsdangerous import URLSafeTimedSerializer
+        self.video = Video.objects.create(title='Offload', video_file=ContentFile(b'\x00' * 4096, name='offload.mp4'))
+        token = URLSafeTimedSerializer('SECRET_KEY').dumps({'video_id': self.video.pk}, salt='share_video')
+        self.url = reverse('video-stream', kwargs={'pk': self.video.pk, 'token': token})
+
+    def test_accel_redirect_hands_the_body_to_nginx(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-99')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.video.video_file.name}')
+        self.assertEqual(response['Content-Type'], 'video/mp4')
+        self.assertEqual(response['Cache-Control'], 'private, max-age=3600')
+        self.assertIn('ETag', response)
+        self.assertEqual(response.content, b'')
+
+    @override_settings(FILE_OFFLOAD='x-sendfile')
+    def test_sendfile_uses_the_absolute_path(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Sendfile'], self.video.video_file.path)
+        self.assertNotIn('X-Accel-Redirect', response)
+
+    def test_conditional_requests_are_answered_before_offloading(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertNotIn('X-Accel-Redirect', response)
+
+    def test_if_range_falls_back_to_plain_serving(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-99', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('X-Accel-Redirect', response)
+        self.assertEqual(len(b''.join(response.streaming_content)), 4096)
+
+    @override_settings(FILE_OFFLOAD=None)
+    def test_plain_serving_without_offload(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-99')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertNotIn('X-Accel-Redirect', response)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT, STREAM_CHUNK_SIZE=1000)
+class AsyncStreamingTests(APITestCase):
+    def setUp(self):
+        from itsdangerous import URLSafeTimedSerializer
+        self.payload = bytes(range(256)) * 40
+        self.video = Video.objects.create(title='Async', video_file=ContentFile(self.payload, name='async.mp4'))
+        self.token = URLSafeTimedSerializer('SECRET_KEY').dumps({'video_id': self.video.pk}, salt='share_video')
+        self.url = reverse('video-stream', kwargs={'pk': self.video.pk, 'token': self.token})
+
+    async def read(self, response):
+        self.assertTrue(response.is_async)
+        return b''.join([chunk async for chunk in response.streaming_content])
+
+    async def test_full_response_is_read_in_chunks(self):
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Length'], str(len(self.payload)))
+        chunks = [chunk async for chunk in response.streaming_content]
+        self.assertEqual(max(len(chunk) for chunk in chunks), 1000)
+        self.assertEqual(b''.join(chunks), self.payload)
+
+    async def test_ranges(self):
+        response = await self.async_client.get(self.url, headers={'Range': 'bytes=100-199'})
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(await self.read(response), self.payload[100:200])
+
+        response = await self.async_client.get(self.url, headers={'Range': 'bytes=0-9,5000-5009'})
+        body = await self.read(response)
+        self.assertEqual(len(body), int(response['Content-Length']))
+        self.assertIn(self.payload[5000:5010], body)
+
+    async def test_cancelled_read_closes_the_file_once_it_returns(self):
+        import asyncio
+        import threading
+        from videoapi.streaming import offloaded
+        reading, release, closed = threading.Event(), threading.Event(), threading.Event()
+
+        def chunks():
+            try:
+                yield b'first'
+                reading.set()
+                release.wait(5)
+                yield b'second'
+            finally:
+                closed.set()
+
+        body = offloaded(chunks())
+        self.assertEqual(await body.__anext__(), b'first')
+        pending = asyncio.ensure_future(body.__anext__())
+        await asyncio.get_running_loop().run_in_executor(None, reading.wait, 5)
+        pending.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await pending
+        self.assertFalse(closed.is_set())
+        release.set()
+        self.assertTrue(await asyncio.get_running_loop().run_in_executor(None, closed.wait, 5))
+
+    async def test_invalid_token_and_missing_video(self):
+        from itsdangerous import URLSafeTimedSerializer
+        response = await self.async_client.get(reverse('video-stream', kwargs={'pk': self.video.pk, 'token': 'bad'}))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        token = URLSafeTimedSerializer('SECRET_KEY').dumps({'video_id': 0}, salt='share_video')
+        response = await self.async_client.get(reverse('video-stream', kwargs={'pk': 0, 'token': token}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = await self.async_client.post(self.url)
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    async def test_download_requires_login(self):
+        from asgiref.sync import sync_to_async
+        from rest_framework_simplejwt.tokens import RefreshToken
+        url = reverse('video-download', kwargs={'pk': self.video.pk, 'token': self.token})
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        user = await sync_to_async(User.objects.create_user)(username='viewer', password='12345')
+        access = await sync_to_async(lambda: str(RefreshToken.for_user(user).access_token))()
+        response = await self.async_client.get(url, headers={'Authorization': f'Bearer {access}'})
+        self.assertEqual(await self.read(response), self.payload)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class ObjectStorageTests(APITestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from videoapi.objectstore import ObjectStoreServer
+        cls.workdir = tempfile.mkdtemp(dir=TEST_MEDIA_ROOT)
+        cls.sample = make_test_video(os.path.join(cls.workdir, 'sample.mp4'), padding=5 * 1024 * 1024)
+        cls.server = ObjectStoreServer(('127.0.0.1', 0), os.path.join(cls.workdir, 'objects'), 'test-key',
+                                       buckets=['videos'])
+        cls.server.start()
+        cls.cache_dir = os.path.join(cls.workdir, 'cache')
+        # Assets are written under MEDIA_ROOT only, so object storage runs without post-processing
+        cls.storage_settings = override_settings(STORAGE_CACHE_DIR=cls.cache_dir, VIDEO_POSTPROCESS_STAGES=[],
+                                                 DERIVED_POSTPROCESS_STAGES=[], STORAGES={
+            'default': {'BACKEND': 'videoapi.storage.ObjectStorage', 'OPTIONS': {
+                'endpoint_url': cls.server.endpoint_url, 'bucket': 'videos', 'access_key': 'test-key',
+                'secret_key': 'test-secret', 'multipart_threshold': 256 * 1024, 'multipart_chunk_size': 64 * 1024,
+                'transfer_workers': 4,
+            }},
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        })
+        cls.storage_settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.storage_settings.disable()
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def stored(self, name):
+        return os.path.join(self.server.root, 'videos', name)
+
+    def test_multipart_round_trip(self):
+        from django.core.files.storage import default_storage
+        from videoapi.storage import local_file
+        data = os.urandom(1024 * 1024 + 123)
+        completed = self.server.completed_uploads
+        name = default_storage.save('blobs/roundtrip.bin', ContentFile(data))
+        self.assertEqual(self.server.completed_uploads, completed + 1)
+        self.assertEqual(default_storage.size(name), len(data))
+
+        with default_storage.open(name) as handle:
+            handle.seek(500000)
+            self.assertEqual(handle.read(1000), data[500000:501000])
+            handle.seek(0)
+            self.assertEqual(handle.read(), data)
+
+        video = Video.objects.create(title='Remote', video_file=name)
+        with local_file(video.video_file) as path:
+            self.assertTrue(path.startswith(self.cache_dir))
+            with open(path, 'rb') as handle:
+                self.assertEqual(handle.read(), data)
+
+        default_storage.delete(name)
+        self.assertFalse(default_storage.exists(name))
+
+    def test_requests_are_signed(self):
+        from videoapi.storage import ObjectStorage, ObjectStoreError
+        storage = ObjectStorage(self.server.endpoint_url, 'videos', 'other-key', 'test-secret')
+        with self.assertRaises(ObjectStoreError):
+            storage.exists('blobs/anything.mp4')
+
+    def test_upload_trim_and_stream_without_local_files(self):
+        from itsdangerous import URLSafeTimedSerializer
+        from videoapi.tasks import trim_video_task
+        self.client.force_authenticate(user=User.objects.create_user(username='remote', password='12345'))
+        with open(self.sample, 'rb') as handle:
+            response = self.client.post(reverse('video-upload'), {'video_file': handle}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        video = Video.objects.get(pk=response.data['id'])
+        self.assertTrue(os.path.isfile(self.stored(video.video_file.name)))
+
+        # A worker with an empty cache downloads the source
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        result = trim_video_task.apply(args=[video.pk, 1.0, 3.0, 'fast']).get()
+        trimmed = Video.objects.get(pk=result['id'])
+        self.assertTrue(os.path.isfile(self.stored(trimmed.video_file.name)))
+        self.assertEqual(sum(len(names) for _, _, names in os.walk(self.cache_dir)), 2)
+
+        token = URLSafeTimedSerializer('SECRET_KEY').dumps({'video_id': trimmed.pk}, salt='share_video')
+        url = reverse('video-stream', kwargs={'pk': trimmed.pk, 'token': token})
+        with open(self.stored(trimmed.video_file.name), 'rb') as handle:
+            payload = handle.read()
+        response = self.client.get(url, HTTP_RANGE='bytes=10-99')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b''.join(response.streaming_content), payload[10:100])
+
+    def test_trim_cache_keeps_files_in_use(self):
+        import fcntl
+        from videoapi.storage import trim_cache
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        paths = []
+        for index in range(3):
+            path = os.path.join(self.cache_dir, 'trim', f'{index}.mp4')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as handle:
+                handle.write(b'\x00' * 100)
+            os.utime(path, (index, index))
+            paths.append(path)
+
+        with open(paths[0], 'rb') as in_use:
+            fcntl.flock(in_use, fcntl.LOCK_SH)
+            self.assertEqual(trim_cache(max_bytes=200), 1)
+        self.assertEqual([os.path.exists(path) for path in paths], [True, False, True])
+
+    def test_post_processing_needs_local_storage(self):
+        from django.core.exceptions import ImproperlyConfigured
+        from videoapi.models import Blob, MediaAsset
+        from videoapi.postprocess import build_asset, check_asset_storage
+        self.assertEqual(check_asset_storage(None), [])
+        with self.settings(DERIVED_POSTPROCESS_STAGES=['waveform']):
+            self.assertEqual([error.id for error in check_asset_storage(None)], ['videoapi.E001'])
+
+        blob = Blob.objects.create(sha256='ab' * 32, size=1, file='blobs/ab.mp4')
+        asset = MediaAsset.objects.create(blob=blob, kind='waveform')
+        with self.assertRaises(ImproperlyConfigured):
+            build_asset(asset.pk)
+        asset.refresh_from_db()
+        self.assertEqual((asset.state, asset.attempts), (MediaAsset.FAILED, 1))
+
+
+BULK_MEDIA_ROOT = os.path.join(TEST_MEDIA_ROOT, 'bulk')
+
+
+@override_settings(MEDIA_ROOT=BULK_MEDIA_ROOT, BULK_BATCH_SIZE=2)
+class BulkOperationTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='bulkuser', password='12345')
+        self.client.force_authenticate(user=self.user)
+        self.videos = [self.stored_video(f'video {index}'.encode()) for index in range(4)]
+
+    def stored_video(self, content):
+        from videoapi.blobs import ingest_file
+        path = os.path.join(BULK_MEDIA_ROOT, 'videos', f'{content.hex()}.mp4')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as handle:
+            handle.write(content)
+        blob = ingest_file(path)
+        return Video.objects.create(title='Stored', video_file=blob.file.name, blob=blob, owner=self.user)
+
+    def ids(self, *indexes):
+        return [self.videos[index].pk for index in indexes]
+
+    def tags_of(self, index):
+        return sorted(self.videos[index].tags.values_list('name', flat=True))
+
+    def test_update_title_and_tags(self):
+        url = reverse('video-bulk')
+        response = self.client.patch(url, {'ids': self.ids(0, 1, 2), 'title': 'Renamed', 'tags': {'set': ['a', 'b']}},
+                                     format='json')
+        self.assertEqual(response.data, {'updated': 3})
+        self.assertEqual(Video.objects.filter(title='Renamed').count(), 3)
+
+        response = self.client.patch(url, {'ids': self.ids(0, 1), 'tags': {'add': ['c'], 'remove': ['a']}}, format='json')
+        self.assertEqual(self.tags_of(0), ['b', 'c'])
+        self.assertEqual(self.tags_of(2), ['a', 'b'])
+
+        # A selection by tag is re-tagged as a whole
+        response = self.client.patch(url, {'filter': {'tag': 'c'}, 'tags': {'set': ['done']}}, format='json')
+        self.assertEqual(response.data, {'updated': 2})
+        response = self.client.get(reverse('video-list'), {'tag': 'done'})
+        self.assertEqual(sorted(video['id'] for video in response.data['results']), self.ids(0, 1))
+        self.assertEqual(response.data['results'][0]['tags'], ['done'])
+
+    def test_rejects_unsafe_selections(self):
+        url = reverse('video-bulk')
+        for data in ({'title': 'x'}, {'filter': {}, 'title': 'x'}, {'filter': {'colour': 'red'}, 'title': 'x'},
+                     {'ids': self.ids(0), 'tags': {'set': ['a'], 'add': ['b']}}):
+            response = self.client.patch(url, data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Video.objects.filter(title='x').exists())
+
+    def test_only_own_videos_are_selected(self):
+        other = User.objects.create_user(username='bulkother', password='12345')
+        theirs = Video.objects.create(title='Theirs', video_file='videos/theirs.mp4', owner=other)
+        response = self.client.post(reverse('video-bulk-delete'), {'ids': self.ids(0) + [theirs.pk, 0]}, format='json')
+        self.assertEqual(response.data, {'deleted': 1, 'not_found': [0, theirs.pk]})
+        response = self.client.patch(reverse('video-bulk'), {'filter': {'is_merged': False}, 'title': 'Mine'},
+                                     format='json')
+        self.assertEqual(response.data, {'updated': 3})
+        response = self.client.post(reverse('video-bulk-delete'), {'filter': {'owner': other.pk}}, format='json')
+        self.assertEqual(response.data, {'deleted': 0})
+        theirs.refresh_from_db()
+        self.assertEqual(theirs.title, 'Theirs')
+
+    def test_delete_runs_a_fixed_number_of_queries_per_batch(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from videoapi.models import Blob, Job
+        Job.objects.create(kind='trim', video=self.videos[0])
+        url = reverse('video-bulk-delete')
+        with CaptureQueriesContext(connection) as one:
+            self.client.post(url, {'ids': self.ids(0)}, format='json')
+        with CaptureQueriesContext(connection) as two:
+            response = self.client.post(url, {'ids': self.ids(1, 2)}, format='json')
+        self.assertEqual(response.data, {'deleted': 2})
+        self.assertEqual(len(one), len(two))
+        self.assertEqual(Blob.objects.filter(ref_count=0).count(), 3)
+        self.assertIsNone(Job.objects.get().video_id)
+
+    def test_reclaim_storage_removes_released_and_orphaned_files(self):
+        from videoapi.models import Blob
+        from videoapi.reclamation import reclaim_storage
+        paths = [video.video_file.path for video in self.videos]
+        legacy = Video.objects.create(title='Legacy', video_file=ContentFile(b'legacy', name='legacy.mp4'),
+                                      owner=self.user)
+        orphan = os.path.join(BULK_MEDIA_ROOT, 'videos', 'trimmed_failed.mp4')
+        with open(orphan, 'wb') as handle:
+            handle.write(b'partial output')
+        self.client.post(reverse('video-bulk-delete'), {'ids': self.ids(0, 1) + [legacy.pk]}, format='json')
+
+        # Fresh files may belong to a running task
+        self.assertEqual(reclaim_storage(), {'blobs': 2, 'orphans': 0})
+        self.assertTrue(os.path.exists(orphan))
+
+        self.assertEqual(reclaim_storage(min_age=0)['orphans'], 2)
+        self.assertEqual([os.path.exists(path) for path in paths], [False, False, True, True])
+        self.assertFalse(os.path.exists(orphan))
+        self.assertFalse(os.path.exists(legacy.video_file.path))
+        self.assertEqual(Blob.objects.count(), 2)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT, METRICS_DIR=os.path.join(TEST_MEDIA_ROOT, 'metrics'))
+class MetricsTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='metricsuser', password='12345')
+        self.client.force_authenticate(user=self.user)
+
+    def scrape(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        return response.content.decode()
+
+    def sample(self, text, name):
+        for line in text.splitlines():
+            if line.startswith(name + ' '):
+                return float(line.rsplit(' ', 1)[1])
+        return 0
+
+    def test_request_latency_and_gauges(self):
+        from videoapi.models import Job
+        before = self.scrape()
+        self.client.get(reverse('video-list'))
+        Job.objects.create(kind='merge', queue='merge')
+        after = self.scrape()
+
+        latency = 'videoapi_http_request_duration_seconds_count{view="video-list",method="GET",status="200"}'
+        self.assertEqual(self.sample(after, latency) - self.sample(before, latency), 1)
+        bucket = 'videoapi_http_request_duration_seconds_bucket{view="video-list",method="GET",status="200",le="+Inf"}'
+        self.assertEqual(self.sample(after, bucket), self.sample(after, latency))
+        self.assertEqual(self.sample(after, 'videoapi_queue_jobs{queue="merge",state="pending"}'), 1)
+        self.assertIn('videoapi_queue_jobs{queue="fast",state="started"} 0', after)
+        self.assertIn('# TYPE videoapi_storage_bytes gauge', after)
+
+        response = self.client.get('/metrics', REMOTE_ADDR='10.0.0.5')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_task_metrics_of_other_processes_are_added_up(self):
+        import json
+        from django.conf import settings
+        from videoapi.tasks import trim_video_task
+        workdir = tempfile.mkdtemp(dir=TEST_MEDIA_ROOT)
+        path = make_test_video(os.path.join(workdir, 'source.mp4'), duration=2)
+        video = Video.objects.create(title='Source', video_file=os.path.relpath(path, TEST_MEDIA_ROOT), file_size=1000)
+        runtime = 'videoapi_task_duration_seconds_count{task="videoapi.tasks.trim_video_task",state="SUCCESS"}'
+        frames = 'videoapi_encode_frames_total{task="videoapi.tasks.trim_video_task"}'
+        inputs = 'videoapi_encode_input_bytes_total{task="videoapi.tasks.trim_video_task"}'
+        before = self.scrape()
+
+        trim_video_task.apply(args=[video.pk, 0, 1, 'fast'])
+        # A worker process that already wrote its counters
+        with open(os.path.join(settings.METRICS_DIR, 'worker.json'), 'w') as handle:
+            json.dump([['videoapi_encode_input_bytes_total', [['task', 'videoapi.tasks.trim_video_task']], 500]],
+                      handle)
+        after = self.scrape()
+        os.remove(os.path.join(settings.METRICS_DIR, 'worker.json'))
+
+        self.assertEqual(self.sample(after, runtime) - self.sample(before, runtime), 1)
+        self.assertGreaterEqual(self.sample(after, frames) - self.sample(before, frames), 25)
+        self.assertEqual(self.sample(after, inputs) - self.sample(before, inputs), 1500)
+
+    def test_counters_of_exited_processes_are_archived(self):
+        import json
+        import subprocess
+        import sys
+        from django.conf import settings
+        from videoapi.metrics import archive_exited
+        counter = 'videoapi_encode_input_bytes_total{task="videoapi.tasks.trim_video_task"}'
+        before = self.sample(self.scrape(), counter)
+        exited = subprocess.Popen([sys.executable, '-c', ''])
+        exited.wait()
+        for pid in (exited.pid, os.getppid()):
+            with open(os.path.join(settings.METRICS_DIR, f'{pid}.json'), 'w') as handle:
+                json.dump([['videoapi_encode_input_bytes_total', [['task', 'videoapi.tasks.trim_video_task']], 300]],
+                          handle)
+
+        self.assertEqual(archive_exited(), 1)
+        self.assertFalse(os.path.exists(os.path.join(settings.METRICS_DIR, f'{exited.pid}.json')))
+        self.assertTrue(os.path.exists(os.path.join(settings.METRICS_DIR, 'archive.json')))
+        self.assertEqual(self.sample(self.scrape(), counter) - before, 600)
+        os.remove(os.path.join(settings.METRICS_DIR, f'{os.getppid()}.json'))
+
+
+PROFILE_DIR = os.path.join(TEST_MEDIA_ROOT, 'profiles')
+
+
+@override_settings(PROFILING_ENABLED=True, PROFILE_DIR=PROFILE_DIR, PROFILE_HEADER_TOKEN='secret', PROFILE_MAX_FILES=3,
+                   PROFILE_TASKS=['videoapi.tasks.evict_derived_videos'])
+class ProfilingTests(APITestCase):
+    def setUp(self):
+        shutil.rmtree(PROFILE_DIR, ignore_errors=True)
+        self.admin = User.objects.create_user(username='profileadmin', password='12345', is_staff=True)
+        self.client.force_authenticate(user=self.admin)
+
+    def test_requests_with_the_token_are_profiled(self):
+        import pstats
+        url = reverse('video-list')
+        self.assertNotIn('X-Profile-Id', self.client.get(url))
+        self.assertNotIn('X-Profile-Id', self.client.get(url, HTTP_X_PROFILE='guess'))
+        response = self.client.get(url, HTTP_X_PROFILE='secret')
+        name = response['X-Profile-Id']
+        self.assertIn('__request__video-list__', name)
+        self.assertGreater(pstats.Stats(os.path.join(PROFILE_DIR, name)).total_calls, 0)
+
+        with self.settings(PROFILING_ENABLED=False):
+            self.client = self.client_class()
+            self.client.force_authenticate(user=self.admin)
+            self.assertNotIn('X-Profile-Id', self.client.get(url, HTTP_X_PROFILE='secret'))
+        self.assertEqual(len(os.listdir(PROFILE_DIR)), 1)
+
+    def test_tasks_are_profiled_and_listed_for_staff(self):
+        from videoapi.tasks import evict_derived_videos, reclaim_storage_task
+        evict_derived_videos.apply()
+        reclaim_storage_task.apply()
+        response = self.client.get(reverse('profile-list'))
+        profiles = response.data['profiles']
+        self.assertEqual([(p['kind'], p['target']) for p in profiles], [('task', 'videoapi.tasks.evict_derived_videos')])
+
+        url = reverse('profile-detail', kwargs={'name': profiles[0]['name']})
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], 'application/octet-stream')
+        import marshal
+        self.assertIsInstance(marshal.loads(b''.join(response.streaming_content)), dict)
+        response = self.client.get(url, {'top': 5})
+        self.assertEqual(len(response.data['functions']), 5)
+        self.assertEqual(self.client.get(reverse('profile-detail', kwargs={'name': '..'})).status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+        # Oldest ones go once there are more than PROFILE_MAX_FILES
+        for _ in range(4):
+            evict_derived_videos.apply()
+        self.assertEqual(len(self.client.get(reverse('profile-list')).data['profiles']), 3)
+
+        self.client.force_authenticate(user=User.objects.create_user(username='notstaff', password='12345'))
+        self.assertEqual(self.client.get(reverse('profile-list')).status_code, status.HTTP_403_FORBIDDEN)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT, WAVEFORM_SAMPLE_RATE=8000, WAVEFORM_SAMPLES_PER_PEAK=80,
+                   WAVEFORM_MIN_PEAKS=100)
+class WaveformTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='waveformuser', password='12345')
+        self.client.force_authenticate(user=self.user)
+
+    def test_levels_halve_the_peaks(self):
+        import numpy as np
+        from videoapi.waveform import block_peaks, peak_levels, quantize
+        samples = np.array([1, -5, 3, 7, -2, 0, 9], dtype=np.int16)
+        mins, maxs = block_peaks(samples, 2)
+        self.assertEqual((mins.tolist(), maxs.tolist()), ([-5, 3, -2, 9], [1, 7, 0, 9]))
+        levels = peak_levels(mins, maxs, 1)
+        self.assertEqual([(low.tolist(), high.tolist()) for low, high in levels],
+                         [([-5, 3, -2, 9], [1, 7, 0, 9]), ([-5, -2], [7, 9]), ([-5], [9])])
+        pairs = quantize(np.array([-32768, 256]), np.array([32767, 511]), 8)
+        self.assertEqual((pairs.dtype, pairs.tolist()), (np.int8, [-128, 127, 1, 1]))
+
+    @patch('videoapi.tasks.postprocess_asset_task')
+    def test_peaks_are_built_and_served_by_level_of_detail(self, mock_task):
+        import numpy as np
+        from videoapi.blobs import ingest_file
+        from videoapi.postprocess import build_asset
+        workdir = tempfile.mkdtemp(dir=TEST_MEDIA_ROOT)
+        blob = ingest_file(make_test_video(os.path.join(workdir, 'source.mp4'), duration=4))
+        video = Video.objects.create(title='Source', video_file=blob.file.name, blob=blob, file_size=blob.size)
+
+        url = reverse('video-waveform', kwargs={'pk': video.pk})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_202_ACCEPTED)
+        build_asset(mock_task.apply_async.call_args.kwargs['args'][0])
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['sample_rate'], response.data['bits']), (8000, 8))
+        self.assertAlmostEqual(response.data['duration'], 4, delta=0.1)
+        # 100 peaks a second (plus the AAC priming samples), halved until at most 100 are left
+        lengths = [level['length'] for level in response.data['levels']]
+        self.assertAlmostEqual(lengths[0], 400, delta=5)
+        self.assertEqual(lengths[1:], [-(-length // 2) for length in lengths[:-1]])
+        self.assertLessEqual(lengths[-1], 100)
+
+        peaks = self.client.get(response.data['peaks_url'], {'peaks': 150})
+        self.assertEqual(peaks['Content-Type'], 'application/octet-stream')
+        self.assertEqual(peaks['X-Waveform-Samples-Per-Peak'], '160')
+        pairs = np.frombuffer(peaks.content, dtype=np.int8).reshape(-1, 2)
+        self.assertEqual(len(pairs), lengths[1])
+        # The 440 Hz tone is at 1/8 of full scale
+        self.assertTrue((pairs[5:-5, 0] < -10).all() and (pairs[5:-5, 1] > 10).all())
+
+        window = self.client.get(response.data['peaks_url'], {'peaks': 150, 'start': 1, 'end': 2.5})
+        self.assertEqual(window['X-Waveform-Samples-Per-Peak'], '80')
+        self.assertEqual(window['X-Waveform-Start'], '1.0')
+        self.assertEqual(len(window.content), 150 * 2)
+        coarsest = self.client.get(response.data['levels'][-1]['url'])
+        self.assertEqual(len(coarsest.content), lengths[-1] * 2)
+        self.assertEqual(self.client.get(response.data['peaks_url'], {'level': 9}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+    @patch('videoapi.tasks.postprocess_asset_task')
+    def test_silent_video_gets_an_empty_waveform(self, mock_task):
+        from videoapi.blobs import ingest_file
+        from videoapi.media import run_ffmpeg
+        from videoapi.models import MediaAsset
+        from videoapi.postprocess import build_asset
+        path = os.path.join(tempfile.mkdtemp(dir=TEST_MEDIA_ROOT), 'silent.mp4')
+        run_ffmpeg(['-f', 'lavfi', '-i', 'testsrc=size=64x48:rate=25:duration=1', '-c:v', 'libx264',
+                    '-pix_fmt', 'yuv420p', path])
+        blob = ingest_file(path)
+        video = Video.objects.create(title='Silent', video_file=blob.file.name, blob=blob, file_size=blob.size)
+
+        url = reverse('video-waveform', kwargs={'pk': video.pk})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(url)
+        build_asset(mock_task.apply_async.call_args.kwargs['args'][0])
+        self.assertEqual(MediaAsset.objects.get(blob=blob, kind='waveform').state, MediaAsset.READY)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['audio'], response.data['levels']), (False, []))
+        self.assertEqual(mock_task.apply_async.call_count, 1)
+        self.assertEqual(self.client.get(response.data['peaks_url']).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(reverse('video-waveform', kwargs={'pk': 0})).status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+    def test_merged_output_gets_its_waveform_from_the_task(self):
+        from videoapi.models import Job
+        from videoapi.postprocess import ready_asset
+        from videoapi.tasks import merge_videos_task
+        workdir = tempfile.mkdtemp(dir=TEST_MEDIA_ROOT)
+        videos = [Video.objects.create(title=name, video_file=os.path.relpath(
+                      make_test_video(os.path.join(workdir, name), duration=2), TEST_MEDIA_ROOT))
+                  for name in ('first.mp4', 'second.mp4')]
+        job = Job.objects.create(kind='merge')
+
+        merge_videos_task.apply(args=[[v.pk for v in videos]], task_id=str(job.id))
+        job.refresh_from_db()
+        self.assertEqual(job.state, 'SUCCESS', job.error)
+        asset = ready_asset(job.video, 'waveform')
+        self.assertIsNotNone(asset)
+        self.assertAlmostEqual(asset.data['duration'], 4, delta=0.1)
@@ -0,0 +1,115 @@
+# videoapi/uploads.py
+# Storage side of the resumable upload API.
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from .models import Video
+from .utils import generate_unique_filename
+
+CHUNK_SIZE = 64 * 1024
+
+# Running SHA-256 state per session, keyed by session id. A worker that has not
+# seen the earlier chunks (or restarted) rebuilds the state from the bytes on disk.
+_hashers = {}
+_hashers_lock = threading.Lock()
+
+
+def session_path(session):
+    return os.path.join(settings.MEDIA_ROOT, session.file_name)
+
+
+def create_session_file(session):
+    upload_to = Video._meta.get_field('video_file').upload_to
+    session.file_name = os.path.join(upload_to, generate_unique_filename(os.path.basename(session.filename), session.id))
+    path = session_path(session)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+
+
+def _hasher_for(session):
+    with _hashers_lock:
+        offset, hasher = _hashers.pop(str(session.id), (None, None))
+    if offset == session.offset:
+        return hasher
+
+    hasher = hashlib.sha256()
+    with open(session_path(session), 'rb') as handle:
+        remaining = session.offset
+        while remaining > 0:
+            data = handle.read(min(CHUNK_SIZE, remaining))
+            if not data:
+                break
+            hasher.update(data)
+            remaining -= len(data)
+    return hasher
+
+
+def append_chunk(session, stream, length):
+    """Write `length` bytes from `stream` at the session offset, hashing them on the way."""
+    hasher = _hasher_for(session)
+    written = 0
+    with open(session_path(session), 'r+b') as handle:
+        # Drop whatever a broken earlier request left past the committed offset
+        handle.seek(session.offset)
+        handle.truncate()
+        while written < length:
+            data = stream.read(min(CHUNK_SIZE, length - written))
+            if not data:
+                break
+            handle.write(data)
+            hasher.update(data)
+            written += len(data)
+
+    session.offset += written
+    with _hashers_lock:
+        _hashers[str(session.id)] = (session.offset, hasher)
+    return written
+
+
+def finish_hash(session):
+    hasher = _hasher_for(session)
+    return hasher.hexdigest()
+
+
+def forget_session(session):
+    with _hashers_lock:
+        _hashers.pop(str(session.id), None)
+
+
+def discard_session(session):
+    forget_session(session)
+    if os.path.exists(session_path(session)):
+        os.remove(session_path(session))
+
+
+def spool_upload(uploaded):
+    """Path of a local file with the bytes of a multipart upload, handed over to the caller."""
+    if hasattr(uploaded, 'temporary_file_path'):
+        return uploaded.temporary_file_path()
+    handle = tempfile.NamedTemporaryFile(suffix=os.path.splitext(uploaded.name)[1], dir=settings.FILE_UPLOAD_TEMP_DIR,
+                                         delete=False)
+    with handle:
+        uploaded.seek(0)
+        shutil.copyfileobj(uploaded, handle, CHUNK_SIZE)
+    return handle.name
+
+
+class HashingTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    """Compute the SHA-256 of multipart uploads while Django spools them to disk."""
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.hasher = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.hasher.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.sha256 = self.hasher.hexdigest()
+        return file
@@ -1,14 +1,29 @@
 from django.urls import path
-from . import views
+from . import views, async_views
 
 urlpatterns = [
     path('videos/', views.VideoListView.as_view(), name='video-list'),
     path('videos/<int:pk>/', views.VideoListView.as_view(), name='video-detail'),
-    path('videos/download/<int:pk>/<str:token>/', views.DownloadVideoView.as_view(), name='video-download'),
-    path('videos/stream/<int:pk>/<str:token>/', views.StreamVideoView.as_view(), name='video-stream'),
+    path('videos/bulk/', views.BulkVideoView.as_view(), name='video-bulk'),
+    path('videos/bulk/delete/', views.BulkDeleteView.as_view(), name='video-bulk-delete'),
+    path('videos/<int:pk>/previews/', views.VideoPreviewView.as_view(), name='video-previews'),
+    path('videos/<int:pk>/previews/<str:name>', views.VideoPreviewFileView.as_view(), name='video-preview-file'),
+    path('videos/<int:pk>/waveform/', views.VideoWaveformView.as_view(), name='video-waveform'),
+    path('videos/<int:pk>/waveform/peaks', views.VideoWaveformPeaksView.as_view(), name='video-waveform-peaks'),
+    path('videos/download/<int:pk>/<str:token>/', async_views.download_video, name='video-download'),
+    path('videos/stream/<int:pk>/<str:token>/', async_views.stream_video, name='video-stream'),
+    path('videos/stream/<int:pk>/<str:token>/hls/<path:name>', views.StreamHlsView.as_view(), name='video-stream-hls'),
     path('upload/', views.VideoUploadView.as_view(), name='video-upload'),
+    path('uploads/', views.UploadSessionView.as_view(), name='upload-session'),
+    path('uploads/<uuid:pk>/', views.UploadSessionDetailView.as_view(), name='upload-session-detail'),
+    path('uploads/<uuid:pk>/finalize/', views.UploadFinalizeView.as_view(), name='upload-session-finalize'),
     path('trim/<int:pk>/', views.TrimVideoView.as_view(), name='trim-video'),
+    path('trim/<int:pk>/batch/', views.BatchTrimVideoView.as_view(), name='batch-trim-video'),
     path('merge/', views.MergeVideosView.as_view(), name='merge-videos'),
     path('share/<int:pk>/', views.ShareLinkView.as_view(), name='share-video'),
+    path('jobs/<uuid:pk>/', async_views.job_detail, name='job-detail'),
+    path('jobs/<uuid:pk>/events/', async_views.job_events, name='job-events'),
+    path('profiles/', views.ProfileListView.as_view(), name='profile-list'),
+    path('profiles/<str:name>/', views.ProfileDetailView.as_view(), name='profile-detail'),
 ]
 
@@ -1,36 +1,41 @@
-from django.http import FileResponse, StreamingHttpResponse
-from rest_framework import views, status
+from rest_framework import views, status, serializers
 from rest_framework.response import Response
-from .models import Video
-from .serializers import VideoSerializer
+from django.db import transaction
+from django.urls import reverse
+from .models import Video, UploadSession
+from .serializers import VideoSerializer, check_video_size, check_video_duration
+from .jobs import submit_job
+from .scheduling import plan_job
+from .derivations import request_derivation, trim_params, merge_params, derivation_key, stored_outputs
+from .profiles import profile_name
+from .probe import probe_media, media_fields
+from .media import MediaError
+from . import uploads
 from drf_yasg.utils import swagger_auto_schema
 from moviepy.editor import VideoFileClip, concatenate_videoclips
 from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
 import os
-from rest_framework.permissions import AllowAny 
+from functools import partial
+from rest_framework.permissions import AllowAny, IsAdminUser
 from django.conf import settings
-from .tasks import trim_video_task, merge_videos_task
-from .utils import generate_unique_filename
+from .tasks import trim_video_task, batch_trim_video_task, merge_videos_task, schedule_postprocessing
+from .blobs import ingest_file, release_blob
+from .pagination import VideoCursorPagination
+from .bulk import filter_videos, select_videos, tag_changes, bulk_delete, bulk_update
+from .streaming import serve_asset
+from .postprocess import ready_asset, asset_file, retry_at
+from .models import MediaAsset
+from .profiling import list_profiles, profile_path
+from .caching import cached_response, list_key, detail_key
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.http import FileResponse, HttpResponse
+from .waveform import select_level, read_peaks
+import pstats
 
-class DownloadVideoView(views.APIView):
-    def get(self, request, pk, token):
-        serializer = URLSafeTimedSerializer('SECRET_KEY')
-        try:
-            data = serializer.loads(token, salt='share_video', max_age=3600)  # 1 hour validity
-            if data['video_id'] != str(pk):
-                return Response({'error': 'Invalid access'}, status=status.HTTP_403_FORBIDDEN)
-        except (SignatureExpired, BadSignature):
-            return Response({'error': 'Invalid or expired token'}, status=status.HTTP_403_FORBIDDEN)
-
-        video = Video.objects.get(pk=pk)
-        file_handle = video.video_file.open()
-        response = StreamingHttpResponse(file_handle, content_type='video/mp4')
-        response['Content-Disposition'] = f'inline; filename="{os.path.basename(video.video_file.name)}"'
-        return response
-
-class StreamVideoView(views.APIView):
-    permission_classes = [AllowAny] 
-    def get(self, request, pk, token):
+class StreamHlsView(views.APIView):
+    permission_classes = [AllowAny]
+    def get(self, request, pk, token, name):
         serializer = URLSafeTimedSerializer('SECRET_KEY')
         try:
             data = serializer.loads(token, salt='share_video', max_age=3600)  # 1 hour validity
@@ -39,18 +44,35 @@ class StreamVideoView(views.APIView):
         except (SignatureExpired, BadSignature):
             return Response({'error': 'Invalid or expired token'}, status=status.HTTP_403_FORBIDDEN)
 
-        video = Video.objects.get(pk=pk)
-        file_handle = video.video_file.open()
-        response = FileResponse(file_handle, content_type='video/mp4')
-        response['Content-Disposition'] = f'inline; filename="{os.path.basename(video.video_file.name)}"'
-        return response
+        # Playlists reference their renditions and segments relatively, so they all pass through here
+        video = get_object_or_404(Video.objects.select_related('blob'), pk=pk)
+        asset = ready_asset(video, 'hls')
+        path = asset_file(asset, name) if asset else None
+        if path is None:
+            return Response({'error': 'Not found'}, status=status.HTTP_404_NOT_FOUND)
+        return serve_asset(request, asset, path)
 
 class VideoListView(views.APIView):
 
-    def get(self, request):
-        videos = Video.objects.all()
-        serializer = VideoSerializer(videos, many=True)
-        return Response(serializer.data)
+    pagination_class = VideoCursorPagination
+
+    def get(self, request, pk=None):
+        if pk is not None:
+            def detail():
+                return VideoSerializer(get_object_or_404(Video.objects.prefetch_related('tags'), pk=pk)).data
+            return cached_response(request, detail_key(pk), detail)
+
+        try:
+            videos = filter_videos(Video.objects.prefetch_related('tags'), request.query_params, request.user)
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        def page():
+            paginator = self.pagination_class()
+            page = paginator.paginate_queryset(videos, request, view=self)
+            serializer = VideoSerializer(page, many=True)
+            return paginator.get_paginated_response(serializer.data).data
+        return cached_response(request, list_key(request), page)
 
     @swagger_auto_schema(request_body=VideoSerializer, responses={204: 'No Content'})
     def delete(self, request, pk):
@@ -63,32 +85,190 @@ class VideoListView(views.APIView):
         video = Video.objects.get(pk=pk)
         serializer = VideoSerializer(video, data=request.data)
         if serializer.is_valid():
-            serializer.save()
+            uploaded = serializer.validated_data.get('video_file')
+            if uploaded is None:
+                serializer.save()
+                return Response(serializer.data)
+            # A new file goes into the blob store like an upload, the old content loses this reference
+            old_blob_id = video.blob_id
+            blob = ingest_file(uploads.spool_upload(uploaded), getattr(uploaded, 'sha256', None))
+            with transaction.atomic():
+                video = serializer.save(video_file=blob.file.name, blob=blob, file_size=blob.size, derivation=None)
+                if old_blob_id:
+                    transaction.on_commit(partial(release_blob, old_blob_id))
+            schedule_postprocessing(video)
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+def bulk_response(data, not_found):
+    # Requested ids that are missing or belong to someone else are left alone and listed
+    if not_found:
+        data['not_found'] = not_found
+    return Response(data, status=status.HTTP_200_OK)
+
+
+class BulkVideoView(views.APIView):
+    def patch(self, request):
+        # Same title and tag changes for every selected video, a fixed number of queries per batch
+        title = request.data.get('title')
+        tags = request.data.get('tags')
+        if title is None and tags is None:
+            return Response({'error': 'Nothing to update, provide "title" or "tags".'}, status=status.HTTP_400_BAD_REQUEST)
+        if title is not None and (not isinstance(title, str) or len(title) > Video._meta.get_field('title').max_length):
+            return Response({'error': 'Invalid title.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            videos, not_found = select_videos(request.data, request.user)
+            tags = tag_changes(tags) if tags is not None else None
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return bulk_response({'updated': bulk_update(videos, title=title, tags=tags)}, not_found)
+
+
+class BulkDeleteView(views.APIView):
+    def post(self, request):
+        try:
+            videos, not_found = select_videos(request.data, request.user)
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        # The files are removed by the reclaim_storage task
+        return bulk_response({'deleted': bulk_delete(videos)}, not_found)
+
 class VideoUploadView(views.APIView):
     @swagger_auto_schema(request_body=VideoSerializer, responses={201: VideoSerializer})
     def post(self, request):
         serializer = VideoSerializer(data=request.data)
         if serializer.is_valid(raise_exception=True):
-            video = serializer.save()
-            
-            # Generate a unique filename
-            original_filename = os.path.basename(video.video_file.name)
-            unique_filename = generate_unique_filename(original_filename, video.id)
-            
-            # Rename the file
-            new_path = os.path.join(os.path.dirname(video.video_file.path), unique_filename)
-            os.rename(video.video_file.path, new_path)
-            
-            # Update the video object with the new filename
-            video.video_file.name = os.path.join(os.path.dirname(video.video_file.name), unique_filename)
-            video.save()
+            # Move the file into the content-addressed store, identical uploads share one copy
+            uploaded = serializer.validated_data['video_file']
+            blob = ingest_file(uploads.spool_upload(uploaded), getattr(uploaded, 'sha256', None))
+            video = serializer.save(owner=request.user, video_file=blob.file.name, blob=blob, file_size=blob.size)
+            schedule_postprocessing(video)
             
             return Response(VideoSerializer(video).data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+class UploadSessionView(views.APIView):
+    def post(self, request):
+        filename = request.data.get('filename')
+        size = request.data.get('size')
+        if not filename or size is None:
+            return Response({'error': 'Filename and size must be provided.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            size = int(size)
+        except (TypeError, ValueError):
+            return Response({'error': 'Invalid size.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            check_video_size(size)
+        except serializers.ValidationError as exc:
+            return Response({'error': exc.detail[0]}, status=status.HTTP_400_BAD_REQUEST)
+
+        session = UploadSession(filename=filename, size=size, title=request.data.get('title', ''), owner=request.user)
+        uploads.create_session_file(session)
+        session.save()
+        response = Response(
+            {'id': session.id, 'offset': session.offset, 'size': session.size}, status=status.HTTP_201_CREATED
+        )
+        response['Location'] = request.build_absolute_uri(f'{session.id}/')
+        response['Upload-Offset'] = session.offset
+        return response
+
+
+class UploadSessionDetailView(views.APIView):
+    def get(self, request, pk):
+        session = get_object_or_404(UploadSession, pk=pk, owner=request.user)
+        response = Response({'id': session.id, 'offset': session.offset, 'size': session.size})
+        response['Upload-Offset'] = session.offset
+        return response
+
+    def patch(self, request, pk):
+        # The body is the raw chunk, Upload-Offset must match what the server already has
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+            length = int(request.headers.get('Content-Length') or 0)
+        except ValueError:
+            return Response({'error': 'Upload-Offset header must be provided.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            session = get_object_or_404(UploadSession.objects.select_for_update(), pk=pk, owner=request.user)
+            if offset != session.offset:
+                response = Response({'error': 'Offset mismatch.', 'offset': session.offset}, status=status.HTTP_409_CONFLICT)
+                response['Upload-Offset'] = session.offset
+                return response
+            if session.offset + length > session.size:
+                return Response({'error': 'Chunk exceeds the declared size.'}, status=status.HTTP_400_BAD_REQUEST)
+
+            uploads.append_chunk(session, request._request, length)
+            session.save(update_fields=['offset', 'updated_at'])
+
+        response = Response(status=status.HTTP_204_NO_CONTENT)
+        response['Upload-Offset'] = session.offset
+        return response
+
+    def delete(self, request, pk):
+        session = get_object_or_404(UploadSession, pk=pk, owner=request.user)
+        uploads.discard_session(session)
+        session.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class UploadFinalizeView(views.APIView):
+    def post(self, request, pk):
+        # The row stays locked until the video exists, so a second finalize finds no session
+        with transaction.atomic():
+            session = get_object_or_404(UploadSession.objects.select_for_update(), pk=pk, owner=request.user)
+            if session.offset != session.size:
+                return Response({'error': 'Upload is incomplete.', 'offset': session.offset},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+            try:
+                info = probe_media(uploads.session_path(session))
+                check_video_duration(info['duration'] or 0)
+            except MediaError:
+                uploads.discard_session(session)
+                session.delete()
+                return Response({'video_file': ['Unsupported or unreadable video file']},
+                                status=status.HTTP_400_BAD_REQUEST)
+            except serializers.ValidationError as exc:
+                uploads.discard_session(session)
+                session.delete()
+                return Response({'video_file': exc.detail}, status=status.HTTP_400_BAD_REQUEST)
+
+            # The chunks were written straight to disk, storing them is a rename into the blob store
+            title = session.title or os.path.splitext(session.filename)[0]
+            sha256 = uploads.finish_hash(session)
+            blob = ingest_file(uploads.session_path(session), sha256)
+            video = Video.objects.create(
+                title=title, video_file=blob.file.name, blob=blob, file_size=blob.size, owner=request.user,
+                **media_fields(info)
+            )
+            uploads.forget_session(session)
+            session.delete()
+            schedule_postprocessing(video)
+
+        data = VideoSerializer(video).data
+        data['sha256'] = sha256
+        return Response(data, status=status.HTTP_201_CREATED)
+
+
+def job_accepted(message, job, request):
+    return {
+        'message': message,
+        'task_id': str(job.id),
+        'job_url': request.build_absolute_uri(reverse('job-detail', kwargs={'pk': job.id})),
+        'queue': job.queue,
+        'estimated_cost': job.estimated_cost,
+        'expected_wait': job.expected_wait,
+    }
+
+
+def derivation_response(message, video, job, request):
+    # Stored outputs are returned right away, everything else points at the job producing it
+    if job is None:
+        data = {'message': message, 'cached': True, 'video': VideoSerializer(video).data}
+        return Response(data, status=status.HTTP_200_OK)
+    return Response(job_accepted(message, job, request), status=status.HTTP_202_ACCEPTED)
+
+
 class TrimVideoView(views.APIView):
     @swagger_auto_schema(request_body=VideoSerializer, responses={202: 'Accepted'})
     def post(self, request, pk):
@@ -104,8 +284,65 @@ class TrimVideoView(views.APIView):
         except ValueError:
             return Response({'error': 'Invalid start or end time format.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        task = trim_video_task.delay(pk, start, end)
-        return Response({'message': 'Video trim task started', 'task_id': task.id}, status=status.HTTP_202_ACCEPTED)
+        if start < 0 or end <= start:
+            return Response({'error': 'End time must be greater than start time.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # "exact" re-encodes the whole range, "fast" copies packets between keyframes
+        mode = request.data.get('mode', 'exact')
+        if mode not in ('exact', 'fast'):
+            return Response({'error': 'Mode must be either "exact" or "fast".'}, status=status.HTTP_400_BAD_REQUEST)
+        # Only exact trims are encoded, fast ones copy packets whatever the profile
+        try:
+            profile = profile_name(request.data.get('profile'))
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        args = [pk, start, end, mode] + ([profile] if mode == 'exact' else [])
+
+        video = get_object_or_404(Video.objects.select_related('blob'), pk=pk)
+        plan = plan_job('trim', [video], {'start': start, 'end': end, 'mode': mode})
+        output, job, created = request_derivation(
+            'trim', [video], trim_params(start, end, mode, profile), trim_video_task, args, plan, request.user.pk
+        )
+        message = 'Video trim task started' if created else 'Video trim already requested'
+        return derivation_response(message, output, job, request)
+
+
+class BatchTrimVideoView(views.APIView):
+    def post(self, request, pk):
+        ranges = request.data.get('ranges')
+        if not isinstance(ranges, list) or not ranges:
+            return Response({'error': 'A list of [start, end] ranges must be provided.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(ranges) > settings.BATCH_TRIM_MAX_SEGMENTS:
+            return Response({'error': f'At most {settings.BATCH_TRIM_MAX_SEGMENTS} ranges can be cut at once.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            ranges = [[float(start), float(end)] for start, end in ranges]
+        except (TypeError, ValueError):
+            return Response({'error': 'Invalid start or end time format.'}, status=status.HTTP_400_BAD_REQUEST)
+        if any(start < 0 or end <= start for start, end in ranges):
+            return Response({'error': 'End time must be greater than start time.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        mode = request.data.get('mode', 'exact')
+        if mode not in ('exact', 'fast'):
+            return Response({'error': 'Mode must be either "exact" or "fast".'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            profile = profile_name(request.data.get('profile'))
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        args = [pk, ranges, mode] + ([profile] if mode == 'exact' else [])
+
+        video = get_object_or_404(Video.objects.select_related('blob'), pk=pk)
+        keys = [derivation_key('trim', [video], trim_params(start, end, mode, profile)) for start, end in ranges]
+        outputs = stored_outputs(keys, request.user.pk, complete=True)
+        if outputs:
+            videos = [outputs[key] for key in keys]
+            data = {'message': 'Video trimmed', 'cached': True, 'videos': VideoSerializer(videos, many=True).data}
+            return Response(data, status=status.HTTP_200_OK)
+
+        # All segments come out of a single pass over the source, tracked by one job
+        plan = plan_job('batch_trim', [video], {'ranges': ranges, 'mode': mode})
+        job = submit_job('batch_trim', batch_trim_video_task, args, plan, request.user.pk)
+        return Response(job_accepted('Video batch trim task started', job, request), status=status.HTTP_202_ACCEPTED)
 
 
 class MergeVideosView(views.APIView):
@@ -115,12 +352,164 @@ class MergeVideosView(views.APIView):
         if not ids:
             return Response({'error': 'Video IDs must be provided.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        task = merge_videos_task.delay(ids)
-        return Response({'message': 'Video merge task started', 'task_id': task.id}, status=status.HTTP_202_ACCEPTED)
+        try:
+            ids = [int(id) for id in ids]
+        except (TypeError, ValueError):
+            return Response({'error': 'Invalid video IDs.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            profile = profile_name(request.data.get('profile'))
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        videos = Video.objects.select_related('blob').in_bulk(ids)
+        if len(videos) != len(set(ids)):
+            return Response({'error': 'Video not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+        # The order of the ids is the order of the output, so it is part of the key
+        ordered = [videos[id] for id in ids]
+        output, job, created = request_derivation(
+            'merge', ordered, merge_params(ordered, profile), merge_videos_task, [ids, profile], plan_job('merge', ordered, {}),
+            request.user.pk
+        )
+        message = 'Video merge task started' if created else 'Video merge already requested'
+        return derivation_response(message, output, job, request)
+
+def asset_pending(video, kind, message):
+    """Queue a missing asset and answer 202 while it is built or retried, 404 once it failed for good."""
+    schedule_postprocessing(video, [kind])
+    failed = MediaAsset.objects.filter(blob_id=video.blob_id, kind=kind, state=MediaAsset.FAILED).first()
+    if failed is not None:
+        due = retry_at(failed)
+        if due is None:
+            return Response({'error': failed.error}, status=status.HTTP_404_NOT_FOUND)
+        retry_after = max(int((due - timezone.now()).total_seconds()) + 1, 1)
+        return Response({'message': message}, status=status.HTTP_202_ACCEPTED, headers={'Retry-After': retry_after})
+    return Response({'message': message}, status=status.HTTP_202_ACCEPTED)
+
+
+class VideoPreviewView(views.APIView):
+    def get(self, request, pk):
+        video = get_object_or_404(Video.objects.select_related('blob'), pk=pk)
+        asset = ready_asset(video, 'previews')
+        if asset is None:
+            if 'previews' not in settings.VIDEO_POSTPROCESS_STAGES or not video.blob_id:
+                return Response({'error': 'Previews are not available.'}, status=status.HTTP_404_NOT_FOUND)
+            return asset_pending(video, 'previews', 'Previews are being generated.')
+
+        def url(name):
+            return request.build_absolute_uri(reverse('video-preview-file', kwargs={'pk': pk, 'name': name}))
+
+        data = dict(asset.data)
+        data['poster_url'] = url(data['poster'])
+        data['vtt_url'] = url(data['vtt'])
+        data['sprite_urls'] = [url(name) for name in data['sprites']]
+        return Response(data)
+
+class VideoPreviewFileView(views.APIView):
+    def get(self, request, pk, name):
+        video = get_object_or_404(Video.objects.select_related('blob'), pk=pk)
+        asset = ready_asset(video, 'previews')
+        path = asset_file(asset, name) if asset else None
+        if path is None:
+            return Response({'error': 'Not found'}, status=status.HTTP_404_NOT_FOUND)
+        return serve_asset(request, asset, path)
+
+class VideoWaveformView(views.APIView):
+    def get(self, request, pk):
+        video = get_object_or_404(Video.objects.select_related('blob'), pk=pk)
+        asset = ready_asset(video, 'waveform')
+        if asset is None:
+            if 'waveform' not in settings.VIDEO_POSTPROCESS_STAGES or not video.blob_id:
+                return Response({'error': 'Waveform is not available.'}, status=status.HTTP_404_NOT_FOUND)
+            return asset_pending(video, 'waveform', 'Waveform is being generated.')
+
+        data = dict(asset.data)
+        peaks_url = request.build_absolute_uri(reverse('video-waveform-peaks', kwargs={'pk': pk}))
+        data['levels'] = [dict(level, url=f'{peaks_url}?level={index}') for index, level in enumerate(data['levels'])]
+        data['peaks_url'] = peaks_url
+        return Response(data)
+
+class VideoWaveformPeaksView(views.APIView):
+    """
+    Interleaved (min, max) pairs as raw little-endian int8 or int16, from the
+    coarsest level with at least `peaks` pairs between `start` and `end`, or
+    from the level given by `level`.
+    """
+    def get(self, request, pk):
+        video = get_object_or_404(Video.objects.select_related('blob'), pk=pk)
+        asset = ready_asset(video, 'waveform')
+        if asset is None:
+            return Response({'error': 'Not found'}, status=status.HTTP_404_NOT_FOUND)
+        data = asset.data
+        if not data['levels']:
+            return Response({'error': 'Video has no audio.'}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            start = max(float(request.query_params.get('start', 0)), 0)
+            end = min(float(request.query_params.get('end', data['duration'])), data['duration'])
+            peaks = min(max(int(request.query_params.get('peaks', 1000)), 1), 100000)
+            level = request.query_params.get('level')
+            level = data['levels'][int(level)] if level is not None else select_level(data, peaks, start, end)
+        except (ValueError, IndexError):
+            return Response({'error': 'Invalid waveform parameters.'}, status=status.HTTP_400_BAD_REQUEST)
+        if end <= start:
+            return Response({'error': 'End time must be greater than start time.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        path = asset_file(asset, level['file'])
+        if path is None:
+            return Response({'error': 'Not found'}, status=status.HTTP_404_NOT_FOUND)
+        first, content = read_peaks(path, data, level, start, end)
+        response = HttpResponse(content, content_type='application/octet-stream')
+        response['X-Waveform-Bits'] = data['bits']
+        response['X-Waveform-Sample-Rate'] = data['sample_rate']
+        response['X-Waveform-Samples-Per-Peak'] = level['samples_per_peak']
+        response['X-Waveform-Start'] = round(first * level['samples_per_peak'] / data['sample_rate'], 6)
+        # Content never changes for a video, its blob is fixed
+        response['Cache-Control'] = 'private, max-age=86400'
+        return response
 
 class ShareLinkView(views.APIView):
 
     def get(self, request, pk):
         serializer = URLSafeTimedSerializer('SECRET_KEY')
         token = serializer.dumps({'video_id': pk}, salt='share_video')
-        return Response({'link': f'http://0.0.0.0:8000/api/videos/stream/{pk}/{token}'}, status=status.HTTP_200_OK)
+        link = f'http://0.0.0.0:8000/api/videos/stream/{pk}/{token}'
+        data = {'link': link}
+
+        # Adaptive streaming once the renditions exist, sharing is what asks for them otherwise
+        if 'hls' in settings.VIDEO_POSTPROCESS_STAGES:
+            video = get_object_or_404(Video.objects.select_related('blob'), pk=pk)
+            if ready_asset(video, 'hls'):
+                data['hls'] = f'{link}/hls/master.m3u8'
+            else:
+                schedule_postprocessing(video, ['hls'])
+        return Response(data, status=status.HTTP_200_OK)
+
+class ProfileListView(views.APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({'profiles': list_profiles()})
+
+class ProfileDetailView(views.APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, name):
+        path = profile_path(name)
+        if path is None:
+            return Response({'error': 'Not found'}, status=status.HTTP_404_NOT_FOUND)
+        if 'top' not in request.query_params:
+            # The pstats file itself, for snakeviz, tuna or flameprof
+            return FileResponse(open(path, 'rb'), as_attachment=True, filename=name,
+                                content_type='application/octet-stream')
+
+        try:
+            top = min(max(int(request.query_params['top']), 1), 200)
+        except ValueError:
+            return Response({'error': 'top must be a number.'}, status=status.HTTP_400_BAD_REQUEST)
+        stats = pstats.Stats(path).sort_stats('cumulative')
+        functions = []
+        for function in stats.fcn_list[:top]:
+            _, calls, total, cumulative, _ = stats.stats[function]
+            filename, line, func = function
+            functions.append({'function': f'{filename}:{line}({func})', 'calls': calls,
+                              'total_time': round(total, 6), 'cumulative_time': round(cumulative, 6)})
+        return Response({'name': name, 'total_time': round(stats.total_tt, 6), 'functions': functions})
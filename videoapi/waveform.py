@@ -0,0 +1,119 @@
+# videoapi/waveform.py
+# Min/max peaks of the audio track at several resolutions for waveform displays,
+# from one decode pass. Every level is a file of interleaved (min, max) pairs, the
+# layout of BBC audiowaveform's data, so clients draw it without decoding audio.
+import math
+import os
+import subprocess
+import tempfile
+import numpy as np
+from django.conf import settings
+from imageio_ffmpeg import get_ffmpeg_exe
+from .media import MediaError, probe_streams
+
+# Blocks of peaks computed per read from ffmpeg
+READ_BLOCKS = 4096
+
+
+def block_peaks(samples, block):
+    """(mins, maxs) of every `block` samples, a shorter last block is padded with its last sample."""
+    count = -(-len(samples) // block)
+    padded = np.empty(count * block, dtype=samples.dtype)
+    padded[:len(samples)] = samples
+    padded[len(samples):] = samples[-1] if len(samples) else 0
+    blocks = padded.reshape(count, block)
+    return blocks.min(axis=1), blocks.max(axis=1)
+
+
+def halve(mins, maxs):
+    # Neighbouring pairs merged into one, an odd last pair is kept on its own
+    if len(mins) % 2:
+        mins, maxs = np.append(mins, mins[-1]), np.append(maxs, maxs[-1])
+    return mins.reshape(-1, 2).min(axis=1), maxs.reshape(-1, 2).max(axis=1)
+
+
+def peak_levels(mins, maxs, min_peaks):
+    """The finest level first, each next one with half as many peaks, down to `min_peaks`."""
+    levels = [(mins, maxs)]
+    while len(levels[-1][0]) > min_peaks:
+        levels.append(halve(*levels[-1]))
+    return levels
+
+
+def decode_peaks(src, sample_rate, block):
+    """Finest level peaks of the first audio stream mixed down to mono int16, and the number of samples."""
+    cmd = [get_ffmpeg_exe(), '-hide_banner', '-nostdin', '-i', src, '-map', '0:a:0', '-vn', '-ac', '1',
+           '-ar', str(sample_rate), '-f', 's16le', 'pipe:1']
+    mins, maxs, total = [], [], 0
+    with tempfile.TemporaryFile() as errors:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=errors)
+        try:
+            while True:
+                # Whole blocks except at the end of the stream, so peaks never straddle two reads
+                data = process.stdout.read(block * READ_BLOCKS * 2)
+                if len(data) < 2:
+                    break
+                samples = np.frombuffer(data[:len(data) // 2 * 2], dtype='<i2')
+                low, high = block_peaks(samples, block)
+                mins.append(low)
+                maxs.append(high)
+                total += len(samples)
+        finally:
+            process.stdout.close()
+            returncode = process.wait()
+        if returncode != 0:
+            errors.seek(0)
+            output = errors.read().decode('utf8', errors='replace').strip()
+            raise MediaError(output.splitlines()[-1] if output else 'ffmpeg failed')
+    if not total:
+        return None, None, 0
+    return np.concatenate(mins), np.concatenate(maxs), total
+
+
+def quantize(mins, maxs, bits):
+    # 8 bits keep the top byte of each sample, plenty for a display and half the size
+    dtype = np.int8 if bits == 8 else np.int16
+    pairs = np.empty(len(mins) * 2, dtype=dtype)
+    pairs[0::2] = mins >> 8 if bits == 8 else mins
+    pairs[1::2] = maxs >> 8 if bits == 8 else maxs
+    return pairs
+
+
+def build_waveform(src, out_dir):
+    rate, block, bits = settings.WAVEFORM_SAMPLE_RATE, settings.WAVEFORM_SAMPLES_PER_PEAK, settings.WAVEFORM_BITS
+    # A silent video has a waveform too, an empty one, there is nothing to retry
+    empty = {'audio': False, 'sample_rate': rate, 'bits': bits, 'channels': 0, 'duration': 0, 'levels': []}
+    if not probe_streams(src).get('audio'):
+        return empty
+    mins, maxs, samples = decode_peaks(src, rate, block)
+    if not samples:
+        return empty
+
+    levels = []
+    for index, (low, high) in enumerate(peak_levels(mins, maxs, settings.WAVEFORM_MIN_PEAKS)):
+        name = f'level_{index}.bin'
+        quantize(low, high, bits).tofile(os.path.join(out_dir, name))
+        samples_per_peak = block * 2 ** index
+        levels.append({'file': name, 'samples_per_peak': samples_per_peak,
+                       'peaks_per_second': round(rate / samples_per_peak, 4), 'length': len(low)})
+    return {'audio': True, 'sample_rate': rate, 'bits': bits, 'channels': 1, 'duration': round(samples / rate, 3),
+            'levels': levels}
+
+
+def select_level(data, peaks, start, end):
+    """The coarsest level with at least `peaks` pairs between `start` and `end` seconds, else the finest."""
+    for level in reversed(data['levels']):
+        if (end - start) * data['sample_rate'] / level['samples_per_peak'] >= peaks:
+            return level
+    return data['levels'][0]
+
+
+def read_peaks(path, data, level, start, end):
+    """Index of the first pair and the bytes of the pairs of `level` covering `start` to `end` seconds."""
+    per_second = data['sample_rate'] / level['samples_per_peak']
+    first = min(max(math.floor(start * per_second), 0), level['length'])
+    last = min(max(math.ceil(end * per_second), first), level['length'])
+    size = 2 * data['bits'] // 8
+    with open(path, 'rb') as handle:
+        handle.seek(first * size)
+        return first, handle.read((last - first) * size)
@@ -1,6 +1,7 @@
 from __future__ import absolute_import, unicode_literals
 import os
 from celery import Celery
+from celery.signals import celeryd_init
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'videoproject.settings')
 
@@ -10,6 +11,18 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 
 app.autodiscover_tasks()
 
+@celeryd_init.connect
+def set_queue_concurrency(sender=None, conf=None, options=None, **kwargs):
+    # A worker consuming a single video queue gets that queue's concurrency unless -c was given
+    queues = options.get('queues') or []
+    if isinstance(queues, str):
+        queues = queues.split(',')
+    if options.get('concurrency') is None and len(queues) == 1:
+        from django.conf import settings
+        concurrency = settings.VIDEO_QUEUE_CONCURRENCY.get(queues[0])
+        if concurrency:
+            conf.worker_concurrency = concurrency
+
 @app.task(bind=True)
 def debug_task(self):
     print(f'Request: {self.request!r}')
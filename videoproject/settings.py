@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 import os
+import tempfile
+from kombu import Queue
 from pathlib import Path
 from datetime import timedelta
 
@@ -48,6 +50,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'videoapi.metrics.metrics_middleware',
+    'videoapi.profiling.profiling_middleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -156,6 +160,76 @@ MEDIA_URL = '/media/'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Where videos and blobs are stored. Files stay under MEDIA_ROOT by default; to let
+# web and worker nodes share them without a shared filesystem, point 'default' at an
+# S3-compatible bucket (run `python manage.py objectstore` for a local one):
+#   'default': {'BACKEND': 'videoapi.storage.ObjectStorage', 'OPTIONS': {
+#       'endpoint_url': 'http://127.0.0.1:9000', 'bucket': 'videoverse',
+#       'access_key': 'videoverse', 'secret_key': '...'}},
+# Upload sessions and task outputs are staged under the local MEDIA_ROOT before they
+# are stored. HLS, preview and waveform assets are written under MEDIA_ROOT only, so with
+# object storage set VIDEO_POSTPROCESS_STAGES and DERIVED_POSTPROCESS_STAGES to [] (the
+# videoapi.E001 check stops the server otherwise).
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+# Workers keep local copies of objects they processed here, least recently used first out
+STORAGE_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'videoverse-storage-cache')
+STORAGE_CACHE_MAX_BYTES = 10 * 1024 * 1024 * 1024
+
+# Payloads of the video list and detail endpoints are cached in VIDEO_CACHE_ALIAS for
+# VIDEO_CACHE_TIMEOUT seconds. Invalidation only reaches processes that share the cache: the
+# file based default is shared by the web and Celery processes of one machine, with workers
+# on other machines use the Redis server Celery already needs, e.g.
+# CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://localhost:6379/1'}}
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'videoverse-cache'),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+VIDEO_CACHE_ALIAS = 'default'
+VIDEO_CACHE_TIMEOUT = 60
+
+# Prometheus metrics on /metrics. Each process writes its counters to METRICS_DIR at most
+# every METRICS_FLUSH_INTERVAL seconds, the view adds up the files of all of them. Files of
+# processes that have exited are merged into METRICS_DIR/archive.json when a process starts
+METRICS_DIR = os.path.join(tempfile.gettempdir(), 'videoverse-metrics')
+METRICS_FLUSH_INTERVAL = 5
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+METRICS_LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+METRICS_TASK_BUCKETS = [0.5, 1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600]
+
+# Opt-in cProfile runs written to PROFILE_DIR. Requests are profiled at PROFILE_SAMPLE_RATE or
+# when they send "X-Profile: <PROFILE_HEADER_TOKEN>", tasks when their name is in PROFILE_TASKS
+# ('*' for all). With PROFILING_ENABLED off none of it runs
+PROFILING_ENABLED = False
+PROFILE_DIR = os.path.join(tempfile.gettempdir(), 'videoverse-profiles')
+PROFILE_SAMPLE_RATE = 0.0
+PROFILE_HEADER_TOKEN = ''
+PROFILE_TASKS = []
+PROFILE_MAX_FILES = 200
+
+# Let the front proxy send stream, download and asset bodies: None (Django streams
+# them), 'x-accel-redirect' (nginx, see deploy/nginx.conf) or 'x-sendfile' (Apache
+# mod_xsendfile, lighttpd). The accel prefix is the proxy's internal location for MEDIA_ROOT.
+FILE_OFFLOAD = None
+FILE_OFFLOAD_ACCEL_PREFIX = '/protected-media/'
+
+# Bytes per read when Django sends a file itself, and the threads that do the
+# reads for async (ASGI) responses across all viewers of a process
+STREAM_CHUNK_SIZE = 64 * 1024
+STREAM_READ_THREADS = 32
+
+# Uploads are hashed while they are received so they can be stored by content
+FILE_UPLOAD_HANDLERS = [
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'videoapi.uploads.HashingTemporaryFileUploadHandler',
+]
+
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
 CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
 CELERY_ACCEPT_CONTENT = ['json']
@@ -163,3 +237,119 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
 
+# Stream copies, re-encodes and re-encoding merges each get their own queue and worker
+# pool (see videoapi/scheduling.py). Start one worker per queue, e.g.
+#   celery -A videoproject worker -Q fast -n fast@%h
+# and its concurrency defaults to VIDEO_QUEUE_CONCURRENCY for that queue.
+CPU_COUNT = os.cpu_count() or 1
+VIDEO_QUEUE_CONCURRENCY = {
+    'celery': 1,
+    'fast': CPU_COUNT * 2,  # mostly waiting on disk
+    'encode': max(CPU_COUNT // 2, 1),  # x264 already spreads one encode over several cores
+    'merge': max(CPU_COUNT // 4, 1),
+}
+CELERY_TASK_QUEUES = [
+    Queue(name, routing_key=name, queue_arguments={'x-max-priority': 10}) for name in VIDEO_QUEUE_CONCURRENCY
+]
+CELERY_TASK_DEFAULT_QUEUE = 'celery'
+CELERY_TASK_ROUTES = {
+    'videoapi.tasks.trim_video_task': {'queue': 'encode'},
+    'videoapi.tasks.batch_trim_video_task': {'queue': 'encode'},
+    'videoapi.tasks.merge_videos_task': {'queue': 'merge'},
+}
+# Redis honours all ten priority levels, 0 is served first
+CELERY_BROKER_TRANSPORT_OPTIONS = {'queue_order_strategy': 'priority', 'priority_steps': list(range(10))}
+CELERY_TASK_DEFAULT_PRIORITY = 5
+# Long jobs must not be reserved by a busy worker while another one is idle
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_TASK_ACKS_LATE = True
+
+# Seconds of worker time per second of 720p media, used to estimate job cost
+JOB_COST_RATES = {'overhead': 1.0, 'copy': 0.01, 'decode': 0.05, 'encode': 0.4}
+# Beat keeps its schedule in the database (django_celery_beat), the entries below are
+# created there on start and can be changed or paused from the admin afterwards
+CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
+CELERY_BEAT_SCHEDULE = {
+    'evict-derived-videos': {
+        'task': 'videoapi.tasks.evict_derived_videos',
+        'schedule': 60 * 60,
+    },
+    'reclaim-storage': {
+        'task': 'videoapi.tasks.reclaim_storage_task',
+        'schedule': 60 * 60,
+    },
+}
+# Files without a referencing row are only swept once they are this old, so outputs
+# of running tasks and uploads in progress are never touched
+RECLAIM_ORPHAN_MIN_AGE = 24 * 60 * 60
+# Bulk video operations run their statements on this many videos at a time
+BULK_BATCH_SIZE = 500
+
+# Fast trims snap the start of a cut to a keyframe this many seconds away
+TRIM_KEYFRAME_TOLERANCE = 0.5
+# Upper bound on the ranges a single batch trim request may cut
+BATCH_TRIM_MAX_SEGMENTS = 50
+
+# Encoder settings for re-encoding trims and merges, picked per request by name with "profile".
+# crf takes precedence over video_bitrate, threads 0 leaves the thread count to the encoder
+ENCODING_PROFILES = {
+    'fast-preview': {'codec': 'libx264', 'preset': 'ultrafast', 'crf': 30, 'threads': 0, 'pix_fmt': 'yuv420p',
+                     'audio_codec': 'aac', 'audio_bitrate': 96000},
+    'balanced': {'codec': 'libx264', 'preset': 'medium', 'crf': 23, 'threads': 0, 'pix_fmt': 'yuv420p',
+                 'audio_codec': 'aac', 'audio_bitrate': 128000},
+    'archive': {'codec': 'libx264', 'preset': 'slow', 'crf': 18, 'threads': 0, 'pix_fmt': 'yuv420p',
+                'audio_codec': 'aac', 'audio_bitrate': 192000},
+}
+DEFAULT_ENCODING_PROFILE = 'balanced'
+
+# Re-encoding merges at least this many seconds long are encoded in parallel chunks, shorter ones
+# decode one input at a time into a single encoder
+MERGE_PARALLEL_MIN_DURATION = 30
+MERGE_CHUNK_SECONDS = 10
+# Concurrent chunk encodes per merge, None uses every core
+MERGE_PARALLEL_WORKERS = None
+
+# Server-sent job events: database poll interval, keep-alive interval and stream lifetime in seconds
+JOB_EVENTS_POLL_INTERVAL = 0.5
+JOB_EVENTS_HEARTBEAT = 15
+JOB_EVENTS_TIMEOUT = 600
+
+# Trim/merge outputs are cached, idle ones are evicted after DERIVED_CACHE_MAX_IDLE seconds and
+# the least recently used ones once the cache grows past DERIVED_CACHE_MAX_BYTES. Eviction drops the
+# cache's reference on the file only, the videos handed out from it are left alone
+DERIVED_CACHE_MAX_BYTES = 20 * 1024 ** 3
+DERIVED_CACHE_MAX_IDLE = 14 * 24 * 60 * 60
+
+# Post-upload stages, each builds files shared by every video with the same content:
+#   'hls' - fMP4 HLS renditions plus a master playlist, served under the signed stream link
+#   'previews' - poster, thumbnail sprites with a WebVTT map and scene scores, served by videos/<id>/previews/
+#   'waveform' - min/max audio peaks at several resolutions, served by videos/<id>/waveform/
+VIDEO_POSTPROCESS_STAGES = ['previews', 'waveform']
+# Stages the trim and merge tasks run themselves on the videos they write, so they are ready with the job
+DERIVED_POSTPROCESS_STAGES = ['waveform']
+# A failed stage is built again when it is next asked for, POSTPROCESS_RETRY_DELAY seconds after the
+# failure and twice as long after each further one, at most POSTPROCESS_MAX_ATTEMPTS times in all
+POSTPROCESS_MAX_ATTEMPTS = 3
+POSTPROCESS_RETRY_DELAY = 60
+HLS_SEGMENT_SECONDS = 4
+# Rungs taller than the source are skipped, the source resolution is always added as 'original'
+HLS_RENDITIONS = [
+    {'name': '360p', 'height': 360, 'video_bitrate': 800000, 'audio_bitrate': 96000},
+    {'name': '720p', 'height': 720, 'video_bitrate': 2800000, 'audio_bitrate': 128000},
+]
+
+# Preview frames are sampled every PREVIEW_INTERVAL seconds, less often when that would exceed PREVIEW_MAX_SAMPLES
+PREVIEW_INTERVAL = 2
+PREVIEW_MAX_SAMPLES = 600
+PREVIEW_THUMB_WIDTH = 160
+PREVIEW_SPRITE_COLUMNS = 10
+PREVIEW_SPRITE_ROWS = 10
+PREVIEW_POSTER_WIDTH = 1280
+
+# Waveform audio is mixed to mono at WAVEFORM_SAMPLE_RATE. The finest level has one min/max pair
+# per WAVEFORM_SAMPLES_PER_PEAK samples, each next level half as many, down to WAVEFORM_MIN_PEAKS
+# pairs. WAVEFORM_BITS is 8 or 16 per value.
+WAVEFORM_SAMPLE_RATE = 11025
+WAVEFORM_SAMPLES_PER_PEAK = 64
+WAVEFORM_MIN_PEAKS = 256
+WAVEFORM_BITS = 8